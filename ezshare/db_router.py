@@ -0,0 +1,109 @@
+"""
+Read-replica routing with read-your-writes stickiness.
+
+ReplicaMiddleware opens a routing scope per request. Inside it, reads go to
+one of DATABASE_REPLICAS (picked once per request) unless:
+
+- the request has already written, or is inside a transaction on the primary;
+- the client wrote within the last REPLICA_PIN_SECONDS, which the middleware
+  remembers with a short-lived cookie so it needs no lookup of its own.
+
+Everything outside a request (management commands, worker threads) and every
+write uses the primary.
+"""
+
+import time
+import random
+import contextvars
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+DATABASE_REPLICAS = getattr(settings, 'DATABASE_REPLICAS', [])
+REPLICA_PIN_SECONDS = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+PIN_COOKIE = 'ezshare_primary_until'
+
+_routing = contextvars.ContextVar('ezshare_db_routing', default=None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is None or state['wrote'] or state['replica'] is None:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return state['replica']
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            # Mutated rather than set, so writes in sync_to_async threads count too.
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *DATABASE_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary.
+        return db not in DATABASE_REPLICAS
+
+
+class ReplicaMiddleware:
+    """Scope replica reads to the request and pin recent writers to the primary.
+
+    Goes before SessionMiddleware so session and user lookups are routed too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.finish(state, response)
+
+    async def __acall__(self, request):
+        state, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.finish(state, response)
+
+    def start(self, request):
+        try:
+            pinned = float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        state = {
+            'replica': random.choice(DATABASE_REPLICAS) if DATABASE_REPLICAS and not pinned else None,
+            'wrote': False,
+        }
+        return state, _routing.set(state)
+
+    def finish(self, state, response):
+        # Streamed bodies may still query after this point; they stay on the
+        # primary, since the routing scope has ended.
+        if state['wrote'] and DATABASE_REPLICAS:
+            response.set_cookie(
+                PIN_COOKIE, str(time.time() + REPLICA_PIN_SECONDS),
+                max_age=REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+                secure=settings.SESSION_COOKIE_SECURE,
+            )
+        return response
@@ -0,0 +1,311 @@
+"""
+Per-route request metrics: Server-Timing headers and a Prometheus /metrics view.
+
+Each process keeps its own histograms and counters. When METRICS_DIR is set,
+every process also writes a JSON snapshot there (at most once per
+METRICS_WRITE_INTERVAL seconds and at exit), and /metrics sums every snapshot
+in the directory, so any gunicorn worker can answer for all of them. Gauges
+are only summed for workers still running.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+import logging
+import contextvars
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from .query_budget import query_budget, budget_for, view_name
+
+
+METRICS_DIR = getattr(settings, 'METRICS_DIR', None)
+METRICS_WRITE_INTERVAL = getattr(settings, 'METRICS_WRITE_INTERVAL', 1.0)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+HISTOGRAMS = {
+    'ezshare_view_seconds': ('Time spent in the view and middleware below it.', SECONDS_BUCKETS),
+    'ezshare_db_seconds': ('Time spent executing SQL per request.', SECONDS_BUCKETS),
+    'ezshare_db_queries': ('SQL queries executed per request.', QUERY_BUCKETS),
+}
+# name -> (help, label); the label defaults to route.
+COUNTERS = {
+    'ezshare_response_bytes_total': ('Response body bytes sent, including streamed bodies.', 'route'),
+    'ezshare_query_budget_exceeded_total': ('Requests that ran more queries than their view allows.', 'route'),
+    'ezshare_storage_cache_total': ('Shared storage local cache lookups and evictions.', 'result'),
+    'ezshare_db_pool_waits_total': ('Connection checkouts that had to wait for a free connection.', 'pool'),
+    'ezshare_db_pool_timeouts_total': ('Connection checkouts that gave up waiting.', 'pool'),
+}
+# name -> (help, labels); the label value is the labels' values joined by ':'.
+GAUGES = {
+    'ezshare_db_pool_connections': ('Pooled database connections by state.', ('pool', 'state')),
+}
+
+logger = logging.getLogger(__name__)
+
+_request_stats = contextvars.ContextVar('ezshare_request_stats', default=None)
+
+
+def process_alive(pid):
+    try:
+        pid = int(pid)
+        if pid <= 0:
+            return False
+        os.kill(pid, 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        # Running, as another user.
+        pass
+    return True
+
+
+class MetricsStore:
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.last_write = 0.0
+
+    def observe(self, name, route, value):
+        buckets = HISTOGRAMS[name][1]
+        with self.lock:
+            series = self.histograms.setdefault(f'{name}|{route}', {
+                'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0,
+            })
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def inc(self, name, label, amount=1):
+        with self.lock:
+            key = f'{name}|{label}'
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, label, value):
+        with self.lock:
+            self.gauges[f'{name}|{label}'] = value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'histograms': json.loads(json.dumps(self.histograms)),
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+            }
+
+    def persist(self, force=False):
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_write < METRICS_WRITE_INTERVAL:
+            return
+        self.last_write = now
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def collect(self):
+        """Merge this process's series with every other process's snapshot."""
+        snapshots = [self.snapshot()]
+        if self.directory and os.path.isdir(self.directory):
+            own = f'metrics-{os.getpid()}.json'
+            for name in os.listdir(self.directory):
+                if not name.startswith('metrics-') or not name.endswith('.json') or name == own:
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                # Counters of exited workers still count; their gauges describe
+                # connections that no longer exist.
+                if not process_alive(name[len('metrics-'):-len('.json')]):
+                    snapshot['gauges'] = {}
+                snapshots.append(snapshot)
+        merged = {'histograms': {}, 'counters': {}, 'gauges': {}}
+        for snapshot in snapshots:
+            for key, series in snapshot['histograms'].items():
+                total = merged['histograms'].setdefault(key, {
+                    'buckets': [0] * len(series['buckets']), 'sum': 0.0, 'count': 0,
+                })
+                total['buckets'] = [a + b for a, b in zip(total['buckets'], series['buckets'])]
+                total['sum'] += series['sum']
+                total['count'] += series['count']
+            for key, value in snapshot['counters'].items():
+                merged['counters'][key] = merged['counters'].get(key, 0) + value
+            # Gauges add up across processes, e.g. connections in use by all workers.
+            for key, value in snapshot.get('gauges', {}).items():
+                merged['gauges'][key] = merged['gauges'].get(key, 0) + value
+        return merged
+
+
+store = MetricsStore(METRICS_DIR)
+atexit.register(store.persist, force=True)
+
+
+def _count_query(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats['queries'] += 1
+        stats['db'] += time.perf_counter() - start
+
+
+def install_query_counter(sender, connection, **kwargs):
+    # Installed on every connection, including ones opened in sync_to_async
+    # threads; the context variable ties each query to the current request.
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(install_query_counter)
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match.url_name if match else None) or 'unmatched'
+
+
+def record_bytes(route, amount):
+    store.inc('ezshare_response_bytes_total', route, amount)
+    store.persist()
+
+
+def counted(content, route):
+    sent = 0
+    try:
+        for chunk in content:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        record_bytes(route, sent)
+
+
+async def acounted(content, route):
+    sent = 0
+    try:
+        async for chunk in content:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        record_bytes(route, sent)
+
+
+class MetricsMiddleware:
+    """Record query count, DB time, view time and bytes sent per route name.
+
+    Should be first in MIDDLEWARE so it times everything below it.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        for connection in connections.all(initialized_only=True):
+            install_query_counter(None, connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = {'queries': 0, 'db': 0.0}
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = {'queries': 0, 'db': 0.0}
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    def finish(self, request, response, stats, elapsed):
+        route = route_name(request)
+        store.observe('ezshare_view_seconds', route, elapsed)
+        store.observe('ezshare_db_seconds', route, stats['db'])
+        store.observe('ezshare_db_queries', route, stats['queries'])
+        match = getattr(request, 'resolver_match', None)
+        budget = budget_for(match.func) if match else None
+        if budget is not None and stats['queries'] > budget:
+            store.inc('ezshare_query_budget_exceeded_total', route)
+            logger.warning('%s ran %d queries, budget is %d.', view_name(match.func), stats['queries'], budget)
+        response['Server-Timing'] = (
+            f'db;dur={stats["db"] * 1000:.2f};desc="{stats["queries"]} queries", '
+            f'view;dur={elapsed * 1000:.2f}'
+        )
+
+        if not response.streaming:
+            record_bytes(route, len(response.content))
+        elif getattr(response, 'file_to_stream', None) is not None and response.has_header('Content-Length'):
+            # Leave FileResponse untouched so wsgi.file_wrapper can still sendfile().
+            record_bytes(route, int(response['Content-Length']))
+        elif response.is_async:
+            response.streaming_content = acounted(response.streaming_content, route)
+        else:
+            response.streaming_content = counted(response.streaming_content, route)
+        return response
+
+
+def _labels(key):
+    name, route = key.split('|', 1)
+    return name, route.replace('\\', '\\\\').replace('"', '\\"')
+
+
+@query_budget(0)
+def metrics_view(request):
+    """Prometheus text exposition of the merged metrics of every process."""
+    merged = store.collect()
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for key, series in sorted(merged['histograms'].items()):
+            series_name, route = _labels(key)
+            if series_name != name:
+                continue
+            for bound, count in zip(buckets, series['buckets']):
+                lines.append(f'{name}_bucket{{route="{route}",le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{route="{route}",le="+Inf"}} {series["count"]}')
+            lines.append(f'{name}_sum{{route="{route}"}} {series["sum"]}')
+            lines.append(f'{name}_count{{route="{route}"}} {series["count"]}')
+    for name, (help_text, label) in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for key, value in sorted(merged['counters'].items()):
+            series_name, label_value = _labels(key)
+            if series_name == name:
+                lines.append(f'{name}{{{label}="{label_value}"}} {value}')
+    for name, (help_text, labels) in GAUGES.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        for key, value in sorted(merged['gauges'].items()):
+            series_name, label_value = _labels(key)
+            if series_name == name:
+                pairs = ','.join(f'{label}="{v}"' for label, v in zip(labels, label_value.split(':')))
+                lines.append(f'{name}{{{pairs}}} {value}')
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,67 @@
+"""
+The MySQL backend with an in-process connection pool.
+
+Set ``'ENGINE': 'ezshare.mysql_pool'`` and pool limits under
+``OPTIONS['pool']`` (see ezshare.mysql_pool.pool.ConnectionPool). Django
+still "opens" and "closes" a connection per request; here that checks one
+out of the pool and returns it, skipping the TCP and auth handshake.
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.mysql import base
+from .pool import ConnectionPool, get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # Pool limits are ours, not connect() arguments.
+        params.pop('pool', None)
+        return params
+
+    @property
+    def pool(self):
+        # Keyed by database name too: the test runner renames the database in place.
+        return get_pool((self.alias, self.settings_dict['NAME']), self.create_pool)
+
+    def create_pool(self):
+        if self.settings_dict['CONN_MAX_AGE'] != 0:
+            raise ImproperlyConfigured("Pooled connections are returned after each request; set CONN_MAX_AGE to 0.")
+        params = self.get_connection_params()
+        return ConnectionPool(
+            lambda: base.DatabaseWrapper.get_new_connection(self, params),
+            name=self.alias,
+            pre_ping=self.settings_dict['CONN_HEALTH_CHECKS'],
+            reset=reset_connection,
+            **self.settings_dict['OPTIONS']['pool']
+        )
+
+    def get_new_connection(self, conn_params):
+        return self.pool.acquire()
+
+    def init_connection_state(self):
+        # Session variables survive in the pool, so set them once per connection.
+        if getattr(self.connection, 'ezshare_initialized', False):
+            return
+        super().init_connection_state()
+        self.connection.ezshare_initialized = True
+
+    def _set_autocommit(self, autocommit):
+        # Reused connections are already in autocommit mode; skip the round trip.
+        if self.connection.get_autocommit() != autocommit:
+            super()._set_autocommit(autocommit)
+
+    def _close(self):
+        if self.connection is not None:
+            # A connection that raised is only kept if it still answers. One
+            # closed inside atomic() stays attached to this wrapper, so it
+            # must not be handed to anyone else.
+            broken = self.in_atomic_block or (self.errors_occurred and not self.is_usable())
+            self.pool.release(self.connection, discard=broken)
+
+
+def reset_connection(conn):
+    """Leave no open transaction behind, e.g. after a close inside atomic()."""
+    if not conn.get_autocommit():
+        conn.rollback()
+        conn.autocommit(True)
@@ -0,0 +1,174 @@
+import time
+import atexit
+import logging
+import threading
+from django.db.utils import OperationalError
+from ezshare import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(OperationalError):
+    """No connection became free within the pool's timeout."""
+
+
+class ConnectionPool:
+    """A thread-safe pool of DB-API connections.
+
+    Keeps up to ``size`` idle connections and opens up to ``max_overflow``
+    more under load; those are closed when returned instead of kept.
+    Connections older than ``recycle`` seconds are replaced on checkout so
+    the server's wait_timeout never closes one under us. With ``pre_ping``,
+    every reused connection is pinged on checkout and replaced if dead.
+    Once ``size + max_overflow`` connections are out, ``acquire`` waits up
+    to ``timeout`` seconds and then raises PoolTimeout.
+    """
+
+    def __init__(self, connect, name='default', size=5, max_overflow=10, recycle=3600, timeout=30,
+                 pre_ping=False, ping=None, reset=None):
+        self.connect = connect
+        self.name = name
+        self.size = size
+        self.max_overflow = max_overflow
+        self.recycle = recycle
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        self.ping = ping or (lambda conn: conn.ping())
+        self.reset = reset or (lambda conn: conn.rollback())
+        self.condition = threading.Condition()
+        # (connection, opened_at) pairs, most recently returned last.
+        self.idle = []
+        self.opened_at = {}
+        self.in_use = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    @property
+    def opened(self):
+        return self.in_use + len(self.idle)
+
+    def acquire(self):
+        """Check a connection out, reusing an idle one when possible."""
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        with self.condition:
+            while not self.idle and self.opened >= self.size + self.max_overflow:
+                if not waited:
+                    waited = True
+                    self.waits += 1
+                    metrics.store.inc('ezshare_db_pool_waits_total', self.name)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.condition.wait(remaining):
+                    if self.idle or self.opened < self.size + self.max_overflow:
+                        break
+                    self.timeouts += 1
+                    metrics.store.inc('ezshare_db_pool_timeouts_total', self.name)
+                    raise PoolTimeout(
+                        f"No connection free in pool {self.name!r} after {self.timeout}s "
+                        f"({self.in_use} in use)."
+                    )
+            conn, opened_at = self.idle.pop() if self.idle else (None, None)
+            self.in_use += 1
+            self.publish()
+
+        try:
+            if conn is not None and not self.usable(conn, opened_at):
+                self.discard(conn)
+                conn = None
+            if conn is None:
+                conn = self.connect()
+                self.opened_at[id(conn)] = time.monotonic()
+        except BaseException:
+            self.cancel_checkout()
+            raise
+        return conn
+
+    def usable(self, conn, opened_at):
+        if self.recycle is not None and time.monotonic() - opened_at > self.recycle:
+            return False
+        if not self.pre_ping:
+            return True
+        try:
+            self.ping(conn)
+        except Exception:
+            logger.info("Replacing dead connection in pool %r.", self.name)
+            return False
+        return True
+
+    def release(self, conn, discard=False):
+        """Return ``conn``; it is closed instead if broken or over the pool size."""
+        opened_at = self.opened_at.get(id(conn))
+        if not discard:
+            try:
+                self.reset(conn)
+            except Exception:
+                discard = True
+        with self.condition:
+            keep = not discard and opened_at is not None and len(self.idle) < self.size
+            if keep:
+                self.idle.append((conn, opened_at))
+            self.in_use -= 1
+            self.publish()
+            self.condition.notify()
+        if not keep:
+            self.discard(conn)
+
+    def cancel_checkout(self):
+        with self.condition:
+            self.in_use -= 1
+            self.publish()
+            self.condition.notify()
+
+    def discard(self, conn):
+        self.opened_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Close every idle connection; checked-out ones close when returned."""
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.size = 0
+            self.publish()
+        for conn, _ in idle:
+            self.discard(conn)
+
+    def publish(self):
+        # Called with the condition held.
+        metrics.store.set('ezshare_db_pool_connections', f'{self.name}:in_use', self.in_use)
+        metrics.store.set('ezshare_db_pool_connections', f'{self.name}:idle', len(self.idle))
+
+    def stats(self):
+        with self.condition:
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'in_use': self.in_use,
+                'idle': len(self.idle),
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+            }
+
+
+pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, factory):
+    """The process-wide pool for ``key``, created by ``factory()`` on first use."""
+    pool = pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = pools.get(key)
+            if pool is None:
+                pool = pools[key] = factory()
+    return pool
+
+
+@atexit.register
+def close_pools():
+    for pool in list(pools.values()):
+        pool.close()
@@ -0,0 +1,91 @@
+"""
+Per-view query budgets.
+
+Views declare the most SQL queries one request may run with ``@query_budget(n)``.
+The budget covers the whole request (session, user and role lookups included)
+and must not grow with the number of rows involved. ``MetricsMiddleware`` logs
+and counts requests that go over; ``QueryBudgetTestMixin`` fails the test.
+"""
+
+import contextvars
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+_captured = contextvars.ContextVar('query_budget_captured', default=None)
+
+
+def query_budget(max_queries):
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def budget_for(view):
+    return getattr(view, 'query_budget', None)
+
+
+def view_name(view):
+    return f'{view.__module__}.{view.__qualname__}'
+
+
+def _capture_query(execute, sql, params, many, context):
+    captured = _captured.get()
+    if captured is not None:
+        captured.append(sql)
+    return execute(sql, params, many, context)
+
+
+def install_query_capture(sender, connection, **kwargs):
+    # A context variable rather than CaptureQueriesContext, because async views
+    # query from sync_to_async threads with their own connections.
+    if _capture_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_capture_query)
+
+
+connection_created.connect(install_query_capture)
+
+
+class QueryBudgetTestMixin:
+    """``TestCase`` helpers that run a request and compare its queries against
+    the budget declared by the view that handled it. Streamed bodies are read
+    inside the capture so queries issued while streaming count too."""
+
+    def _start_capture(self):
+        for connection in connections.all(initialized_only=True):
+            install_query_capture(None, connection)
+        captured = []
+        return captured, _captured.set(captured)
+
+    def assertWithinQueryBudget(self, send, *args, **kwargs):
+        captured, token = self._start_capture()
+        try:
+            response = send(*args, **kwargs)
+            if response.streaming:
+                response.consumed_content = b''.join(response.streaming_content)
+                response.close()
+        finally:
+            _captured.reset(token)
+        self._check_budget(response, captured)
+        return response
+
+    async def aassertWithinQueryBudget(self, send, *args, **kwargs):
+        captured, token = self._start_capture()
+        try:
+            response = await send(*args, **kwargs)
+            if response.streaming:
+                response.consumed_content = b''.join([chunk async for chunk in response.streaming_content])
+        finally:
+            _captured.reset(token)
+        self._check_budget(response, captured)
+        return response
+
+    def _check_budget(self, response, captured):
+        view = response.resolver_match.func
+        budget = budget_for(view)
+        if budget is None:
+            self.fail(f'{view_name(view)} declares no query budget.')
+        if len(captured) > budget:
+            sql = '\n'.join(f'  {query}' for query in captured)
+            self.fail(f'{view_name(view)} ran {len(captured)} queries, budget is {budget}:\n{sql}')
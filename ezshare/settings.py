@@ -48,11 +48,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ezshare.metrics.MetricsMiddleware',
+    'ezshare.db_router.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     # 'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'user_auth.middleware.RoleMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -80,17 +83,72 @@ WSGI_APPLICATION = 'ezshare.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# DB_ENGINE=django.db.backends.sqlite3 with DB_NAME as a file path runs
+# without a MySQL server, e.g. for local tests.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': os.environ.get('DB_ENGINE', 'django.db.backends.mysql'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASSWORD'),
         'HOST': os.environ.get('DB_HOST', 'localhost'),
         'PORT': os.environ.get('DB_PORT', '3306'),
+        # Seconds to keep a connection open across requests (0 closes it after
+        # each request, 'None' keeps it forever); health checks ping a reused
+        # connection before its first query in a request.
+        'CONN_MAX_AGE': None if os.environ.get('DB_CONN_MAX_AGE') == 'None' else int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', 'False') == 'True',
     }
 }
 
+# In-process connection pool (see ezshare.mysql_pool); replaces persistent
+# connections, so DB_CONN_MAX_AGE must stay 0. DB_POOL_SIZE=0 disables it.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0))
+if DB_POOL_SIZE:
+    DATABASES['default']['ENGINE'] = 'ezshare.mysql_pool'
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'size': DB_POOL_SIZE,
+            'max_overflow': int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10)),
+            'recycle': int(os.environ.get('DB_POOL_RECYCLE', 3600)),
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        },
+    }
+
+# Read replicas (see ezshare.db_router). DB_REPLICA_HOSTS is a comma-separated
+# list of hosts replicating DB_NAME, DB_REPLICA_NAMES one of database names
+# (file paths for SQLite) for replicas under a name of their own; set both
+# and they pair up by position. Each replica becomes a replica_<n> alias.
+# Reads inside requests go to a replica, except for REPLICA_PIN_SECONDS after
+# the same client wrote. In tests, a replica of DB_NAME mirrors the test
+# database, while one with its own name gets its own, empty, test database.
+replica_hosts = [host.strip() for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+replica_names = [name.strip() for name in os.environ.get('DB_REPLICA_NAMES', '').split(',') if name.strip()]
+DATABASE_REPLICAS = []
+for n in range(max(len(replica_hosts), len(replica_names))):
+    replica = {**DATABASES['default']}
+    if n < len(replica_hosts):
+        replica['HOST'] = replica_hosts[n]
+    if n < len(replica_names):
+        replica['NAME'] = replica_names[n]
+    replica['TEST'] = {'MIRROR': 'default'} if replica['NAME'] == DATABASES['default']['NAME'] else {}
+    DATABASES[f'replica_{n + 1}'] = replica
+    DATABASE_REPLICAS.append(f'replica_{n + 1}')
+DATABASE_ROUTERS = ['ezshare.db_router.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+
+
+AUTHENTICATION_BACKENDS = [
+    'user_auth.backends.EmailBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Serve the native async views when running under ASGI (uvicorn/daphne).
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
+
+# Threads that run password hashing for async logins; defaults to the CPU count.
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0)) or None
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -142,9 +200,113 @@ SESSION_COOKIE_HTTPONLY = True
 
 
 
+# Cache shared by every worker, used for sessions and the user/role cache.
+# e.g. CACHE_BACKEND=django.core.cache.backends.redis.RedisCache with
+# CACHE_LOCATION=redis://127.0.0.1:6379/1 (needs the redis package), or
+# django.core.cache.backends.filebased.FileBasedCache with a directory on
+# one host. The default is a per-process memory cache.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+# 'django.contrib.sessions.backends.cached_db' (or '.cache') skips the
+# django_session query once the session is cached; needs a shared CACHE_BACKEND.
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.db')
+
+# Seconds a resolved user role, and an authenticated User with its role,
+# stay in the cache (see user_auth.roles).
+ROLE_CACHE_TIMEOUT = int(os.environ.get('ROLE_CACHE_TIMEOUT', 300))
+USER_CACHE_TIMEOUT = int(os.environ.get('USER_CACHE_TIMEOUT', 300))
+
+# /api/list/ keyset pagination and streaming (see share.views.list_files).
+LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', 100))
+LIST_MAX_PAGE_SIZE = int(os.environ.get('LIST_MAX_PAGE_SIZE', 1000))
+LIST_STREAM_CHUNK_SIZE = int(os.environ.get('LIST_STREAM_CHUNK_SIZE', 2000))
+
+# Upper bound on ranges honoured in a single Range header (see share.ranges).
+DOWNLOAD_MAX_RANGES = int(os.environ.get('DOWNLOAD_MAX_RANGES', 16))
+
+# How secure_download delivers bytes: 'django' streams from the worker,
+# 'nginx' uses X-Accel-Redirect into DOWNLOAD_ACCEL_PREFIX, 'sendfile'
+# uses X-Sendfile (Apache mod_xsendfile, lighttpd).
+DOWNLOAD_BACKEND = os.environ.get('DOWNLOAD_BACKEND', 'django')
+DOWNLOAD_ACCEL_PREFIX = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/protected/')
+
+# Write-behind batching of File.last_opened (see share.access_log).
+LAST_OPENED_FLUSH_INTERVAL = int(os.environ.get('LAST_OPENED_FLUSH_INTERVAL', 30))
+LAST_OPENED_MAX_STALENESS = int(os.environ.get('LAST_OPENED_MAX_STALENESS', 120))
+LAST_OPENED_MAX_PENDING = int(os.environ.get('LAST_OPENED_MAX_PENDING', 1000))
+
+# Chunked upload sessions (see share.uploads).
+UPLOAD_MAX_CHUNK_SIZE = int(os.environ.get('UPLOAD_MAX_CHUNK_SIZE', 8 * 1024 * 1024))
+UPLOAD_MAX_FILE_SIZE = int(os.environ.get('UPLOAD_MAX_FILE_SIZE', 1024 * 1024 * 1024))
+
+# Deduplicate uploads by SHA-256 into shared, reference-counted blobs (see share.blobs).
+CONTENT_ADDRESSED_STORAGE = os.environ.get('CONTENT_ADDRESSED_STORAGE', 'False') == 'True'
+
+# Shared file storage for multi-node deployments (see share.storage). Files
+# live in SHARED_STORAGE_BACKEND, any Django storage class, e.g. a network
+# mount ('django.core.files.storage.FileSystemStorage' with
+# SHARED_STORAGE_LOCATION) or S3 ('storages.backends.s3.S3Storage' from
+# django-storages, configured by its AWS_* settings). Each node keeps recently
+# read files in STORAGE_CACHE_DIR, evicted past STORAGE_CACHE_MAX_BYTES.
+SHARED_STORAGE_BACKEND = os.environ.get('SHARED_STORAGE_BACKEND') or None
+SHARED_STORAGE_LOCATION = os.environ.get('SHARED_STORAGE_LOCATION') or None
+STORAGE_CACHE_DIR = os.environ.get('STORAGE_CACHE_DIR', str(BASE_DIR / 'media-cache'))
+STORAGE_CACHE_MAX_BYTES = int(os.environ.get('STORAGE_CACHE_MAX_BYTES', 10 * 1024 ** 3))
+if SHARED_STORAGE_BACKEND:
+    STORAGES = {
+        'default': {
+            'BACKEND': 'share.storage.CachedStorage',
+            'OPTIONS': {
+                'location': STORAGE_CACHE_DIR,
+                'remote_backend': SHARED_STORAGE_BACKEND,
+                'remote_options': {'location': SHARED_STORAGE_LOCATION} if SHARED_STORAGE_LOCATION else {},
+                'max_size': STORAGE_CACHE_MAX_BYTES,
+            },
+        },
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    }
+
+# Threads extracting document metadata after upload (see share.processing);
+# 0 extracts inline when the upload commits.
+POST_UPLOAD_WORKERS = int(os.environ.get('POST_UPLOAD_WORKERS', 2))
+
+# Largest batch accepted by /api/download-links/.
+BULK_LINK_MAX_FILES = int(os.environ.get('BULK_LINK_MAX_FILES', 500))
+
+# Largest number of files in one streamed ZIP bundle (see share.bundles).
+BUNDLE_MAX_FILES = int(os.environ.get('BUNDLE_MAX_FILES', 200))
+
+# Download link signing (see share.tokens). FERNET_KEYS is a comma-separated
+# keyring: the first key signs, all keys verify. Without keys, one is derived
+# from SECRET_KEY so links work across every worker and node.
+FERNET_KEYS = [key for key in os.environ.get('FERNET_KEYS', os.environ.get('FERNET_KEY', '')).split(',') if key]
+DOWNLOAD_SIGNING_KEYS = [key for key in os.environ.get('DOWNLOAD_SIGNING_KEYS', '').split(',') if key]
+DOWNLOAD_TOKEN_FORMAT = os.environ.get('DOWNLOAD_TOKEN_FORMAT', 'fernet')
+DOWNLOAD_TOKEN_TTL = int(os.environ.get('DOWNLOAD_TOKEN_TTL', 0)) or None
+DOWNLOAD_TOKEN_CACHE_SIZE = int(os.environ.get('DOWNLOAD_TOKEN_CACHE_SIZE', 4096))
+
+# Request metrics (see ezshare.metrics). Set METRICS_DIR to a directory shared
+# by every gunicorn worker, emptied on each deploy, so /metrics covers them all.
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_WRITE_INTERVAL = float(os.environ.get('METRICS_WRITE_INTERVAL', 1.0))
+
+
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = os.environ.get('EMAIL_HOST')
 EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
 EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'True') == 'True'
 EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
+
+# Queued email delivery (see user_auth.mail and the send_queued_email command).
+EMAIL_QUEUE_BATCH_SIZE = int(os.environ.get('EMAIL_QUEUE_BATCH_SIZE', 50))
+EMAIL_QUEUE_MAX_ATTEMPTS = int(os.environ.get('EMAIL_QUEUE_MAX_ATTEMPTS', 5))
+EMAIL_QUEUE_RETRY_BASE = int(os.environ.get('EMAIL_QUEUE_RETRY_BASE', 30))
+
+# Verification cleanup (see the sweep_verifications command).
+VERIFICATION_RETENTION_HOURS = float(os.environ.get('VERIFICATION_RETENTION_HOURS', 24 * 7))
+VERIFICATION_SWEEP_BATCH_SIZE = int(os.environ.get('VERIFICATION_SWEEP_BATCH_SIZE', 1000))
@@ -0,0 +1,320 @@
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, RequestFactory
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections
+from django.http import HttpResponse
+from unittest import skipUnless
+from unittest.mock import patch
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from ezshare.db_router import ReplicaRouter, ReplicaMiddleware, PIN_COOKIE
+from ezshare.metrics import MetricsStore
+from ezshare.mysql_pool.pool import ConnectionPool, PoolTimeout
+from share import views
+from share.models import File
+from share.tests import ShareFixtureMixin
+
+
+class MetricsTestCase(ShareFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir, ignore_errors=True)
+        patcher = patch('ezshare.metrics.store', MetricsStore(self.metrics_dir))
+        self.store = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.file_obj = File.objects.create(
+            owner=self.ops_user,
+            file_name=SimpleUploadedFile('test.docx', self.test_file_content),
+            original_name='test.docx'
+        )
+
+    def test_server_timing_header(self):
+        """Test responses carry DB and view timings with the query count"""
+        self.client.force_login(self.client_user)
+
+        response = self.client.get('/api/list/')
+
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="[1-9]\d* queries", view;dur=[\d.]+$')
+
+    def test_metrics_endpoint_per_route(self):
+        """Test /metrics exposes per-route histograms and response bytes"""
+        self.client.force_login(self.client_user)
+        body = self.client.get('/api/list/').content
+
+        text = self.client.get('/metrics').content.decode()
+
+        self.assertIn('# TYPE ezshare_db_queries histogram', text)
+        self.assertIn('ezshare_view_seconds_count{route="list_files"} 1', text)
+        self.assertIn('ezshare_db_queries_bucket{route="list_files",le="+Inf"} 1', text)
+        self.assertIn(f'ezshare_response_bytes_total{{route="list_files"}} {len(body)}', text)
+
+    def test_over_budget_counted(self):
+        """Test requests over their view's query budget are logged and counted"""
+        self.client.force_login(self.client_user)
+
+        with patch.object(views.list_files, 'query_budget', 1), self.assertLogs('ezshare.metrics', 'WARNING'):
+            self.client.get('/api/list/')
+
+        self.assertEqual(self.store.counters['ezshare_query_budget_exceeded_total|list_files'], 1)
+
+    def test_streamed_bytes_counted(self):
+        """Test streamed download bodies are counted once fully sent"""
+        self.client.force_login(self.client_user)
+        link = self.client.get(f'/api/download-file/{self.file_obj.id}/').json()['download-link']
+
+        response = self.client.get(link, headers={'Range': 'bytes=0-1,4-5'})
+        sent = len(b''.join(response.streaming_content))
+        response.close()
+
+        self.assertEqual(self.store.counters['ezshare_response_bytes_total|secure_download'], sent)
+
+    def test_metrics_merged_across_processes(self):
+        """Test /metrics sums the snapshots other workers left in METRICS_DIR"""
+        other = MetricsStore(self.metrics_dir)
+        other.observe('ezshare_db_queries', 'list_files', 3)
+        other.inc('ezshare_response_bytes_total', 'list_files', 100)
+        with open(os.path.join(self.metrics_dir, 'metrics-0.json'), 'w') as f:
+            json.dump(other.snapshot(), f)
+        self.store.inc('ezshare_response_bytes_total', 'list_files', 20)
+
+        text = self.client.get('/metrics').content.decode()
+
+        self.assertIn('ezshare_db_queries_count{route="list_files"} 1', text)
+        self.assertIn('ezshare_response_bytes_total{route="list_files"} 120', text)
+
+
+class ConnectionPoolTestCase(TestCase):
+    def setUp(self):
+        self.store = MetricsStore()
+        patcher = patch('ezshare.metrics.store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.opened = []
+
+    def connect(self):
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self.opened.append(conn)
+        return conn
+
+    def make_pool(self, **options):
+        pool = ConnectionPool(self.connect, ping=lambda conn: conn.execute('SELECT 1'), **options)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_connections_reused(self):
+        """Test a returned connection is handed out again instead of opening a new one"""
+        pool = self.make_pool(size=2, max_overflow=0)
+
+        first = pool.acquire()
+        self.assertEqual(pool.stats()['in_use'], 1)
+        pool.release(first)
+        second = pool.acquire()
+
+        self.assertIs(first, second)
+        self.assertEqual(len(self.opened), 1)
+        self.assertEqual(self.store.snapshot()['gauges']['ezshare_db_pool_connections|default:in_use'], 1)
+
+    def test_exited_workers_gauges_dropped(self):
+        """Test /metrics adds up gauges of live workers only, and counters of all of them"""
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir, ignore_errors=True)
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        for pid in (os.getppid(), exited.pid):
+            other = MetricsStore()
+            other.set('ezshare_db_pool_connections', 'default:in_use', 3)
+            other.inc('ezshare_db_pool_waits_total', 'default')
+            with open(os.path.join(metrics_dir, f'metrics-{pid}.json'), 'w') as f:
+                json.dump(other.snapshot(), f)
+        store = MetricsStore(metrics_dir)
+        store.set('ezshare_db_pool_connections', 'default:in_use', 1)
+
+        merged = store.collect()
+
+        self.assertEqual(merged['gauges']['ezshare_db_pool_connections|default:in_use'], 4)
+        self.assertEqual(merged['counters']['ezshare_db_pool_waits_total|default'], 2)
+
+    def test_overflow_closed_and_timeout_counted(self):
+        """Test overflow connections are closed on return and an exhausted pool times out"""
+        pool = self.make_pool(size=1, max_overflow=1, timeout=0.05)
+        first, overflow = pool.acquire(), pool.acquire()
+
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        pool.release(first)
+        pool.release(overflow)
+
+        with self.assertRaises(sqlite3.ProgrammingError):
+            overflow.execute('SELECT 1')
+        self.assertEqual(pool.stats(), {'size': 1, 'max_overflow': 1, 'in_use': 0, 'idle': 1, 'waits': 1, 'timeouts': 1})
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('ezshare_db_pool_timeouts_total{pool="default"} 1', text)
+        self.assertIn('ezshare_db_pool_connections{pool="default",state="idle"} 1', text)
+
+    def test_waiter_gets_released_connection(self):
+        """Test a checkout waiting on a full pool gets the next connection returned"""
+        pool = self.make_pool(size=1, max_overflow=0, timeout=5)
+        conn = pool.acquire()
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+        waiter.start()
+
+        while not pool.stats()['waits']:
+            time.sleep(0.001)
+        pool.release(conn)
+        waiter.join()
+
+        self.assertEqual(got, [conn])
+
+    def test_recycled_and_dead_connections_replaced(self):
+        """Test connections past their recycle age or failing the ping are replaced"""
+        pool = self.make_pool(size=1, max_overflow=0, recycle=0, pre_ping=True)
+        old = pool.acquire()
+        pool.release(old)
+        self.assertIsNot(pool.acquire(), old)
+
+        pool = self.make_pool(size=1, max_overflow=0, pre_ping=True)
+        dead = pool.acquire()
+        pool.release(dead)
+        dead.close()
+        self.assertIsNot(pool.acquire(), dead)
+
+    def test_limit_holds_under_threads(self):
+        """Test concurrent checkouts never open more than size + max_overflow connections"""
+        pool = self.make_pool(size=2, max_overflow=2, timeout=5)
+        peak = []
+
+        def work():
+            for _ in range(50):
+                conn = pool.acquire()
+                peak.append(pool.stats()['in_use'])
+                conn.execute('SELECT 1')
+                pool.release(conn)
+
+        workers = [threading.Thread(target=work) for _ in range(16)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertLessEqual(max(peak), 4)
+        self.assertEqual(pool.stats()['in_use'], 0)
+
+
+class ReplicaRoutingTestCase(SimpleTestCase):
+    """Routing decisions only; no replica database is needed to check them."""
+
+    def setUp(self):
+        patcher = patch('ezshare.db_router.DATABASE_REPLICAS', ['replica'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def send(self, writes=False, cookies=None):
+        """Run a request through ReplicaMiddleware; returns (response, read aliases before and after writing)."""
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(File))
+            if writes:
+                self.assertEqual(self.router.db_for_write(File), 'default')
+            reads.append(self.router.db_for_read(File))
+            return HttpResponse()
+
+        request = self.factory.get('/api/list/')
+        request.COOKIES.update(cookies or {})
+        return ReplicaMiddleware(view)(request), reads
+
+    def test_reads_use_replica_outside_writes(self):
+        """Test request reads go to the replica and everything outside a request to the primary"""
+        response, reads = self.send()
+
+        self.assertEqual(reads, ['replica', 'replica'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.router.db_for_read(File), 'default')
+        self.assertEqual(self.router.db_for_write(File), 'default')
+
+    def test_write_pins_client_to_primary(self):
+        """Test reads after a write use the primary, for the rest of the request and the pin window"""
+        response, reads = self.send(writes=True)
+
+        self.assertEqual(reads, ['replica', 'default'])
+        pin = response.cookies[PIN_COOKIE]
+        self.assertEqual(pin['max-age'], 5)
+
+        _, reads = self.send(cookies={PIN_COOKIE: pin.value})
+        self.assertEqual(reads, ['default', 'default'])
+
+        _, reads = self.send(cookies={PIN_COOKIE: str(time.time() - 1)})
+        self.assertEqual(reads, ['replica', 'replica'])
+        _, reads = self.send(cookies={PIN_COOKIE: 'garbage'})
+        self.assertEqual(reads, ['replica', 'replica'])
+
+    def test_transactions_read_primary(self):
+        """Test reads inside a transaction on the primary never go to the replica"""
+        with patch.object(connections['default'], 'in_atomic_block', True):
+            _, reads = self.send()
+
+        self.assertEqual(reads, ['default', 'default'])
+
+    def test_replicas_not_migrated(self):
+        """Test migrations run on the primary only"""
+        self.assertTrue(self.router.allow_migrate('default', 'share'))
+        self.assertFalse(self.router.allow_migrate('replica', 'share'))
+
+
+SQLITE_REPLICA = settings.DATABASES.get('replica_1', {}).get('ENGINE') == 'django.db.backends.sqlite3'
+
+
+@skipUnless(
+    SQLITE_REPLICA,
+    "Needs a SQLite replica_1, e.g. DB_ENGINE=django.db.backends.sqlite3 DB_REPLICA_NAMES=replica.sqlite3."
+)
+class ReplicaLagTestCase(ShareFixtureMixin, TransactionTestCase):
+    """Requests against a real replica that lags behind the primary."""
+
+    # The runner sets up every alias a test names, even when the test is skipped.
+    databases = {'default', 'replica_1'} if SQLITE_REPLICA else {'default'}
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch('ezshare.db_router.DATABASE_REPLICAS', ['replica_1'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+        File.objects.create(owner=self.ops_user, file_name='ab/cd/replicated.docx', original_name='replicated.docx')
+        self.client.force_login(self.client_user)
+        self.replicate()
+        # Written after the last replication, so only the primary has it.
+        File.objects.create(owner=self.ops_user, file_name='ab/cd/fresh.docx', original_name='fresh.docx')
+
+    def replicate(self):
+        """Copy the primary into the replica, as replication would."""
+        for alias in ('default', 'replica_1'):
+            connections[alias].ensure_connection()
+        connections['default'].connection.backup(connections['replica_1'].connection)
+
+    def listed(self, **cookies):
+        self.client.cookies.load(cookies)
+        response = self.client.get('/api/list/')
+        self.assertEqual(response.status_code, 200)
+        return sorted(f['file_name'] for f in response.json()['files'])
+
+    def test_unpinned_reads_see_the_replica(self):
+        """Test a client that has not written reads the lagging replica"""
+        self.assertEqual(self.listed(), ['replicated.docx'])
+
+    def test_pinned_reads_see_the_write(self):
+        """Test a client pinned after writing reads its write from the primary"""
+        self.assertEqual(self.listed(**{PIN_COOKIE: str(time.time() + 5)}), ['fresh.docx', 'replicated.docx'])
@@ -3,11 +3,13 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import path, include
+from ezshare.metrics import metrics_view
 
 urlpatterns = [
    # path('admin/', admin.site.urls),
     path('api/', include('user_auth.urls')),
     path('api/', include('share.urls')),
+    path('metrics', metrics_view, name='metrics'),
 
 ]
 
@@ -0,0 +1,101 @@
+import atexit
+import logging
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, When, Value, DateTimeField
+from django.utils import timezone
+from .models import File
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background flushes; 0 writes through on every access.
+FLUSH_INTERVAL = getattr(settings, 'LAST_OPENED_FLUSH_INTERVAL', 30)
+# Flush inline once the oldest buffered timestamp is older than this.
+MAX_STALENESS = getattr(settings, 'LAST_OPENED_MAX_STALENESS', 120)
+# Flush inline once this many files are waiting.
+MAX_PENDING = getattr(settings, 'LAST_OPENED_MAX_PENDING', 1000)
+
+_lock = threading.Lock()
+_pending = {}
+_oldest = None
+_flusher = None
+
+
+def _buffer(file_ids, when):
+    """Record ``when`` for ``file_ids``; return True if a flush is due now."""
+    global _oldest
+    with _lock:
+        for file_id in file_ids:
+            if file_id not in _pending or _pending[file_id] < when:
+                _pending[file_id] = when
+        if _oldest is None:
+            _oldest = time.monotonic()
+        return (
+            FLUSH_INTERVAL <= 0
+            or len(_pending) >= MAX_PENDING
+            or time.monotonic() - _oldest >= MAX_STALENESS
+        )
+
+
+def record_access(*file_ids, when=None):
+    """Buffer a ``last_opened`` update for ``file_ids`` instead of saving the rows."""
+    if _buffer(file_ids, when or timezone.now()):
+        flush()
+    else:
+        _start_flusher()
+
+
+async def arecord_access(*file_ids, when=None):
+    """Async ``record_access``; only an inline flush leaves the event loop."""
+    if _buffer(file_ids, when or timezone.now()):
+        await sync_to_async(flush)()
+    else:
+        _start_flusher()
+
+
+def flush():
+    """Write every buffered timestamp in one ``UPDATE ... CASE`` statement."""
+    global _pending, _oldest
+    with _lock:
+        batch, _pending, _oldest = _pending, {}, None
+    if not batch:
+        return 0
+    return File.objects.filter(id__in=batch).update(
+        last_opened=Case(
+            *[When(id=file_id, then=Value(when)) for file_id, when in batch.items()],
+            output_field=DateTimeField()
+        )
+    )
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception:
+            logger.exception("Failed to flush last_opened updates.")
+        finally:
+            connection.close()
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name='last-opened-flusher', daemon=True)
+            _flusher.start()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception("Failed to flush last_opened updates on shutdown.")
@@ -0,0 +1,128 @@
+import os
+import hashlib
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from .models import Blob, File
+from .upload_handlers import StoredUploadedFile
+from .storage import publish
+
+
+# Store one copy per distinct content and point File rows at it.
+CONTENT_ADDRESSED_STORAGE = getattr(settings, 'CONTENT_ADDRESSED_STORAGE', False)
+HASH_BLOCK_SIZE = 64 * 1024
+
+
+def blob_name(sha256):
+    return f'blobs/{sha256[:2]}/{sha256}'
+
+
+def hash_chunks(chunks):
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def acquire_blob(sha256, size, store):
+    """Return ``(blob, created)`` with one reference taken on the blob.
+
+    ``store(name)`` is only called when no blob with this hash exists yet
+    and must put the content at ``name`` in storage, returning the name used.
+    """
+    while True:
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(sha256=sha256).first()
+            if blob is not None:
+                Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+                return blob, False
+            name = store(blob_name(sha256))
+            publish(name)
+            try:
+                with transaction.atomic():
+                    return Blob.objects.create(sha256=sha256, file_name=name, size=size, ref_count=1), True
+            except IntegrityError:
+                # Another worker stored the same content first; drop our copy and reuse theirs.
+                default_storage.delete(name)
+
+
+def release_blob(blob_id):
+    """Drop one reference and delete the blob once nothing points at it."""
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=blob_id).first()
+        if blob is None:
+            return
+        if blob.ref_count > 1:
+            Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+            return
+        name = blob.file_name.name
+        blob.delete()
+    default_storage.delete(name)
+
+
+def move_in_storage(source, target):
+    os.makedirs(os.path.dirname(default_storage.path(target)), exist_ok=True)
+    target = default_storage.get_available_name(target)
+    os.replace(default_storage.path(source), default_storage.path(target))
+    return target
+
+
+def create_file_from_upload(owner, uploaded_file):
+    """Create a File for ``uploaded_file``, deduplicating in content-addressed mode."""
+    if isinstance(uploaded_file, StoredUploadedFile):
+        return create_file_from_storage(
+            owner, uploaded_file.storage_name, uploaded_file.name,
+            uploaded_file.size, uploaded_file.sha256
+        )
+    if not CONTENT_ADDRESSED_STORAGE:
+        file_obj = File.objects.create(
+            owner=owner,
+            file_name=uploaded_file,
+            original_name=uploaded_file.name,
+            file_size_kb=uploaded_file.size // 1024
+        )
+        publish(file_obj.file_name.name)
+        return file_obj
+    sha256, size = hash_chunks(uploaded_file.chunks())
+    uploaded_file.seek(0)
+    with transaction.atomic():
+        blob, _ = acquire_blob(sha256, size, lambda name: default_storage.save(name, uploaded_file))
+        return File.objects.create(
+            owner=owner,
+            file_name=blob.file_name.name,
+            original_name=uploaded_file.name,
+            blob=blob,
+            file_size_kb=size // 1024
+        )
+
+
+def create_file_from_storage(owner, name, original_name, size, sha256=None):
+    """Create a File for content already written to storage at ``name``.
+
+    Pass ``sha256`` when it was computed while writing to skip re-reading.
+    """
+    if not CONTENT_ADDRESSED_STORAGE:
+        publish(name)
+        return File.objects.create(
+            owner=owner,
+            file_name=name,
+            original_name=original_name,
+            file_size_kb=size // 1024
+        )
+    if sha256 is None:
+        with default_storage.open(name, 'rb') as f:
+            sha256, size = hash_chunks(iter(lambda: f.read(HASH_BLOCK_SIZE), b''))
+    with transaction.atomic():
+        blob, created = acquire_blob(sha256, size, lambda target: move_in_storage(name, target))
+        if not created:
+            default_storage.delete(name)
+        return File.objects.create(
+            owner=owner,
+            file_name=blob.file_name.name,
+            original_name=original_name,
+            blob=blob,
+            file_size_kb=size // 1024
+        )
@@ -0,0 +1,92 @@
+import os
+import time
+import zipfile
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from .delivery import cache_lookup
+
+
+BUNDLE_MAX_FILES = getattr(settings, 'BUNDLE_MAX_FILES', 200)
+BUNDLE_BLOCK_SIZE = 64 * 1024
+
+
+class ZipStream:
+    """Write-only sink that hands ZipFile output back to a generator.
+
+    It has no seek()/tell(), so ZipFile writes data descriptors after each
+    entry instead of seeking back to patch headers.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def unique_arcnames(names):
+    seen = {}
+    for name in names:
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        if count:
+            stem, ext = os.path.splitext(name)
+            name = f'{stem} ({count}){ext}'
+        yield name
+
+
+def entry_source(arcname, file_field):
+    """The ZipInfo and content blocks of one bundle entry.
+
+    Called as the bundle reaches the entry, so a cache miss is streamed from
+    shared storage (filling the cache) instead of being fetched up front.
+    """
+    if cache_lookup(file_field):
+        info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+        info.external_attr = 0o644 << 16
+        info.file_size = file_field.storage.size(file_field.name)
+        return info, file_field.storage.iter_fill(file_field.name)
+    path = file_field.path
+    return zipfile.ZipInfo.from_file(path, arcname), iter_file(path)
+
+
+def iter_file(path):
+    with open(path, 'rb') as src:
+        yield from iter(lambda: src.read(BUNDLE_BLOCK_SIZE), b'')
+
+
+def iter_zip(entries):
+    """Yield a ZIP of ``(arcname, file_field)`` entries with stored (uncompressed) members."""
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as bundle:
+        for arcname, file_field in entries:
+            info, blocks = entry_source(arcname, file_field)
+            info.compress_type = zipfile.ZIP_STORED
+            force_zip64 = info.file_size >= zipfile.ZIP64_LIMIT
+            try:
+                with bundle.open(info, 'w', force_zip64=force_zip64) as dst:
+                    for block in blocks:
+                        dst.write(block)
+                        yield stream.drain()
+            finally:
+                blocks.close()
+            yield stream.drain()
+    yield stream.drain()
+
+
+def zip_bundle_response(files, filename='bundle.zip'):
+    arcnames = unique_arcnames(f.display_name() for f in files)
+    entries = [(arcname, f.file_name) for arcname, f in zip(arcnames, files)]
+    response = StreamingHttpResponse(iter_zip(entries), content_type='application/zip')
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
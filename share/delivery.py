@@ -0,0 +1,118 @@
+import os
+import asyncio
+import functools
+import mimetypes
+from urllib.parse import quote
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from .ranges import ranged_file_response
+
+
+DOWNLOAD_BACKEND = getattr(settings, 'DOWNLOAD_BACKEND', 'django')
+DOWNLOAD_ACCEL_PREFIX = getattr(settings, 'DOWNLOAD_ACCEL_PREFIX', '/protected/')
+
+
+def offload_response(filename, header, value):
+    response = HttpResponse()
+    response['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response[header] = value
+    return response
+
+
+async def aiter_blocks(blocks):
+    """Drive a blocking iterator from the default executor, one block at a time."""
+    loop = asyncio.get_running_loop()
+    done = object()
+    try:
+        while (block := await loop.run_in_executor(None, next, blocks, done)) is not done:
+            yield block
+    finally:
+        await loop.run_in_executor(None, blocks.close)
+
+
+def cache_miss_response(file_field, filename, asynchronous=False):
+    """Stream ``file_field`` from shared storage while it is copied into the local cache."""
+    blocks = file_field.storage.iter_fill(file_field.name)
+    response = StreamingHttpResponse(
+        aiter_blocks(blocks) if asynchronous else blocks,
+        content_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    )
+    response['Content-Length'] = file_field.storage.size(file_field.name)
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def cache_lookup(file_field):
+    """Record a hit or miss when ``file_field`` lives in cached shared storage;
+    True if it has to come from the remote store."""
+    lookup = getattr(file_field.storage, 'lookup', None)
+    return lookup is not None and not lookup(file_field.name)
+
+
+def streams_miss(request):
+    """True when the django backend can stream a miss instead of filling the cache first."""
+    return DOWNLOAD_BACKEND == 'django' and request.method == 'GET' and 'Range' not in request.headers
+
+
+def fills_before_responding(request, file_field):
+    """True when answering ``request`` first copies ``file_field`` into the local cache."""
+    is_cached = getattr(file_field.storage, 'is_cached', None)
+    return is_cached is not None and not is_cached(file_field.name) and not streams_miss(request)
+
+
+def django_backend(request, file_field, filename, asynchronous=False):
+    if cache_lookup(file_field) and streams_miss(request):
+        return cache_miss_response(file_field, filename, asynchronous)
+    # Hits, and ranged misses once .path has filled the cache, are served from local disk.
+    return ranged_file_response(request, file_field.path, filename, asynchronous)
+
+
+def nginx_backend(request, file_field, filename, asynchronous=False):
+    # The web server reads the local copy, so fetch it first on a miss.
+    if cache_lookup(file_field):
+        file_field.storage.path(file_field.name)
+    location = DOWNLOAD_ACCEL_PREFIX.rstrip('/') + '/' + quote(file_field.name.lstrip('/'))
+    return offload_response(filename, 'X-Accel-Redirect', location)
+
+
+def sendfile_backend(request, file_field, filename, asynchronous=False):
+    cache_lookup(file_field)
+    return offload_response(filename, 'X-Sendfile', file_field.path)
+
+
+BACKENDS = {
+    'django': django_backend,
+    'nginx': nginx_backend,
+    'sendfile': sendfile_backend,
+}
+
+
+def file_download_response(request, file_field, filename=None, asynchronous=False):
+    """Hand ``file_field`` to the configured delivery backend.
+
+    ``django`` streams from the worker; ``nginx`` and ``sendfile`` return an
+    empty response and let the web server stream (and handle Range) itself.
+    """
+    try:
+        backend = BACKENDS[DOWNLOAD_BACKEND]
+    except KeyError:
+        raise ImproperlyConfigured(f"Unknown DOWNLOAD_BACKEND {DOWNLOAD_BACKEND!r}.")
+    return backend(request, file_field, filename or os.path.basename(file_field.name), asynchronous)
+
+
+async def afile_download_response(request, file_field, filename=None):
+    """Async twin of file_download_response.
+
+    A miss that has to be fetched from shared storage before the response
+    can be built is fetched in the default executor, off the event loop.
+    """
+    if fills_before_responding(request, file_field):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(file_download_response, request, file_field, filename, asynchronous=True)
+        )
+    return file_download_response(request, file_field, filename, asynchronous=True)
@@ -0,0 +1,289 @@
+import io
+import json
+import math
+import random
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+import datetime
+import subprocess
+import http.cookiejar
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.test import Client
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment,
+)
+from share.access_log import flush as flush_access_log
+from share.models import File, shard_name
+from share.processing import processing_disabled
+from share.tokens import sign_token
+from user_auth.models import Role
+
+
+SCENARIOS = ['login', 'list', 'link', 'download', 'upload']
+PASSWORD = 'Bench@1234'
+
+
+def make_document(size, rng):
+    """An OOXML package padded with incompressible bytes to roughly ``size``."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as package:
+        package.writestr('[Content_Types].xml', '<Types/>')
+        package.writestr('ppt/presentation.xml', '<presentation/>')
+        package.writestr('ppt/media/image1.bin', rng.randbytes(max(size - 300, 0)))
+    return buffer.getvalue()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+class InProcessTransport:
+    """Drive the app through Django's test client, no sockets involved."""
+
+    def __init__(self, user):
+        self.client = Client()
+        self.client.force_login(user)
+
+    def request(self, method, path, body=None, content_type=None):
+        if method == 'GET':
+            response = self.client.get(path)
+        elif content_type == 'multipart':
+            response = self.client.post(path, body)
+        else:
+            response = self.client.post(path, body, content_type=content_type)
+        size = sum(len(chunk) for chunk in response.streaming_content) if response.streaming else len(response.content)
+        response.close()
+        return response.status_code, size
+
+
+class HttpTransport:
+    """Drive a real HTTP server with urllib and a per-worker cookie jar."""
+
+    def __init__(self, base_url, user):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        status, _ = self.request('POST', '/api/login_view/', json.dumps({'email': user.email, 'password': PASSWORD}), 'application/json')
+        if status != 200:
+            raise RuntimeError(f"Login for {user.email} failed with {status}.")
+
+    def request(self, method, path, body=None, content_type=None):
+        headers = {}
+        if content_type == 'multipart':
+            boundary = 'benchboundary'
+            upload = body['file']
+            body = (
+                f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{upload.name}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n'
+            ).encode() + upload.read() + f'\r\n--{boundary}--\r\n'.encode()
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+        elif body is not None:
+            body = body.encode()
+            headers['Content-Type'] = content_type
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(request) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read())
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database and media root, run concurrent API scenarios against the "
+        "in-process test client or a local HTTP server, and report throughput and latency percentiles."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help="Users to seed (half Ops, half Client).")
+        parser.add_argument('--files', type=int, default=200, help="Files to seed.")
+        parser.add_argument('--median-file-kb', type=int, default=512, help="Median of the log-normal file size mix.")
+        parser.add_argument('--max-file-kb', type=int, default=8192)
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario.")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, help="Repeatable; defaults to all.")
+        parser.add_argument('--transport', choices=['inprocess', 'http'], default='inprocess')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help="Write machine-readable JSON results to this path.")
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp(prefix='ezshare-bench-')
+        database = connections['default']
+        if database.vendor == 'sqlite':
+            # An in-memory SQLite test DB cannot serve concurrent threads; use a file.
+            database.settings_dict['TEST']['NAME'] = f'{media_root}/bench.sqlite3'
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            # The local server speaks plain HTTP, so the session cookie must not be Secure-only.
+            # Post-upload processing is off: its pool threads would compete with the
+            # measured requests and outlive the throwaway database.
+            with override_settings(MEDIA_ROOT=media_root, SESSION_COOKIE_SECURE=False), \
+                    processing_disabled():
+                results = self.run_bench(options)
+            # Write buffered last_opened updates while the throwaway DB still exists.
+            flush_access_log()
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        for name, result in results['scenarios'].items():
+            self.stdout.write(
+                f"{name:<9} {result['throughput_rps']:>9.1f} req/s  "
+                f"p50 {result['p50_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms  "
+                f"p99 {result['p99_ms']:>8.2f} ms  errors {result['errors']}"
+            )
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}.")
+
+    def seed(self, options, rng):
+        password = make_password(PASSWORD)
+        User.objects.bulk_create([
+            User(username=f'bench{i}@example.invalid', email=f'bench{i}@example.invalid', password=password)
+            for i in range(max(options['users'], 2))
+        ])
+        # MySQL does not return primary keys from bulk_create, so read the rows back.
+        users = list(User.objects.filter(username__endswith='@example.invalid').order_by('id'))
+        Role.objects.bulk_create([
+            Role(user=user, role='Ops' if i % 2 == 0 else 'Client') for i, user in enumerate(users)
+        ])
+        ops = users[0::2]
+        mu = math.log(options['median_file_kb'] * 1024)
+        files = []
+        for i in range(options['files']):
+            size = int(min(rng.lognormvariate(mu, 1.0), options['max_file_kb'] * 1024))
+            name = default_storage.save(shard_name(f'bench-{i}.pptx'), ContentFile(make_document(size, rng)))
+            files.append(File(owner=rng.choice(ops), file_name=name, original_name=f'deck-{i}.pptx', file_size_kb=size // 1024))
+        File.objects.bulk_create(files)
+        return ops, users[1::2], list(File.objects.values_list('id', flat=True))
+
+    def run_bench(self, options):
+        rng = random.Random(options['seed'])
+        ops, clients, file_ids = self.seed(options, rng)
+        upload_body = make_document(options['median_file_kb'] * 1024, rng)
+
+        base_url = server = None
+        if options['transport'] == 'http':
+            server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+            server.set_app(get_wsgi_application())
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+        def transport(user):
+            return HttpTransport(base_url, user) if base_url else InProcessTransport(user)
+
+        def scenario_request(name, user, worker_rng):
+            if name == 'login':
+                body = json.dumps({'email': user.email, 'password': PASSWORD})
+                return ('POST', '/api/login_view/', body, 'application/json')
+            if name == 'list':
+                return ('GET', '/api/list/', None, None)
+            if name == 'link':
+                return ('GET', f'/api/download-file/{worker_rng.choice(file_ids)}/', None, None)
+            if name == 'download':
+                token = sign_token(f'{user.id}:{worker_rng.choice(file_ids)}')
+                return ('GET', f'/api/secure-download/{token}/', None, None)
+            upload = ContentFile(upload_body, name='upload.pptx')
+            return ('POST', '/api/upload/', {'file': upload}, 'multipart')
+
+        results = {
+            'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'commit': self.git_commit(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'options': {key: options[key] for key in (
+                'users', 'files', 'median_file_kb', 'max_file_kb', 'requests',
+                'concurrency', 'transport', 'seed',
+            )},
+            'scenarios': {},
+        }
+        try:
+            for name in options['scenario'] or SCENARIOS:
+                actors = ops if name == 'upload' else clients
+                results['scenarios'][name] = self.run_scenario(
+                    name, actors, transport, scenario_request, options
+                )
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        return results
+
+    def run_scenario(self, name, actors, transport, scenario_request, options):
+        concurrency = max(1, options['concurrency'])
+        total = options['requests']
+        per_worker = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+
+        def worker(index):
+            user, client = clients[index]
+            worker_rng = random.Random(options['seed'] * 1000 + index)
+            latencies, errors, sent_bytes = [], 0, 0
+            try:
+                for _ in range(per_worker[index]):
+                    method, path, body, content_type = scenario_request(name, user, worker_rng)
+                    start = time.perf_counter()
+                    status, size = client.request(method, path, body, content_type)
+                    latencies.append(time.perf_counter() - start)
+                    sent_bytes += size
+                    errors += status >= 400
+            finally:
+                connections.close_all()
+            return latencies, errors, sent_bytes
+
+        def connect(index):
+            user = actors[index % len(actors)]
+            return user, transport(user)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            # Log every worker in before the clock starts.
+            clients = list(pool.map(connect, range(concurrency)))
+            start = time.perf_counter()
+            outcomes = list(pool.map(worker, range(concurrency)))
+            wall = time.perf_counter() - start
+
+        latencies = sorted(latency for outcome in outcomes for latency in outcome[0])
+        ms = [latency * 1000 for latency in latencies]
+        return {
+            'requests': len(latencies),
+            'errors': sum(outcome[1] for outcome in outcomes),
+            'response_bytes': sum(outcome[2] for outcome in outcomes),
+            'wall_seconds': wall,
+            'throughput_rps': len(latencies) / wall if wall else 0.0,
+            'p50_ms': percentile(ms, 50),
+            'p95_ms': percentile(ms, 95),
+            'p99_ms': percentile(ms, 99),
+            'max_ms': ms[-1] if ms else None,
+        }
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                cwd=settings.BASE_DIR, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
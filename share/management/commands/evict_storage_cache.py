@@ -0,0 +1,17 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Evict least recently used files from the shared storage cache down to "
+        "STORAGE_CACHE_MAX_BYTES. Each worker only counts its own fills, so run this "
+        "periodically when several workers share one cache directory."
+    )
+
+    def handle(self, *args, **options):
+        evict = getattr(default_storage, 'evict', None)
+        if evict is None:
+            self.stdout.write("Default storage has no local cache, nothing to evict.")
+            return
+        self.stdout.write(f"Evicted {evict()} file(s).")
@@ -0,0 +1,45 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+from share.models import Blob
+
+
+class Command(BaseCommand):
+    help = "Recount blob references and delete blobs no active File points at."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        fixed = deleted = 0
+        while True:
+            batch = list(
+                Blob.objects.filter(id__gt=last_id).order_by('id')
+                .annotate(active=Count('files', filter=Q(files__status=True)))[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            for blob in batch:
+                if blob.active == blob.ref_count and blob.active:
+                    continue
+                if options['dry_run']:
+                    fixed += 1
+                    continue
+                with transaction.atomic():
+                    locked = Blob.objects.select_for_update().filter(pk=blob.pk).first()
+                    active = locked.files.filter(status=True).count() if locked else 0
+                    if locked and active:
+                        Blob.objects.filter(pk=blob.pk).update(ref_count=active)
+                        fixed += 1
+                        continue
+                    if locked:
+                        locked.delete()
+                if locked:
+                    default_storage.delete(blob.file_name.name)
+                    deleted += 1
+        self.stdout.write(f"Recounted {fixed} blob(s), deleted {deleted} unreferenced blob(s).")
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from share.models import File
+from share.processing import process_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Extract document metadata for files that have none yet, e.g. uploads from "
+        "before post-processing existed or jobs lost to a restart."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--retry-failed', action='store_true', help="Also redo files whose extraction failed.")
+
+    def handle(self, *args, **options):
+        missing = Q(metadata__isnull=True)
+        if options['retry_failed']:
+            missing |= Q(metadata__error__isnull=False)
+        pending = File.objects.filter(missing, status=True)
+        last_id = 0
+        processed = failed = 0
+        while True:
+            batch = list(pending.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1]
+            for file_id in batch:
+                metadata = process_file(file_id)
+                if metadata is None:
+                    continue
+                processed += 1
+                failed += metadata.error is not None
+        self.stdout.write(f"Processed {processed} file(s), {failed} without readable metadata.")
@@ -0,0 +1,120 @@
+import os
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, When, Value, F, Q, CharField
+from django.db.models.functions import Coalesce
+from share.models import File, UploadSession, SHARDED_NAME_PATTERN, shard_name
+
+
+def link_into_shard(old_name):
+    """Give ``old_name`` a second, sharded name without copying when possible.
+
+    The target is derived from the old name, so rerunning after a crash
+    reuses the link made last time instead of leaving an orphan.
+    """
+    new_name = shard_name(old_name, key=old_name)
+    source, target = default_storage.path(old_name), default_storage.path(new_name)
+    if os.path.exists(target):
+        if os.path.samefile(source, target) or os.path.getsize(source) == os.path.getsize(target):
+            return old_name, new_name
+        os.remove(target)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        # Hard links need one filesystem that supports them; fall back to a copy.
+        partial = f'{target}.partial'
+        shutil.copyfile(source, partial)
+        os.replace(partial, target)
+    return old_name, new_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Move files from the flat media directory into the ab/cd/<uuid>.<ext> layout. "
+        "Each file gets its new name before its row is updated, and the old name is "
+        "only removed after a grace period, so downloads keep working. Safe to rerun."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=4, help="Parallel link/copy operations.")
+        parser.add_argument('--grace', type=float, default=10.0,
+                            help="Seconds to keep an old name after its rows point elsewhere.")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        pending = File.objects.exclude(
+            Q(file_name__isnull=True) | Q(file_name='') | Q(file_name__startswith='blobs/')
+            | Q(file_name__regex=SHARDED_NAME_PATTERN)
+        )
+        if options['dry_run']:
+            self.stdout.write(f"{pending.count()} file(s) to move.")
+            return
+
+        moved = missing = 0
+        retiring = []
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            while True:
+                batch = list(
+                    pending.filter(id__gt=last_id).order_by('id').values_list('id', 'file_name')[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+
+                old_names = list(dict.fromkeys(name for _, name in batch))
+                present = [name for name in old_names if default_storage.exists(name)]
+                missing += len(old_names) - len(present)
+                renames = dict(pool.map(link_into_shard, present))
+
+                moved += self.update_names(batch, renames)
+                deadline = time.monotonic() + options['grace']
+                retiring.extend((deadline, name) for name in renames)
+                retiring = self.retire(retiring)
+
+        if retiring:
+            time.sleep(max(0.0, retiring[-1][0] - time.monotonic()))
+            self.retire(retiring)
+        self.stdout.write(f"Moved {moved} file(s); {missing} stored name(s) were missing and left as is.")
+
+    def update_names(self, batch, renames):
+        """Point every row of ``batch`` at its new name in one UPDATE per table."""
+        whens = [When(file_name=old, then=Value(new)) for old, new in renames.items()]
+        if not whens:
+            return 0
+        ids = [file_id for file_id, name in batch if name in renames]
+        with transaction.atomic():
+            # Matching on the old name as well skips rows changed since they were read.
+            # Rows without an original name would otherwise start showing the uuid.
+            # It is assigned first: MySQL evaluates SET left to right and would
+            # otherwise match against the new file_name.
+            updated = File.objects.filter(id__in=ids, file_name__in=list(renames)).update(
+                original_name=Coalesce(F('original_name'), Case(
+                    *[When(file_name=old, then=Value(os.path.basename(old))) for old in renames],
+                    output_field=CharField(),
+                )),
+                file_name=Case(*whens, default=F('file_name'), output_field=CharField()),
+            )
+            UploadSession.objects.filter(file_id__in=ids, file_name__in=list(renames)).update(
+                file_name=Case(*whens, default=F('file_name'), output_field=CharField())
+            )
+        return updated
+
+    def retire(self, retiring):
+        """Delete old names past their grace period that nothing references any more."""
+        now = time.monotonic()
+        due = [name for deadline, name in retiring if deadline <= now]
+        if not due:
+            return retiring
+        in_use = set(File.objects.filter(file_name__in=due).values_list('file_name', flat=True))
+        in_use |= set(UploadSession.objects.filter(file_name__in=due).values_list('file_name', flat=True))
+        for name in due:
+            if name not in in_use:
+                default_storage.delete(name)
+        return [(deadline, name) for deadline, name in retiring if deadline > now]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:40
+
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('share', '0004_content_addressed_blobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='search_name',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.Lower(django.db.models.functions.comparison.Coalesce('original_name', 'file_name')), output_field=models.CharField(max_length=255, null=True)),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['status', 'search_name', 'id'], name='share_file_status_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['status', 'file_size_kb', 'id'], name='share_file_status_size_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['status', 'last_opened', 'id'], name='share_file_status_opened_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['owner', 'status', 'created_at', 'id'], name='share_file_owner_created_idx'),
+        ),
+    ]
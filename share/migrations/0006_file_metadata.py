@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('share', '0005_file_catalogue_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileMetadata',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('title', models.CharField(blank=True, max_length=255, null=True)),
+                ('author', models.CharField(blank=True, max_length=255, null=True)),
+                ('page_count', models.PositiveIntegerField(blank=True, null=True)),
+                ('modified_at', models.DateTimeField(blank=True, null=True)),
+                ('snippet', models.CharField(blank=True, max_length=500, null=True)),
+                ('error', models.CharField(blank=True, max_length=255, null=True)),
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='metadata', to='share.file')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
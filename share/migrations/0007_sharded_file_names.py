@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:48
+
+import share.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('share', '0006_file_metadata'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='file_name',
+            field=models.FileField(null=True, upload_to=share.models.sharded_upload_to),
+        ),
+    ]
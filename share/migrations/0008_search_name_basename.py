@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-18 21:32
+
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+import share.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('share', '0007_sharded_file_names'),
+    ]
+
+    operations = [
+        # Generated columns cannot be altered in place; drop and re-add it with its index.
+        migrations.RemoveIndex(
+            model_name='file',
+            name='share_file_status_name_idx',
+        ),
+        migrations.RemoveField(
+            model_name='file',
+            name='search_name',
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='search_name',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.Lower(django.db.models.functions.comparison.Coalesce('original_name', share.models.Basename('file_name'))), output_field=models.CharField(max_length=255, null=True)),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['status', 'search_name', 'id'], name='share_file_status_name_idx'),
+        ),
+    ]
@@ -1,10 +1,106 @@
+import os
+import uuid
 from django.db import models
+from django.db.models.functions import Coalesce, Lower
 from django.contrib.auth.models import User
 from user_auth.models import BaseModel
 
+
+# Storage names laid out as ab/cd/<uuid>.<ext>: 65536 directories, no collisions to probe for.
+SHARDED_NAME_PATTERN = r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}(\.[a-z0-9]+)?$'
+
+
+def shard_name(filename, key=None):
+    """Sharded storage name for ``filename``; ``key`` makes it deterministic."""
+    name = (uuid.uuid5(uuid.NAMESPACE_URL, key) if key else uuid.uuid4()).hex
+    return f'{name[:2]}/{name[2:4]}/{name}{os.path.splitext(filename)[1].lower()}'
+
+
+class Basename(models.Func):
+    """The part of a storage name after its last '/'."""
+    arity = 1
+    output_field = models.CharField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return self.as_sql_template(compiler, connection, "REGEXP_REPLACE(%s, '^.*/', '')")
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql_template(compiler, connection, "SUBSTRING_INDEX(%s, '/', -1)")
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # Strip the directory part: RTRIM(x, <x without slashes>) leaves everything up to the last '/'.
+        sql, params = compiler.compile(self.source_expressions[0])
+        return f"SUBSTR({sql}, LENGTH(RTRIM({sql}, REPLACE({sql}, '/', ''))) + 1)", params * 3
+
+    def as_sql_template(self, compiler, connection, template):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return template % sql, params
+
+
+def sharded_upload_to(instance, filename):
+    # The stored name is a uuid, so keep the uploaded one for display and search.
+    if not instance.original_name:
+        instance.original_name = os.path.basename(filename)
+    return shard_name(filename)
     
+class Blob(BaseModel):
+    sha256 = models.CharField(max_length=64, unique=True)
+    file_name = models.FileField(upload_to='', null=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+
+
 class File(BaseModel):
     owner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
-    file_name = models.FileField(upload_to='', null=True)
+    file_name = models.FileField(upload_to=sharded_upload_to, null=True)
+    original_name = models.CharField(max_length=255, null=True, blank=True)
+    blob = models.ForeignKey(Blob, on_delete=models.SET_NULL, null=True, blank=True, related_name='files')
     file_size_kb = models.BigIntegerField(null=True)
-    last_opened = models.DateTimeField(auto_now=True)
\ No newline at end of file
+    last_opened = models.DateTimeField(auto_now=True)
+    # Lower-cased display name (as display_name()), computed by the database so
+    # bulk_create and queryset updates keep it in step; backs name search and sorting.
+    search_name = models.GeneratedField(
+        expression=Lower(Coalesce('original_name', Basename('file_name'))),
+        output_field=models.CharField(max_length=255, null=True),
+        db_persist=True,
+    )
+
+    def display_name(self):
+        return self.original_name or os.path.basename(self.file_name.name)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at', 'id'], name='share_file_status_created_idx'),
+            models.Index(fields=['status', 'search_name', 'id'], name='share_file_status_name_idx'),
+            models.Index(fields=['status', 'file_size_kb', 'id'], name='share_file_status_size_idx'),
+            models.Index(fields=['status', 'last_opened', 'id'], name='share_file_status_opened_idx'),
+            models.Index(fields=['owner', 'status', 'created_at', 'id'], name='share_file_owner_created_idx'),
+        ]
+
+
+class UploadSession(BaseModel):
+    upload_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    original_name = models.CharField(max_length=255)
+    file_name = models.FileField(upload_to='', null=True)
+    total_size = models.BigIntegerField()
+    file = models.ForeignKey(File, on_delete=models.SET_NULL, null=True, blank=True)
+
+
+class UploadChunk(BaseModel):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    offset = models.BigIntegerField()
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64)
+
+
+class FileMetadata(BaseModel):
+    """Document properties extracted after upload by ``share.processing``."""
+    file = models.OneToOneField(File, on_delete=models.CASCADE, related_name='metadata')
+    title = models.CharField(max_length=255, null=True, blank=True)
+    author = models.CharField(max_length=255, null=True, blank=True)
+    # Pages for .docx, slides for .pptx, sheets for .xlsx.
+    page_count = models.PositiveIntegerField(null=True, blank=True)
+    modified_at = models.DateTimeField(null=True, blank=True)
+    snippet = models.CharField(max_length=500, null=True, blank=True)
+    error = models.CharField(max_length=255, null=True, blank=True)
@@ -0,0 +1,162 @@
+import os
+import re
+import logging
+import zipfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils.dateparse import parse_datetime
+from .models import File, FileMetadata
+
+
+logger = logging.getLogger(__name__)
+
+# Threads extracting metadata after upload; 0 runs the job inline on commit.
+POST_UPLOAD_WORKERS = getattr(settings, 'POST_UPLOAD_WORKERS', 2)
+SNIPPET_LENGTH = 500
+# Skip package parts larger than this rather than inflate them.
+MAX_PART_SIZE = 4 * 1024 * 1024
+
+NS = {
+    'cp': 'http://schemas.openxmlformats.org/package/2006/metadata/core-properties',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+    'dcterms': 'http://purl.org/dc/terms/',
+    'ep': 'http://schemas.openxmlformats.org/officeDocument/2006/extended-properties',
+}
+# Where the page count comes from, per type: a docProps/app.xml element, or
+# the number of parts matching a pattern.
+PAGE_COUNT_SOURCES = {
+    '.docx': ('ep:Pages', None),
+    '.pptx': ('ep:Slides', re.compile(r'ppt/slides/slide\d+\.xml$')),
+    '.xlsx': (None, re.compile(r'xl/worksheets/sheet\d+\.xml$')),
+}
+# Body text used for the snippet when docProps has no description.
+TEXT_PARTS = {
+    '.docx': re.compile(r'word/document\.xml$'),
+    '.pptx': re.compile(r'ppt/slides/slide\d+\.xml$'),
+    '.xlsx': re.compile(r'xl/sharedStrings\.xml$'),
+}
+TEXT_TAG = re.compile(r'\}t$')
+
+process_executor = ThreadPoolExecutor(max_workers=max(POST_UPLOAD_WORKERS, 1), thread_name_prefix='post-upload')
+# Set by processing_disabled(); process-wide, so request threads see it too.
+_disabled = False
+
+
+def read_part(package, name):
+    info = package.getinfo(name)
+    if info.file_size > MAX_PART_SIZE:
+        return None
+    return ElementTree.fromstring(package.read(info))
+
+
+def text_of(root, path):
+    if root is None:
+        return None
+    value = root.findtext(path, namespaces=NS)
+    return (value.strip() or None) if value else None
+
+
+def body_snippet(package, pattern):
+    """The first SNIPPET_LENGTH characters of text runs in matching parts."""
+    parts = sorted(
+        (name for name in package.namelist() if pattern.match(name)),
+        key=lambda name: [int(n) if n.isdigit() else n for n in re.split(r'(\d+)', name)]
+    )
+    words = []
+    length = 0
+    for name in parts:
+        if package.getinfo(name).file_size > MAX_PART_SIZE:
+            continue
+        with package.open(name) as part:
+            for _, element in ElementTree.iterparse(part):
+                if TEXT_TAG.search(element.tag) and element.text:
+                    words.append(element.text)
+                    length += len(element.text)
+                    if length >= SNIPPET_LENGTH:
+                        return ' '.join(' '.join(words).split())[:SNIPPET_LENGTH]
+                element.clear()
+    return ' '.join(' '.join(words).split())[:SNIPPET_LENGTH] or None
+
+
+def extract_metadata(path, ext):
+    """Read title, author, page count, modified date and a snippet from an OOXML package."""
+    if ext not in PAGE_COUNT_SOURCES:
+        raise ValueError(f'Unsupported file type {ext!r}.')
+    with zipfile.ZipFile(path) as package:
+        names = set(package.namelist())
+        core = read_part(package, 'docProps/core.xml') if 'docProps/core.xml' in names else None
+        app = read_part(package, 'docProps/app.xml') if 'docProps/app.xml' in names else None
+
+        app_element, part_pattern = PAGE_COUNT_SOURCES[ext]
+        page_count = None
+        if part_pattern is not None:
+            page_count = sum(1 for name in names if part_pattern.match(name))
+        elif text_of(app, app_element):
+            page_count = int(text_of(app, app_element))
+
+        modified = text_of(core, 'dcterms:modified')
+        snippet = text_of(core, 'dc:description') or text_of(core, 'dc:subject') or body_snippet(package, TEXT_PARTS[ext])
+        return {
+            'title': (text_of(core, 'dc:title') or '')[:255] or None,
+            'author': (text_of(core, 'dc:creator') or '')[:255] or None,
+            'page_count': page_count,
+            'modified_at': parse_datetime(modified) if modified else None,
+            'snippet': snippet[:SNIPPET_LENGTH] if snippet else None,
+        }
+
+
+def process_file(file_id):
+    """Extract and store metadata for one File; failures are recorded, not raised."""
+    file_obj = File.objects.filter(id=file_id).first()
+    if file_obj is None or not file_obj.file_name:
+        return None
+    ext = os.path.splitext(file_obj.display_name())[1].lower()
+    try:
+        values = extract_metadata(file_obj.file_name.path, ext)
+        values['error'] = None
+    except (KeyError, ValueError, OSError, zipfile.BadZipFile, ElementTree.ParseError) as e:
+        logger.warning("Could not read metadata of file %s: %s", file_id, e)
+        values = {'error': str(e)[:255] or type(e).__name__}
+    metadata, _ = FileMetadata.objects.update_or_create(file=file_obj, defaults=values)
+    return metadata
+
+
+def _process_in_pool(file_id):
+    try:
+        process_file(file_id)
+    except Exception:
+        logger.exception("Post-upload processing of file %s failed.", file_id)
+    finally:
+        connections.close_all()
+
+
+def enqueue_processing(file_id):
+    """Process ``file_id`` once the surrounding transaction commits.
+
+    Jobs live in this process only; ``manage.py process_files`` picks up any
+    file left without metadata by a restart.
+    """
+    if _disabled:
+        return
+    if POST_UPLOAD_WORKERS <= 0:
+        transaction.on_commit(lambda: process_file(file_id))
+    else:
+        transaction.on_commit(lambda: process_executor.submit(_process_in_pool, file_id))
+
+
+@contextlib.contextmanager
+def processing_disabled():
+    """Queue no processing for files uploaded inside the block, in any thread.
+
+    For benchmarks, where extraction would compete with the measured
+    requests; ``manage.py process_files`` can fill in the metadata later.
+    """
+    global _disabled
+    previous, _disabled = _disabled, True
+    try:
+        yield
+    finally:
+        _disabled = previous
@@ -0,0 +1,188 @@
+import os
+import asyncio
+import uuid
+import mimetypes
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, content_disposition_header
+
+
+MAX_RANGES = getattr(settings, 'DOWNLOAD_MAX_RANGES', 16)
+RANGE_BLOCK_SIZE = 64 * 1024
+
+
+class RangeFile:
+    """File-like view over ``length`` bytes of ``fileobj`` starting at ``start``.
+
+    Keeps ``fileno()`` so ``wsgi.file_wrapper`` can still sendfile() the
+    slice: the descriptor is positioned at ``start`` and Content-Length
+    bounds the count.
+    """
+
+    def __init__(self, fileobj, start, length):
+        self.fileobj = fileobj
+        self.remaining = length
+        fileobj.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def close(self):
+        self.fileobj.close()
+
+
+def file_validators(stat):
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    return etag, http_date(stat.st_mtime)
+
+
+def parse_range_header(header, size):
+    """Return a list of (start, end) inclusive ranges, [] if none is
+    satisfiable, or None if the header should be ignored."""
+    if not header or not header.startswith('bytes='):
+        return None
+    specs = header[len('bytes='):].split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        first, sep, last = spec.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if end < start:
+                    return None
+            else:
+                suffix = int(last)
+                start, end = max(size - suffix, 0), size - 1
+                if suffix == 0:
+                    continue
+        except ValueError:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+    return ranges
+
+
+def if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return if_range == last_modified
+
+
+def iter_multipart(fileobj, ranges, size, content_type, boundary):
+    try:
+        for start, end in ranges:
+            yield (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+            ).encode()
+            part = RangeFile(fileobj, start, end - start + 1)
+            for chunk in iter(lambda: part.read(RANGE_BLOCK_SIZE), b''):
+                yield chunk
+        yield f'\r\n--{boundary}--\r\n'.encode()
+    finally:
+        fileobj.close()
+
+
+async def aiter_range(fileobj, start, length, close=True):
+    """Async iterator over a byte range; each read runs in the default executor,
+    so a slow client holds no thread between chunks."""
+    loop = asyncio.get_running_loop()
+    part = RangeFile(fileobj, start, length)
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, part.read, RANGE_BLOCK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if close:
+            fileobj.close()
+
+
+async def aiter_multipart(fileobj, ranges, size, content_type, boundary):
+    try:
+        for start, end in ranges:
+            yield (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+            ).encode()
+            async for chunk in aiter_range(fileobj, start, end - start + 1, close=False):
+                yield chunk
+        yield f'\r\n--{boundary}--\r\n'.encode()
+    finally:
+        fileobj.close()
+
+
+def ranged_file_response(request, file_path, filename, asynchronous=False):
+    """Serve ``file_path`` honouring ``Range``/``If-Range`` (RFC 9110).
+
+    With ``asynchronous`` the body is an async iterator for ASGI servers.
+    """
+    fileobj = open(file_path, 'rb')
+    stat = os.fstat(fileobj.fileno())
+    size = stat.st_size
+    etag, last_modified = file_validators(stat)
+
+    ranges = None
+    if request.method == 'GET' and if_range_matches(request, etag, last_modified):
+        ranges = parse_range_header(request.headers.get('Range'), size)
+
+    if ranges == []:
+        fileobj.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif asynchronous and (ranges is None or len(ranges) == 1):
+        start, end = ranges[0] if ranges else (0, size - 1)
+        response = StreamingHttpResponse(
+            aiter_range(fileobj, start, end - start + 1),
+            status=206 if ranges else 200,
+            content_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        )
+        response['Content-Length'] = end - start + 1
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+        if ranges:
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    elif ranges is None:
+        response = FileResponse(fileobj, as_attachment=True, filename=filename)
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = FileResponse(
+            RangeFile(fileobj, start, end - start + 1),
+            as_attachment=True, filename=filename, status=206
+        )
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        boundary = uuid.uuid4().hex
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = StreamingHttpResponse(
+            (aiter_multipart if asynchronous else iter_multipart)(fileobj, ranges, size, content_type, boundary),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}'
+        )
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    return response
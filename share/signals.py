@@ -0,0 +1,24 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import File
+from .blobs import release_blob
+
+
+@receiver(pre_save, sender=File)
+def file_soft_deleting(sender, instance, **kwargs):
+    instance._release_blob = bool(
+        instance.pk and instance.blob_id and not instance.status
+        and File.objects.filter(pk=instance.pk, status=True).exists()
+    )
+
+
+@receiver(post_save, sender=File)
+def file_soft_deleted(sender, instance, **kwargs):
+    if getattr(instance, '_release_blob', False):
+        release_blob(instance.blob_id)
+
+
+@receiver(post_delete, sender=File)
+def file_deleted(sender, instance, **kwargs):
+    if instance.blob_id and instance.status:
+        release_blob(instance.blob_id)
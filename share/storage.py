@@ -0,0 +1,189 @@
+import logging
+import os
+import time
+import uuid
+import threading
+from django.core.files import File as DjangoFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.module_loading import import_string
+from ezshare import metrics
+
+logger = logging.getLogger(__name__)
+
+FILL_BLOCK_SIZE = 256 * 1024
+# Evict down to this share of max_size, so one eviction pass makes room for many fills.
+LOW_WATER = 0.9
+
+
+class CachedStorage(FileSystemStorage):
+    """Shared remote storage behind a size-bounded local disk cache.
+
+    The remote store (any Django storage: S3 via django-storages, or a
+    FileSystemStorage on a network mount) holds every published file. The
+    local location (MEDIA_ROOT by default) keeps recently read files plus
+    uploads still being written. ``path()`` always returns a local path and
+    fetches the file first on a miss, so code that opens files directly
+    keeps working. Least recently used files are evicted on a background
+    thread once the cache grows past ``max_size``, but only files the remote
+    already holds. ``cached_bytes`` is counted per process, so with several
+    workers sharing one cache directory ``max_size`` is a soft bound; run the
+    ``evict_storage_cache`` command periodically to enforce it.
+    """
+
+    def __init__(self, remote_backend='django.core.files.storage.FileSystemStorage', remote_options=None,
+                 max_size=10 * 1024 ** 3, **kwargs):
+        super().__init__(**kwargs)
+        self.remote = import_string(remote_backend)(**(remote_options or {}))
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.cached_bytes = None
+        self.evictor = None
+
+    # Local cache
+
+    def local_path(self, name):
+        return super().path(name)
+
+    def is_cached(self, name):
+        return os.path.exists(self.local_path(name))
+
+    def touch(self, name):
+        """Mark ``name`` as recently used. Only atime changes, so ETags stay stable."""
+        path = self.local_path(name)
+        try:
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except FileNotFoundError:
+            pass
+
+    def lookup(self, name):
+        """Count a cache hit or miss for a download of ``name``; True on a hit."""
+        hit = self.is_cached(name)
+        metrics.store.inc('ezshare_storage_cache_total', 'hit' if hit else 'miss')
+        if hit:
+            self.touch(name)
+        return hit
+
+    def iter_fill(self, name):
+        """Yield ``name`` from the remote store while writing it into the cache.
+
+        The copy is only moved into place once complete, so a client that
+        disconnects midway leaves nothing half-written behind.
+        """
+        target = self.local_path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        partial = f'{target}.fill-{uuid.uuid4().hex}'
+        size = 0
+        try:
+            with self.remote.open(name, 'rb') as source, open(partial, 'wb') as out:
+                for block in iter(lambda: source.read(FILL_BLOCK_SIZE), b''):
+                    out.write(block)
+                    size += len(block)
+                    yield block
+            os.replace(partial, target)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        self.added(size)
+
+    def fill(self, name):
+        for _ in self.iter_fill(name):
+            pass
+
+    def added(self, size):
+        with self.lock:
+            if self.cached_bytes is not None:
+                self.cached_bytes += size
+            over = self.cached_bytes is None or self.cached_bytes > self.max_size
+            if not over or (self.evictor is not None and self.evictor.is_alive()):
+                return
+            self.evictor = threading.Thread(target=self.evict_in_background, name='storage-cache-evict', daemon=True)
+        # Fills and publishes never wait for eviction; one pass runs at a time.
+        self.evictor.start()
+
+    def evict_in_background(self):
+        try:
+            self.evict()
+        except Exception:
+            logger.exception("Evicting the storage cache failed.")
+
+    def evict(self):
+        """Delete least recently used published files until under the low-water mark.
+
+        Runs without the lock, which only guards ``cached_bytes``: asking the
+        remote about each candidate may take a network round trip. Returns the
+        number of files evicted.
+        """
+        entries = []
+        for root, _, names in os.walk(self.location):
+            for filename in names:
+                path = os.path.join(root, filename)
+                if '.fill-' in filename:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        if total > self.max_size:
+            target = self.max_size * LOW_WATER
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                name = os.path.relpath(path, self.location).replace(os.sep, '/')
+                # Unpublished uploads exist only here; never evict those.
+                try:
+                    if self.remote.size(name) != size:
+                        continue
+                except Exception:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Another worker sharing the directory got there first.
+                    pass
+                else:
+                    evicted += 1
+                    metrics.store.inc('ezshare_storage_cache_total', 'evict')
+                total -= size
+        with self.lock:
+            self.cached_bytes = total
+        return evicted
+
+    def publish(self, name):
+        """Copy the local file ``name`` to the remote store, replacing any older copy."""
+        if self.remote.exists(name):
+            self.remote.delete(name)
+        with open(self.local_path(name), 'rb') as f:
+            saved = self.remote.save(name, DjangoFile(f))
+        if saved != name:
+            raise OSError(f"Remote storage saved {name!r} as {saved!r}.")
+        self.added(os.path.getsize(self.local_path(name)))
+
+    # Storage API
+
+    def path(self, name):
+        path = self.local_path(name)
+        if not os.path.exists(path) and self.remote.exists(name):
+            self.fill(name)
+        return path
+
+    def exists(self, name):
+        return super().exists(name) or self.remote.exists(name)
+
+    def size(self, name):
+        if self.is_cached(name):
+            return super().size(name)
+        return self.remote.size(name)
+
+    def delete(self, name):
+        super().delete(name)
+        self.remote.delete(name)
+
+
+def publish(name):
+    """Push a finished file to shared storage; a no-op for plain local storage."""
+    publish_to_remote = getattr(default_storage, 'publish', None)
+    if publish_to_remote is not None:
+        publish_to_remote(name)
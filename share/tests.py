@@ -1,37 +1,89 @@
-from django.test import TestCase, Client
+from django.test import TestCase, AsyncClient, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.urls import reverse
+from django.core.management import call_command
+from django.db import connection
+from django.urls import reverse, path
+from django.utils import timezone
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from cryptography.fernet import Fernet, MultiFernet
+from unittest.mock import patch
+import base64
+import datetime
+import hashlib
+import io
 import json
 import os
+import shutil
+import tempfile
+import threading
+import zipfile
 from user_auth.models import Role
-from .models import File
-from cryptography.fernet import Fernet
-from django.conf import settings
+from ezshare.metrics import MetricsStore
+from ezshare.query_budget import QueryBudgetTestMixin, budget_for
+from share import access_log, tokens, urls, views
+from share.management.commands.shard_media import link_into_shard
+from share.processing import processing_disabled
+from share.views import encode_cursor
+from .models import File, FileMetadata, UploadSession, Blob, SHARDED_NAME_PATTERN
+
+
+urlpatterns = [
+    path('api/list/', views.alist_files, name='list_files'),
+    path('api/download-file/<int:file_id>/', views.adownload_file, name='download_file'),
+    path('api/secure-download/<str:token>/', views.asecure_download, name='secure_download'),
+]
+
+
+def make_ooxml(main_part='word/document.xml'):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as package:
+        package.writestr('[Content_Types].xml', '<Types/>')
+        package.writestr(main_part, '<document/>')
+    return buffer.getvalue()
+
+
+class TempMediaRootMixin:
+    """Store uploads under a temporary MEDIA_ROOT, removed after the class runs."""
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp(prefix='ezshare-test-media-')
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        cls.addClassCleanup(media.disable)
+        super().setUpClass()
+
+
+class ShareFixtureMixin(TempMediaRootMixin):
+    """An Ops and a Client user and an OOXML package, the starting point of most share tests."""
+
+    def setUp(self):
+        super().setUp()
+        # Write last_opened through synchronously so tests never race the flusher thread.
+        patcher = patch('share.access_log.FLUSH_INTERVAL', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.ops_user = User.objects.create_user(username='ops@example.com', email='ops@example.com', password='Test@1234')
+        Role.objects.create(user=self.ops_user, role='Ops')
+        self.client_user = User.objects.create_user(username='client@example.com', email='client@example.com', password='Test@1234')
+        Role.objects.create(user=self.client_user, role='Client')
+        self.test_file_content = make_ooxml()
 
 
-class FileSharingTestCase(TestCase):
+class FileSharingTestCase(ShareFixtureMixin, TestCase):
     def setUp(self):
-        self.client = Client()
+        super().setUp()
         self.upload_url = '/api/upload/'
         self.list_url = '/api/list/'
         self.download_url = '/api/download-file/'
-        
-        self.ops_user = User.objects.create_user(
-            username='ops@example.com',
-            email='ops@example.com',
-            password='Test@1234'
-        )
-        Role.objects.create(user=self.ops_user, role='Ops')
-        
-        self.client_user = User.objects.create_user(
-            username='client@example.com',
-            email='client@example.com',
-            password='Test@1234'
-        )
-        Role.objects.create(user=self.client_user, role='Client')
-        
-        self.test_file_content = b'This is a test file content'
         self.test_file = SimpleUploadedFile(
             'test.docx',
             self.test_file_content,
@@ -87,6 +139,25 @@ class FileSharingTestCase(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn('Invalid file type', response.json()['message'])
 
+    def test_upload_name_too_long(self):
+        """Test direct and chunked uploads reject names longer than original_name holds"""
+        self.client.force_login(self.ops_user)
+        name = 'a' * 251 + '.docx'
+        # Built by hand: SimpleUploadedFile would shorten the name to 255 characters.
+        body = (
+            f'--boundary\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode() + self.test_file_content + b'\r\n--boundary--\r\n'
+
+        response = self.client.post(self.upload_url, body, content_type='multipart/form-data; boundary=boundary')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], 'File name too long.')
+        response = self._create_upload_session(filename=name)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], 'File name too long.')
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(UploadSession.objects.exists())
+
     def test_list_files_client_user_success(self):
         """Test successful file listing by Client user"""
         self.client.force_login(self.client_user)
@@ -180,3 +251,1198 @@ class FileSharingTestCase(TestCase):
         
         self.assertEqual(response.status_code, 403)
         self.assertIn('This link is not for you', response.content.decode())
+
+    def test_role_lookup_cached_between_requests(self):
+        """Test that a warm role cache avoids Role queries in share views"""
+        self.client.force_login(self.client_user)
+        self.client.get(self.list_url)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.list_url)
+
+        self.assertEqual(response.status_code, 200)
+        role_queries = [q for q in ctx.captured_queries if 'user_auth_role' in q['sql']]
+        self.assertEqual(role_queries, [])
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+    def test_warm_requests_run_no_auth_queries(self):
+        """Test cache-backed sessions and the user cache leave no session, user or role queries"""
+        file_obj = File.objects.create(owner=self.ops_user, file_name='deck.pptx', original_name='deck.pptx')
+        self.client.force_login(self.client_user)
+        self.client.get(self.list_url)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(self.list_url).status_code, 200)
+            self.assertEqual(self.client.get(f'/api/download-file/{file_obj.id}/').status_code, 200)
+
+        auth_tables = ('django_session', 'auth_user', 'user_auth_role')
+        self.assertEqual([q['sql'] for q in ctx.captured_queries if any(t in q['sql'] for t in auth_tables)], [])
+
+    def test_user_cache_invalidated_on_change(self):
+        """Test deactivating a user or changing its role is picked up on the next request"""
+        self.client.force_login(self.client_user)
+        self.assertEqual(self.client.get(self.list_url).status_code, 200)
+
+        Role.objects.filter(user=self.client_user).update(role='Ops')
+        Role.objects.get(user=self.client_user).save()
+        self.assertEqual(self.client.get(self.list_url).status_code, 403)
+
+        self.client_user.is_active = False
+        self.client_user.save()
+        self.assertEqual(self.client.get(self.list_url).status_code, 302)
+
+    def test_role_cache_invalidated_on_soft_delete(self):
+        """Test that soft-deleting a Role is picked up on the next request"""
+        self.client.force_login(self.client_user)
+        self.assertEqual(self.client.get(self.list_url).status_code, 200)
+
+        role = Role.objects.get(user=self.client_user)
+        role.status = False
+        role.save()
+
+        self.assertEqual(self.client.get(self.list_url).status_code, 403)
+
+    def test_list_files_keyset_pagination(self):
+        """Test that list pages follow next_cursor without overlap"""
+        self.client.force_login(self.client_user)
+        ids = [
+            File.objects.create(owner=self.ops_user, file_name=f'deck{i}.pptx', file_size_kb=i).id
+            for i in range(5)
+        ]
+
+        seen = []
+        cursor = ''
+        while True:
+            response = self.client.get(self.list_url, {'page_size': 2, 'cursor': cursor})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertLessEqual(len(data['files']), 2)
+            seen.extend(f['id'] for f in data['files'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+
+        self.assertEqual(seen, ids)
+
+    def test_list_files_filters(self):
+        """Test name search, size, date and owner filters on the list"""
+        self.client.force_login(self.client_user)
+        other_ops = User.objects.create_user(username='ops2@example.com', email='ops2@example.com', password='Test@1234')
+        report = File.objects.create(owner=self.ops_user, file_name='a.docx', original_name='Q3-Report.docx', file_size_kb=10)
+        plan = File.objects.create(owner=other_ops, file_name='b.pptx', original_name='q3 plan.pptx', file_size_kb=500)
+        budget = File.objects.create(owner=self.ops_user, file_name='c.xlsx', original_name='Budget Q3.xlsx', file_size_kb=2000)
+        File.objects.filter(id=budget.id).update(created_at=timezone.now() - datetime.timedelta(days=30))
+
+        def ids(params):
+            response = self.client.get(self.list_url, params)
+            self.assertEqual(response.status_code, 200)
+            return [f['id'] for f in response.json()['files']]
+
+        self.assertEqual(ids({'prefix': 'Q3'}), [report.id, plan.id])
+        self.assertEqual(ids({'q': 'q3'}), [budget.id, report.id, plan.id])
+        self.assertEqual(ids({'q': 'PLAN'}), [plan.id])
+        self.assertEqual(ids({'min_size_kb': 100, 'max_size_kb': 1000}), [plan.id])
+        self.assertEqual(ids({'owner': other_ops.id}), [plan.id])
+        self.assertEqual(ids({'created_before': (timezone.now() - datetime.timedelta(days=1)).date().isoformat()}), [budget.id])
+        self.assertEqual(ids({'created_after': (timezone.now() - datetime.timedelta(days=1)).isoformat(), 'q': 'q3'}), [report.id, plan.id])
+        self.assertEqual(ids({'opened_after': '2999-01-01'}), [])
+
+    def test_list_files_invalid_filter(self):
+        """Test that malformed filter and sort values are rejected"""
+        self.client.force_login(self.client_user)
+
+        for params in ({'min_size_kb': 'big'}, {'created_after': 'yesterday'}, {'owner': 'me'}, {'sort': 'color'}):
+            self.assertEqual(self.client.get(self.list_url, params).status_code, 400, params)
+
+    def test_list_files_sorted_pagination(self):
+        """Test that each sort order pages through every file exactly once"""
+        self.client.force_login(self.client_user)
+        files = [
+            File.objects.create(owner=self.ops_user, file_name=f'f{i}.docx', original_name=name, file_size_kb=size)
+            for i, (name, size) in enumerate([('b.docx', 5), ('A.docx', None), ('c.docx', 5), ('a2.docx', 1), ('B2.docx', None)])
+        ]
+
+        def walk(sort):
+            seen, cursor = [], ''
+            while True:
+                data = self.client.get(self.list_url, {'sort': sort, 'page_size': 2, 'cursor': cursor}).json()
+                seen.extend(f['id'] for f in data['files'])
+                cursor = data['next_cursor']
+                if not cursor:
+                    return seen
+
+        by_size = sorted(files, key=lambda f: (f.file_size_kb if f.file_size_kb is not None else -1, f.id))
+        self.assertEqual(walk('size'), [f.id for f in by_size])
+        self.assertEqual(walk('-size'), [f.id for f in reversed(by_size)])
+        by_name = sorted(files, key=lambda f: (f.original_name.lower(), f.id))
+        self.assertEqual(walk('name'), [f.id for f in by_name])
+        self.assertEqual(walk('-created_at'), [f.id for f in reversed(files)])
+
+    def test_list_files_invalid_cursor(self):
+        """Test that a malformed cursor is rejected"""
+        self.client.force_login(self.client_user)
+
+        response = self.client.get(self.list_url, {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_list_files_cursor_from_other_sort(self):
+        """Test a cursor is rejected by a different sort or with a value of the wrong type"""
+        self.client.force_login(self.client_user)
+        for i in range(3):
+            File.objects.create(owner=self.ops_user, file_name=f'deck{i}.pptx', file_size_kb=i)
+        cursor = self.client.get(self.list_url, {'page_size': 1}).json()['next_cursor']
+
+        self.assertEqual(self.client.get(self.list_url, {'cursor': cursor, 'sort': 'size'}).status_code, 400)
+        self.assertEqual(self.client.get(self.list_url, {'cursor': cursor, 'sort': '-created_at'}).status_code, 400)
+        forged = base64.urlsafe_b64encode(json.dumps(['file_size_kb', 'big', 1]).encode()).decode()
+        self.assertEqual(self.client.get(self.list_url, {'cursor': forged, 'sort': 'size'}).status_code, 400)
+        self.assertEqual(self.client.get(self.list_url, {'cursor': cursor}).status_code, 200)
+
+    def test_search_name_is_display_basename(self):
+        """Test rows without an original name are searched and sorted by their file's basename"""
+        self.client.force_login(self.client_user)
+        sharded = File.objects.create(owner=self.ops_user, file_name='ab/cd/' + 'e' * 32 + '.docx')
+        File.objects.create(owner=self.ops_user, file_name='Quarterly Report.docx')
+
+        self.assertEqual(File.objects.get(id=sharded.id).search_name, 'e' * 32 + '.docx')
+        self.assertEqual(self.client.get(self.list_url, {'prefix': 'ab/'}).json()['files'], [])
+        names = [f['file_name'] for f in self.client.get(self.list_url, {'prefix': 'quarterly'}).json()['files']]
+        self.assertEqual(names, ['Quarterly Report.docx'])
+
+    def test_list_files_stream_all(self):
+        """Test that all=1 streams the whole catalogue as one JSON array"""
+        self.client.force_login(self.client_user)
+        for i in range(3):
+            File.objects.create(owner=self.ops_user, file_name=f'deck{i}.pptx', file_size_kb=i)
+
+        response = self.client.get(self.list_url, {'all': '1'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([f['file_name'] for f in data['files']], ['deck0.pptx', 'deck1.pptx', 'deck2.pptx'])
+
+    def test_list_files_stream_all_in_keyset_pages(self):
+        """Test that all=1 reads the catalogue in keyset pages, keeping the sort across pages"""
+        self.client.force_login(self.client_user)
+        files = [
+            File.objects.create(owner=self.ops_user, file_name=f'deck{i}.pptx', file_size_kb=i // 2)
+            for i in range(5)
+        ]
+        self.client.get(self.list_url)
+
+        with patch('share.views.LIST_STREAM_CHUNK_SIZE', 2), CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.list_url, {'all': '1', 'sort': '-size'})
+            data = json.loads(b''.join(response.streaming_content))
+
+        expected = sorted(files, key=lambda f: (f.file_size_kb, f.id), reverse=True)
+        self.assertEqual([f['id'] for f in data['files']], [f.id for f in expected])
+        pages = [q for q in ctx.captured_queries if 'share_file' in q['sql']]
+        self.assertEqual(len(pages), 3)
+
+    def _secure_download_url(self):
+        file_obj = File.objects.create(
+            owner=self.ops_user,
+            file_name=self.test_file,
+            file_size_kb=len(self.test_file_content) // 1024
+        )
+        from share.views import fernet
+        token = fernet.encrypt(f"{self.client_user.id}:{file_obj.id}".encode()).decode()
+        return f'/api/secure-download/{token}/'
+
+    def test_secure_download_single_range(self):
+        """Test that a single byte range returns 206 with the slice"""
+        self.client.force_login(self.client_user)
+        url = self._secure_download_url()
+
+        response = self.client.get(url, HTTP_RANGE='bytes=5-11')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.test_file_content[5:12])
+        self.assertEqual(response['Content-Length'], '7')
+        self.assertEqual(response['Content-Range'], f'bytes 5-11/{len(self.test_file_content)}')
+
+    def test_secure_download_suffix_range(self):
+        """Test that a suffix range returns the tail of the file"""
+        self.client.force_login(self.client_user)
+        url = self._secure_download_url()
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-7')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.test_file_content[-7:])
+
+    def test_secure_download_multi_range(self):
+        """Test that several ranges come back as multipart/byteranges"""
+        self.client.force_login(self.client_user)
+        url = self._secure_download_url()
+
+        response = self.client.get(url, HTTP_RANGE='bytes=0-3,8-11')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges'))
+        body = b''.join(response.streaming_content)
+        self.assertIn(self.test_file_content[0:4], body)
+        self.assertIn(self.test_file_content[8:12], body)
+        self.assertIn(b'Content-Range: bytes 8-11/', body)
+
+    def test_secure_download_unsatisfiable_range(self):
+        """Test that a range past the end returns 416"""
+        self.client.force_login(self.client_user)
+        url = self._secure_download_url()
+
+        response = self.client.get(url, HTTP_RANGE='bytes=1000-2000')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.test_file_content)}')
+
+    def test_secure_download_if_range_mismatch(self):
+        """Test that a stale If-Range validator falls back to the full file"""
+        self.client.force_login(self.client_user)
+        url = self._secure_download_url()
+        etag = self.client.get(url)['ETag']
+
+        matching = self.client.get(url, HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE=etag)
+        stale = self.client.get(url, HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE='"stale"')
+
+        self.assertEqual(matching.status_code, 206)
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(b''.join(stale.streaming_content), self.test_file_content)
+        self.assertEqual(stale['Accept-Ranges'], 'bytes')
+
+    @patch('share.delivery.DOWNLOAD_BACKEND', 'nginx')
+    def test_secure_download_nginx_offload(self):
+        """Test that the nginx backend returns X-Accel-Redirect and no body"""
+        self.client.force_login(self.client_user)
+        url = self._secure_download_url()
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['X-Accel-Redirect'], r'^/protected/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}\.docx$')
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertEqual(response.content, b'')
+
+    @patch('share.delivery.DOWNLOAD_BACKEND', 'sendfile')
+    def test_secure_download_sendfile_offload(self):
+        """Test that the sendfile backend returns an absolute X-Sendfile path"""
+        self.client.force_login(self.client_user)
+        url = self._secure_download_url()
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(os.path.isabs(response['X-Sendfile']))
+        self.assertEqual(response.content, b'')
+
+    @patch('share.access_log._start_flusher')
+    @patch('share.access_log.FLUSH_INTERVAL', 3600)
+    def test_secure_download_buffers_last_opened(self, mock_flusher):
+        """Test that downloads buffer last_opened and flush it in one update"""
+        self.client.force_login(self.client_user)
+        url = self._secure_download_url()
+        file_obj = File.objects.get()
+        before = file_obj.last_opened
+
+        response = self.client.get(url)
+        response.close()
+
+        file_obj.refresh_from_db()
+        self.assertEqual(file_obj.last_opened, before)
+        self.assertIn(file_obj.id, access_log._pending)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(access_log.flush(), 1)
+        file_obj.refresh_from_db()
+        self.assertGreater(file_obj.last_opened, before)
+
+    def _create_upload_session(self, filename='deck.pptx', size=10):
+        response = self.client.post(
+            '/api/uploads/',
+            data=json.dumps({'filename': filename, 'size': size}),
+            content_type='application/json'
+        )
+        return response
+
+    def test_chunked_upload_out_of_order(self):
+        """Test that chunks sent out of order assemble and finalize into a File"""
+        self.client.force_login(self.ops_user)
+        content = make_ooxml('ppt/presentation.xml')
+        size = len(content)
+        upload_id = self._create_upload_session(size=size).json()['upload_id']
+        url = f'/api/uploads/{upload_id}/'
+
+        response = self.client.put(
+            f'{url}?offset=6', content[6:], content_type='application/octet-stream',
+            HTTP_X_CHUNK_SHA256=hashlib.sha256(content[6:]).hexdigest()
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url).json()['received'], [[6, size]])
+
+        incomplete = self.client.post(f'{url}finalize/')
+        self.assertEqual(incomplete.status_code, 409)
+
+        self.client.put(f'{url}?offset=0', content[:6], content_type='application/octet-stream')
+        self.assertEqual(self.client.get(url).json()['received'], [[0, size]])
+
+        response = self.client.post(f'{url}finalize/')
+        self.assertEqual(response.status_code, 200)
+        file_obj = File.objects.get(id=response.json()['file_id'])
+        self.assertEqual(file_obj.owner, self.ops_user)
+        with file_obj.file_name.open('rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_finalize_locks_session_and_runs_once(self):
+        """Test finalize locks the session row, so a repeated finalize creates no second File"""
+        self.client.force_login(self.ops_user)
+        content = make_ooxml('ppt/presentation.xml')
+        upload_id = self._create_upload_session(size=len(content)).json()['upload_id']
+        url = f'/api/uploads/{upload_id}/'
+        self.client.put(f'{url}?offset=0', content, content_type='application/octet-stream')
+        sessions = UploadSession.objects
+
+        with patch.object(sessions, 'select_for_update', wraps=sessions.select_for_update) as lock:
+            first = self.client.post(f'{url}finalize/')
+            second = self.client.post(f'{url}finalize/')
+
+        self.assertEqual(lock.call_count, 2)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 404)
+        self.assertEqual(File.objects.filter(original_name='deck.pptx').count(), 1)
+
+    def test_chunked_upload_content_checked_at_finalize(self):
+        """Test finalize rejects assembled bytes that are not a package of the named type"""
+        self.client.force_login(self.ops_user)
+        content = make_ooxml('word/document.xml')
+        upload_id = self._create_upload_session(size=len(content)).json()['upload_id']
+        url = f'/api/uploads/{upload_id}/'
+        self.client.put(f'{url}?offset=0', content, content_type='application/octet-stream')
+        reserved = UploadSession.objects.get(upload_id=upload_id).file_name.name
+
+        response = self.client.post(f'{url}finalize/')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], 'File content does not match its type.')
+        self.assertFalse(default_storage.exists(reserved))
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(File.objects.exists())
+
+    def test_chunked_upload_checksum_mismatch(self):
+        """Test that a chunk with a wrong checksum is rejected and not recorded"""
+        self.client.force_login(self.ops_user)
+        upload_id = self._create_upload_session(size=4).json()['upload_id']
+        url = f'/api/uploads/{upload_id}/'
+
+        response = self.client.put(
+            f'{url}?offset=0', b'abcd', content_type='application/octet-stream',
+            HTTP_X_CHUNK_SHA256='0' * 64
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).json()['received'], [])
+
+    def test_chunked_upload_rules_match_upload_file(self):
+        """Test that upload sessions apply the same role and extension checks"""
+        self.client.force_login(self.ops_user)
+        self.assertEqual(self._create_upload_session(filename='notes.txt').status_code, 400)
+
+        self.client.force_login(self.client_user)
+        self.assertEqual(self._create_upload_session().status_code, 403)
+
+    @patch('share.blobs.CONTENT_ADDRESSED_STORAGE', True)
+    def test_content_addressed_upload_deduplicates(self):
+        """Test that identical uploads share one blob until both are soft-deleted"""
+        self.client.force_login(self.ops_user)
+        for name in ('a.docx', 'b.docx'):
+            upload = SimpleUploadedFile(name, self.test_file_content)
+            self.assertEqual(self.client.post(self.upload_url, {'file': upload}).status_code, 200)
+
+        blob = Blob.objects.get()
+        first, second = File.objects.order_by('id')
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(first.file_name.name, second.file_name.name)
+        self.assertEqual(first.display_name(), 'a.docx')
+
+        first.status = False
+        first.save()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+
+        second.status = False
+        second.save()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.file_name.name))
+
+    @patch('share.blobs.CONTENT_ADDRESSED_STORAGE', True)
+    def test_content_addressed_chunked_upload_reuses_blob(self):
+        """Test that a finalized chunked upload of known content reuses the blob"""
+        self.client.force_login(self.ops_user)
+        content = make_ooxml('ppt/presentation.xml')
+        upload = SimpleUploadedFile('a.pptx', content)
+        self.assertEqual(self.client.post(self.upload_url, {'file': upload}).status_code, 200)
+
+        upload_id = self._create_upload_session(size=len(content)).json()['upload_id']
+        self.client.put(f'/api/uploads/{upload_id}/?offset=0', content, content_type='application/octet-stream')
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_upload_file_streams_into_storage(self):
+        """Test that uploads are written once to storage with their checksum"""
+        self.client.force_login(self.ops_user)
+
+        response = self.client.post(self.upload_url, {'file': self.test_file})
+
+        self.assertEqual(response.status_code, 200)
+        file_obj = File.objects.get(id=response.json()['file_id'])
+        self.assertEqual(file_obj.display_name(), 'test.docx')
+        with file_obj.file_name.open('rb') as f:
+            self.assertEqual(hashlib.sha256(f.read()).digest(), hashlib.sha256(self.test_file_content).digest())
+
+    def test_upload_file_rejects_non_zip_content(self):
+        """Test that a renamed non-OOXML file is rejected from its first bytes"""
+        self.client.force_login(self.ops_user)
+        fake = SimpleUploadedFile('test.docx', b'This is not a zip file')
+
+        response = self.client.post(self.upload_url, {'file': fake})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('does not match', response.json()['message'])
+        self.assertFalse(File.objects.exists())
+
+    def test_upload_file_rejects_wrong_package_type(self):
+        """Test that a spreadsheet package renamed to .docx is rejected"""
+        self.client.force_login(self.ops_user)
+        renamed = SimpleUploadedFile('test.docx', make_ooxml('xl/workbook.xml'))
+
+        response = self.client.post(self.upload_url, {'file': renamed})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(File.objects.exists())
+
+    def test_download_links_bulk(self):
+        """Test bulk link issuance with one file query and missing ids reported"""
+        self.client.force_login(self.client_user)
+        files = [
+            File.objects.create(owner=self.ops_user, file_name=f'deck{i}.pptx', file_size_kb=i)
+            for i in range(3)
+        ]
+        file_ids = [f.id for f in files] + [999999]
+        self.client.get(self.list_url)
+
+        # The session and the files; user and role come from the user cache.
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                '/api/download-links/',
+                data=json.dumps({'file_ids': file_ids}),
+                content_type='application/json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(sorted(data['download-links']), sorted(str(f.id) for f in files))
+        self.assertEqual(data['missing'], [999999])
+
+        from share.views import fernet
+        token = data['download-links'][str(files[0].id)].rstrip('/').rsplit('/', 1)[1]
+        self.assertEqual(fernet.decrypt(token.encode()).decode(), f'{self.client_user.id}:{files[0].id}')
+
+    def test_bundle_download_streams_stored_zip(self):
+        """Test that a bundle link streams every file as a stored ZIP entry"""
+        self.client.force_login(self.client_user)
+        files = [
+            File.objects.create(
+                owner=self.ops_user,
+                file_name=SimpleUploadedFile('test.docx', self.test_file_content),
+                original_name='test.docx'
+            )
+            for _ in range(2)
+        ]
+
+        response = self.client.post(
+            '/api/bundle-link/',
+            data=json.dumps({'file_ids': [f.id for f in files]}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        bundle = self.client.get(response.json()['download-link'])
+
+        self.assertEqual(bundle.status_code, 200)
+        self.assertTrue(bundle.streaming)
+        with zipfile.ZipFile(io.BytesIO(b''.join(bundle.streaming_content))) as archive:
+            self.assertEqual(archive.namelist(), ['test.docx', 'test (1).docx'])
+            for info in archive.infolist():
+                self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(archive.read(info), self.test_file_content)
+
+    def test_bundle_link_rejects_other_user(self):
+        """Test that a bundle token minted for another user is refused"""
+        from share.views import fernet
+        self.client.force_login(self.client_user)
+        file_obj = File.objects.create(owner=self.ops_user, file_name=self.test_file)
+        token = fernet.encrypt(f"{self.ops_user.id}:bundle:{file_obj.id}".encode()).decode()
+
+        response = self.client.get(f'/api/secure-bundle/{token}/')
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_hmac_download_token_round_trip(self):
+        """Test that compact HMAC links verify and stale ones are refused"""
+        with patch('share.tokens.DOWNLOAD_TOKEN_FORMAT', 'hmac'), patch('share.tokens.DOWNLOAD_TOKEN_TTL', 60):
+            token = tokens.sign_token('7:42')
+            self.assertNotIn('gAAAA', token)
+            self.assertEqual(tokens.verify_token(token), '7:42')
+            with patch('share.tokens.time.time', return_value=10 ** 12):
+                with self.assertRaises(tokens.InvalidToken):
+                    tokens.verify_token(token)
+            with self.assertRaises(tokens.InvalidToken):
+                tokens.verify_token(token[:-2] + 'AA')
+
+    def test_download_token_key_rotation(self):
+        """Test that links signed with a retired key still verify after rotation"""
+        old_key = Fernet(Fernet.generate_key())
+        old_token = old_key.encrypt(b'7:42').decode()
+
+        with patch('share.tokens.fernet', MultiFernet([Fernet(Fernet.generate_key()), old_key])):
+            self.assertEqual(tokens.verify_token(old_token), '7:42')
+            new_token = tokens.sign_token('7:43')
+        with self.assertRaises(tokens.InvalidToken):
+            old_key.decrypt(new_token.encode())
+
+    def test_secure_download_hmac_link(self):
+        """Test that an HMAC link issued by download_file is honoured"""
+        self.client.force_login(self.client_user)
+        file_obj = File.objects.create(owner=self.ops_user, file_name=self.test_file)
+
+        with patch('share.tokens.DOWNLOAD_TOKEN_FORMAT', 'hmac'):
+            link = self.client.get(f'{self.download_url}{file_obj.id}/').json()['download-link']
+        response = self.client.get(link)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.test_file_content)
+
+
+@override_settings(ROOT_URLCONF='share.tests')
+class AsyncShareViewsTestCase(ShareFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = AsyncClient()
+        self.file_obj = File.objects.create(
+            owner=self.ops_user,
+            file_name=SimpleUploadedFile('test.docx', self.test_file_content),
+            original_name='test.docx'
+        )
+
+    async def test_async_list_files(self):
+        """Test the async list view pages and streams"""
+        await self.client.aforce_login(self.client_user)
+
+        response = await self.client.get('/api/list/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['files'][0]['id'], self.file_obj.id)
+
+        response = await self.client.get('/api/list/', {'all': '1'})
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(json.loads(body)['files'][0]['file_name'], 'test.docx')
+
+    async def test_async_stream_all_in_keyset_pages(self):
+        """Test the async all=1 stream walks keyset pages to the end"""
+        await self.client.aforce_login(self.client_user)
+        for i in range(4):
+            await File.objects.acreate(owner=self.ops_user, file_name=f'deck{i}.pptx', original_name=f'deck{i}.pptx')
+
+        with patch('share.views.LIST_STREAM_CHUNK_SIZE', 2):
+            response = await self.client.get('/api/list/', {'all': '1', 'sort': 'name'})
+            body = b''.join([chunk async for chunk in response.streaming_content])
+
+        names = [f['file_name'] for f in json.loads(body)['files']]
+        self.assertEqual(names, ['deck0.pptx', 'deck1.pptx', 'deck2.pptx', 'deck3.pptx', 'test.docx'])
+
+    async def test_async_list_files_ops_forbidden(self):
+        """Test the async list view applies the Client role check"""
+        await self.client.aforce_login(self.ops_user)
+
+        response = await self.client.get('/api/list/')
+
+        self.assertEqual(response.status_code, 403)
+
+    async def test_async_download_streams_file(self):
+        """Test async link issuance and async streaming, including a range"""
+        await self.client.aforce_login(self.client_user)
+
+        link = (await self.client.get(f'/api/download-file/{self.file_obj.id}/')).json()['download-link']
+        response = await self.client.get(link)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.test_file_content)
+
+        response = await self.client.get(link, headers={'Range': 'bytes=2-5'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.test_file_content[2:6])
+
+
+class QueryBudgetTestCase(ShareFixtureMixin, QueryBudgetTestMixin, TestCase):
+    """Every share view stays within its declared query budget at realistic sizes."""
+
+    FILE_COUNT = 150
+
+    def setUp(self):
+        super().setUp()
+        # Budgets are for a cold role cache, the worst case.
+        cache.clear()
+        stored = File.objects.create(
+            owner=self.ops_user,
+            file_name=SimpleUploadedFile('test.docx', self.test_file_content),
+            original_name='test.docx'
+        )
+        File.objects.bulk_create([
+            File(owner=self.ops_user, file_name=stored.file_name.name, original_name=f'deck-{i}.docx', file_size_kb=i)
+            for i in range(self.FILE_COUNT - 1)
+        ])
+        self.file_ids = list(File.objects.values_list('id', flat=True))
+
+    def post_json(self, path, data):
+        return self.client.post(path, json.dumps(data), content_type='application/json')
+
+    def test_every_view_declares_a_budget(self):
+        """Test every routed share view declares a query budget"""
+        for pattern in urls.urlpatterns + urlpatterns:
+            self.assertIsNotNone(budget_for(pattern.callback), pattern.name)
+
+    def test_upload_views_within_budget(self):
+        """Test upload, chunked upload and finalize stay within budget"""
+        self.client.force_login(self.ops_user)
+        upload = SimpleUploadedFile('deck.docx', self.test_file_content)
+        self.assertWithinQueryBudget(self.client.post, '/api/upload/', {'file': upload})
+
+        response = self.assertWithinQueryBudget(
+            self.post_json, '/api/uploads/', {'filename': 'deck.docx', 'size': len(self.test_file_content)}
+        )
+        url = f"/api/uploads/{response.json()['upload_id']}/"
+        half = len(self.test_file_content) // 2
+        for offset, part in ((0, self.test_file_content[:half]), (half, self.test_file_content[half:])):
+            self.assertWithinQueryBudget(
+                self.client.put, f'{url}?offset={offset}', part, content_type='application/octet-stream'
+            )
+        self.assertWithinQueryBudget(self.client.get, url)
+        response = self.assertWithinQueryBudget(self.client.post, f'{url}finalize/')
+        self.assertEqual(response.status_code, 200)
+
+    @patch('share.blobs.CONTENT_ADDRESSED_STORAGE', True)
+    def test_content_addressed_upload_views_within_budget(self):
+        """Test uploads stay within budget with content-addressed storage"""
+        self.test_upload_views_within_budget()
+
+    def test_over_budget_fails(self):
+        """Test the helper fails a request that runs more queries than its view allows"""
+        self.client.force_login(self.client_user)
+
+        with patch.object(views.list_files, 'query_budget', 1), self.assertLogs('ezshare.metrics', 'WARNING'):
+            with self.assertRaisesMessage(AssertionError, 'share.views.list_files ran 4 queries, budget is 1'):
+                self.assertWithinQueryBudget(self.client.get, '/api/list/')
+
+    def test_list_views_within_budget(self):
+        """Test paged and streamed listing stay within budget"""
+        self.client.force_login(self.client_user)
+
+        response = self.assertWithinQueryBudget(self.client.get, '/api/list/', {'page_size': self.FILE_COUNT})
+        self.assertEqual(len(response.json()['files']), self.FILE_COUNT)
+        first = File.objects.order_by('created_at', 'id').values_list('created_at', 'id').first()
+        self.assertWithinQueryBudget(self.client.get, '/api/list/', {'cursor': encode_cursor(*first)})
+        response = self.assertWithinQueryBudget(self.client.get, '/api/list/', {'all': '1'})
+        self.assertEqual(len(json.loads(response.consumed_content)['files']), self.FILE_COUNT)
+
+    def test_link_views_within_budget(self):
+        """Test single, bulk and bundle link issuance stay within budget"""
+        self.client.force_login(self.client_user)
+
+        self.assertWithinQueryBudget(self.client.get, f'/api/download-file/{self.file_ids[0]}/')
+        response = self.assertWithinQueryBudget(self.post_json, '/api/download-links/', {'file_ids': self.file_ids})
+        self.assertEqual(len(response.json()['download-links']), self.FILE_COUNT)
+        response = self.assertWithinQueryBudget(self.post_json, '/api/bundle-link/', {'file_ids': self.file_ids[:50]})
+        self.assertEqual(response.status_code, 200)
+
+    def test_download_views_within_budget(self):
+        """Test single and bundled downloads stay within budget"""
+        self.client.force_login(self.client_user)
+
+        link = self.client.get(f'/api/download-file/{self.file_ids[0]}/').json()['download-link']
+        cache.clear()
+        response = self.assertWithinQueryBudget(self.client.get, link)
+        self.assertEqual(response.consumed_content, self.test_file_content)
+
+        link = self.post_json('/api/bundle-link/', {'file_ids': self.file_ids[:50]}).json()['download-link']
+        cache.clear()
+        response = self.assertWithinQueryBudget(self.client.get, link)
+        self.assertEqual(len(zipfile.ZipFile(io.BytesIO(response.consumed_content)).namelist()), 50)
+
+    @override_settings(ROOT_URLCONF='share.tests')
+    async def test_async_views_within_budget(self):
+        """Test the async list, link and download views stay within budget"""
+        client = AsyncClient()
+        await client.aforce_login(self.client_user)
+
+        await self.aassertWithinQueryBudget(client.get, '/api/list/', {'page_size': self.FILE_COUNT})
+        await self.aassertWithinQueryBudget(client.get, '/api/list/', {'all': '1'})
+        response = await self.aassertWithinQueryBudget(client.get, f'/api/download-file/{self.file_ids[0]}/')
+        await cache.aclear()
+        response = await self.aassertWithinQueryBudget(client.get, response.json()['download-link'])
+        self.assertEqual(response.consumed_content, self.test_file_content)
+
+
+CORE_XML = (
+    '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/">'
+    '<dc:title>Q3 Plan</dc:title><dc:creator>Dana</dc:creator>{description}'
+    '<dcterms:modified>2024-05-01T09:30:00Z</dcterms:modified></cp:coreProperties>'
+)
+APP_XML = (
+    '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties">'
+    '<Pages>7</Pages></Properties>'
+)
+
+
+def make_package(parts):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as package:
+        package.writestr('[Content_Types].xml', '<Types/>')
+        for name, content in parts.items():
+            package.writestr(name, content)
+    return buffer.getvalue()
+
+
+class PostUploadProcessingTestCase(ShareFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Extract inline on commit unless a test opts into the pool.
+        patcher = patch('share.processing.POST_UPLOAD_WORKERS', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, name, content):
+        self.client.force_login(self.ops_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/upload/', {'file': SimpleUploadedFile(name, content)})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['file_id']
+
+    def test_upload_metadata_listed(self):
+        """Test docProps metadata is extracted after upload and returned by the list"""
+        file_id = self.upload('plan.docx', make_package({
+            'docProps/core.xml': CORE_XML.format(description='<dc:description>Quarterly targets</dc:description>'),
+            'docProps/app.xml': APP_XML,
+            'word/document.xml': '<document/>',
+        }))
+
+        self.client.force_login(self.client_user)
+        listed = self.client.get('/api/list/').json()['files']
+
+        self.assertEqual(listed[0]['id'], file_id)
+        self.assertEqual(listed[0]['title'], 'Q3 Plan')
+        self.assertEqual(listed[0]['author'], 'Dana')
+        self.assertEqual(listed[0]['page_count'], 7)
+        self.assertEqual(listed[0]['snippet'], 'Quarterly targets')
+        self.assertTrue(listed[0]['modified_at'].startswith('2024-05-01T09:30:00'))
+
+    def test_slide_and_sheet_counts_with_body_snippet(self):
+        """Test slides and sheets are counted from parts and the snippet falls back to body text"""
+        slide = '<p:sld xmlns:p="p" xmlns:a="a"><a:t>{}</a:t></p:sld>'
+        deck_id = self.upload('deck.pptx', make_package({
+            'ppt/presentation.xml': '<presentation/>',
+            'ppt/slides/slide1.xml': slide.format('Welcome'),
+            'ppt/slides/slide2.xml': slide.format('Agenda'),
+            'ppt/slides/slide10.xml': slide.format('Thanks'),
+        }))
+        book_id = self.upload('book.xlsx', make_package({
+            'xl/workbook.xml': '<workbook/>',
+            'xl/worksheets/sheet1.xml': '<worksheet/>',
+            'xl/worksheets/sheet2.xml': '<worksheet/>',
+        }))
+
+        deck = FileMetadata.objects.get(file_id=deck_id)
+        self.assertEqual((deck.page_count, deck.snippet, deck.title), (3, 'Welcome Agenda Thanks', None))
+        self.assertEqual(FileMetadata.objects.get(file_id=book_id).page_count, 2)
+
+    @patch('share.processing.process_executor')
+    def test_upload_hands_job_to_pool(self, executor):
+        """Test the upload request only queues the extraction on the worker pool"""
+        patcher = patch('share.processing.POST_UPLOAD_WORKERS', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        file_id = self.upload('plan.docx', make_ooxml())
+
+        executor.submit.assert_called_once()
+        self.assertEqual(executor.submit.call_args.args[1], file_id)
+        self.assertFalse(FileMetadata.objects.exists())
+
+    def test_processing_disabled(self):
+        """Test uploads inside processing_disabled() queue no extraction"""
+        with processing_disabled():
+            self.upload('plan.docx', make_ooxml())
+
+        self.assertFalse(FileMetadata.objects.exists())
+        self.upload('plan.docx', make_ooxml())
+        self.assertEqual(FileMetadata.objects.count(), 1)
+
+    def test_unreadable_file_recorded_and_backfilled(self):
+        """Test extraction failures are recorded and process_files fills in missing metadata"""
+        broken = File.objects.create(owner=self.ops_user, file_name=SimpleUploadedFile('broken.docx', b'not a zip'), original_name='broken.docx')
+        good = File.objects.create(owner=self.ops_user, file_name=SimpleUploadedFile('good.docx', make_package({
+            'docProps/core.xml': CORE_XML.format(description=''),
+            'word/document.xml': '<w:document xmlns:w="w"><w:t>Hello</w:t> <w:t>world</w:t></w:document>',
+        })), original_name='good.docx')
+        out = io.StringIO()
+
+        with self.assertLogs('share.processing', 'WARNING') as logs:
+            call_command('process_files', stdout=out)
+
+        self.assertEqual(logs.output, [
+            f'WARNING:share.processing:Could not read metadata of file {broken.id}: File is not a zip file'
+        ])
+        self.assertIn('Processed 2 file(s), 1 without readable metadata', out.getvalue())
+        self.assertIsNotNone(FileMetadata.objects.get(file=broken).error)
+        self.assertEqual(FileMetadata.objects.get(file=good).snippet, 'Hello world')
+        call_command('process_files', stdout=out)
+        self.assertIn('Processed 0 file(s)', out.getvalue())
+
+
+class ShardedMediaTestCase(ShareFixtureMixin, TestCase):
+    def flat_file(self, name, content=None, original_name=True):
+        name = default_storage.save(name, ContentFile(content or self.test_file_content))
+        self.addCleanup(default_storage.delete, name)
+        return File.objects.create(
+            owner=self.ops_user, file_name=name, original_name=name if original_name else None
+        )
+
+    def test_new_uploads_are_sharded(self):
+        """Test direct and chunked uploads land in ab/cd/<uuid>.<ext>"""
+        self.client.force_login(self.ops_user)
+        file_id = self.client.post('/api/upload/', {'file': SimpleUploadedFile('Deck.DOCX', self.test_file_content)}).json()['file_id']
+        upload_id = self.client.post(
+            '/api/uploads/', json.dumps({'filename': 'book.xlsx', 'size': 4}), content_type='application/json'
+        ).json()['upload_id']
+
+        self.assertRegex(File.objects.get(id=file_id).file_name.name, SHARDED_NAME_PATTERN)
+        self.assertTrue(File.objects.get(id=file_id).file_name.name.endswith('.docx'))
+        self.assertRegex(UploadSession.objects.get(upload_id=upload_id).file_name.name, SHARDED_NAME_PATTERN)
+
+    def test_shard_media_moves_flat_files(self):
+        """Test shard_media moves flat files, shares one target per name and is resumable"""
+        first = self.flat_file('flat-one.docx')
+        second = File.objects.create(owner=self.ops_user, file_name=first.file_name.name, original_name='copy.docx')
+        other = self.flat_file('flat-two.pptx', b'other bytes')
+        lost = File.objects.create(owner=self.ops_user, file_name='gone.docx', original_name='gone.docx')
+        # A link left behind by an interrupted run is reused, not duplicated.
+        link_into_shard(other.file_name.name)
+        out = io.StringIO()
+
+        call_command('shard_media', '--grace', '0', '--batch-size', '2', stdout=out)
+
+        self.assertIn('Moved 3 file(s); 1 stored name(s) were missing', out.getvalue())
+        first.refresh_from_db(), second.refresh_from_db(), other.refresh_from_db(), lost.refresh_from_db()
+        self.assertRegex(first.file_name.name, SHARDED_NAME_PATTERN)
+        self.assertEqual(first.file_name.name, second.file_name.name)
+        self.assertEqual(lost.file_name.name, 'gone.docx')
+        self.assertFalse(default_storage.exists('flat-one.docx'))
+        self.assertFalse(default_storage.exists('flat-two.pptx'))
+        with default_storage.open(other.file_name.name) as f:
+            self.assertEqual(f.read(), b'other bytes')
+        self.addCleanup(default_storage.delete, first.file_name.name)
+        self.addCleanup(default_storage.delete, other.file_name.name)
+
+        call_command('shard_media', '--grace', '0', stdout=out)
+        self.assertIn('Moved 0 file(s)', out.getvalue())
+
+    def test_shard_media_keeps_display_name(self):
+        """Test rows without an original name keep showing and matching their old basename"""
+        file_obj = self.flat_file('legacy/Quarterly Report.docx', original_name=False)
+        named = self.flat_file('legacy/named.docx')
+
+        call_command('shard_media', '--grace', '0', stdout=io.StringIO())
+
+        file_obj.refresh_from_db(), named.refresh_from_db()
+        self.addCleanup(default_storage.delete, file_obj.file_name.name)
+        self.addCleanup(default_storage.delete, named.file_name.name)
+        self.assertRegex(file_obj.file_name.name, SHARDED_NAME_PATTERN)
+        self.assertEqual(file_obj.original_name, 'Quarterly Report.docx')
+        self.assertEqual(file_obj.search_name, 'quarterly report.docx')
+        self.assertEqual(named.original_name, 'legacy/named.docx')
+
+    def test_upload_to_fills_original_name(self):
+        """Test saving a File without an original name records the uploaded one"""
+        file_obj = File(owner=self.ops_user)
+        file_obj.file_name.save('Board Deck.pptx', ContentFile(self.test_file_content))
+        self.addCleanup(default_storage.delete, file_obj.file_name.name)
+
+        file_obj.refresh_from_db()
+        self.assertRegex(file_obj.file_name.name, SHARDED_NAME_PATTERN)
+        self.assertEqual(file_obj.original_name, 'Board Deck.pptx')
+
+    def test_downloads_work_during_move(self):
+        """Test a link issued before the move still downloads afterwards, and the old name survives the grace period"""
+        file_obj = self.flat_file('flat-three.docx')
+        self.client.force_login(self.client_user)
+        link = self.client.get(f'/api/download-file/{file_obj.id}/').json()['download-link']
+
+        with patch('share.management.commands.shard_media.time.sleep'):
+            old_name = file_obj.file_name.name
+            call_command('shard_media', '--grace', '3600', stdout=io.StringIO())
+        file_obj.refresh_from_db()
+        self.addCleanup(default_storage.delete, file_obj.file_name.name)
+
+        response = self.client.get(link)
+        self.assertEqual(b''.join(response.streaming_content), self.test_file_content)
+        response.close()
+        self.assertTrue(default_storage.exists(old_name))
+
+
+class SharedStorageTestCase(ShareFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir, ignore_errors=True)
+        patcher = patch('ezshare.metrics.store', MetricsStore(self.metrics_dir))
+        self.store = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.cache_dir, self.remote_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.remote_dir, ignore_errors=True)
+        storages = override_settings(STORAGES={
+            'default': {
+                'BACKEND': 'share.storage.CachedStorage',
+                'OPTIONS': {
+                    'location': self.cache_dir,
+                    'remote_options': {'location': self.remote_dir},
+                    'max_size': 1024 * 1024,
+                },
+            },
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        storages.enable()
+        self.addCleanup(storages.disable)
+        self.addCleanup(self.wait_for_eviction)
+
+    def wait_for_eviction(self):
+        if default_storage.evictor is not None:
+            default_storage.evictor.join(5)
+
+    def upload(self, content=None, filename='shared.docx'):
+        self.client.force_login(self.ops_user)
+        file_id = self.client.post('/api/upload/', {'file': SimpleUploadedFile(filename, content or self.test_file_content)}).json()['file_id']
+        return File.objects.get(id=file_id)
+
+    def padded(self, size):
+        buffer = io.BytesIO(make_ooxml())
+        with zipfile.ZipFile(buffer, 'a') as package:
+            package.writestr('word/media/padding.bin', os.urandom(size))
+        return buffer.getvalue()
+
+    def link(self, file_obj):
+        self.client.force_login(self.client_user)
+        return self.client.get(f'/api/download-file/{file_obj.id}/').json()['download-link']
+
+    def counters(self):
+        return self.store.snapshot()['counters']
+
+    def test_upload_is_published(self):
+        """Test uploads are written to the shared store as well as the local cache"""
+        file_obj = self.upload()
+
+        with open(os.path.join(self.remote_dir, file_obj.file_name.name), 'rb') as f:
+            self.assertEqual(f.read(), self.test_file_content)
+        self.assertTrue(default_storage.is_cached(file_obj.file_name.name))
+
+    def test_miss_streams_and_fills(self):
+        """Test a download missing from the cache streams from the shared store and fills the cache"""
+        file_obj = self.upload()
+        os.remove(default_storage.local_path(file_obj.file_name.name))
+        link = self.link(file_obj)
+
+        response = self.client.get(link)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(self.test_file_content)))
+        self.assertEqual(b''.join(response.streaming_content), self.test_file_content)
+        response.close()
+        self.assertTrue(default_storage.is_cached(file_obj.file_name.name))
+        self.assertEqual(self.counters().get('ezshare_storage_cache_total|miss'), 1)
+
+        response = self.client.get(link)
+        self.assertEqual(b''.join(response.streaming_content), self.test_file_content)
+        response.close()
+        self.assertEqual(self.counters().get('ezshare_storage_cache_total|hit'), 1)
+
+    @override_settings(ROOT_URLCONF='share.tests')
+    async def test_async_miss_streams_and_fills(self):
+        """Test the async download view streams a miss without blocking and fills the cache"""
+        file_obj = await sync_to_async(File.objects.create)(
+            owner=self.ops_user, file_name=SimpleUploadedFile('shared.docx', self.test_file_content), original_name='shared.docx'
+        )
+        await sync_to_async(default_storage.publish)(file_obj.file_name.name)
+        os.remove(default_storage.local_path(file_obj.file_name.name))
+        client = AsyncClient()
+        await client.aforce_login(self.client_user)
+        link = (await client.get(f'/api/download-file/{file_obj.id}/')).json()['download-link']
+
+        response = await client.get(link)
+
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.test_file_content)
+        self.assertTrue(default_storage.is_cached(file_obj.file_name.name))
+
+    def test_chunked_upload_on_another_node(self):
+        """Test chunks and finalize sent to a node without the upload's file get a 409"""
+        self.client.force_login(self.ops_user)
+        upload_id = self.client.post(
+            '/api/uploads/', json.dumps({'filename': 'shared.docx', 'size': len(self.test_file_content)}),
+            content_type='application/json'
+        ).json()['upload_id']
+        self.client.put(f'/api/uploads/{upload_id}/?offset=0', self.test_file_content, content_type='application/octet-stream')
+        # Another node shares the database and the remote store, not this cache.
+        os.remove(default_storage.local_path(UploadSession.objects.get(upload_id=upload_id).file_name.name))
+
+        response = self.client.put(f'/api/uploads/{upload_id}/?offset=0', self.test_file_content, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(File.objects.exists())
+
+    @override_settings(ROOT_URLCONF='share.tests')
+    async def test_async_fill_runs_off_the_event_loop(self):
+        """Test the async view fetches ranged and nginx misses in an executor thread"""
+        file_obj = await sync_to_async(File.objects.create)(
+            owner=self.ops_user, file_name=SimpleUploadedFile('shared.docx', self.test_file_content), original_name='shared.docx'
+        )
+        name = file_obj.file_name.name
+        await sync_to_async(default_storage.publish)(name)
+        client = AsyncClient()
+        await client.aforce_login(self.client_user)
+        link = (await client.get(f'/api/download-file/{file_obj.id}/')).json()['download-link']
+        fill = default_storage.fill
+        fill_threads = []
+
+        def record_fill(name):
+            fill_threads.append(threading.get_ident())
+            fill(name)
+
+        with patch.object(default_storage, 'fill', record_fill):
+            os.remove(default_storage.local_path(name))
+            response = await client.get(link, headers={'Range': 'bytes=0-9'})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.test_file_content[:10])
+
+            os.remove(default_storage.local_path(name))
+            with patch('share.delivery.DOWNLOAD_BACKEND', 'nginx'):
+                response = await client.get(link)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('X-Accel-Redirect', response)
+
+        self.assertEqual(len(fill_threads), 2)
+        self.assertNotIn(threading.get_ident(), fill_threads)
+        self.assertTrue(default_storage.is_cached(name))
+
+    def test_bundle_streams_misses_lazily(self):
+        """Test a bundle fetches each missing file only when the stream reaches it"""
+        first = self.upload(self.padded(1024), 'first.docx')
+        second = self.upload(self.padded(2048), 'second.docx')
+        for file_obj in (first, second):
+            os.remove(default_storage.local_path(file_obj.file_name.name))
+        self.client.force_login(self.client_user)
+        link = self.client.post(
+            '/api/bundle-link/', json.dumps({'file_ids': [first.id, second.id]}), content_type='application/json'
+        ).json()['download-link']
+
+        response = self.client.get(link)
+
+        self.assertFalse(default_storage.is_cached(first.file_name.name))
+        self.assertFalse(default_storage.is_cached(second.file_name.name))
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            for file_obj in (first, second):
+                with default_storage.remote.open(file_obj.file_name.name) as f:
+                    self.assertEqual(archive.read(file_obj.original_name), f.read())
+        response.close()
+        self.assertTrue(default_storage.is_cached(first.file_name.name))
+        self.assertEqual(self.counters().get('ezshare_storage_cache_total|miss'), 2)
+
+    def test_ranged_miss_fills_first(self):
+        """Test a Range request on a miss is answered from the freshly filled cache"""
+        file_obj = self.upload()
+        os.remove(default_storage.local_path(file_obj.file_name.name))
+
+        response = self.client.get(self.link(file_obj), HTTP_RANGE='bytes=0-9')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.test_file_content[:10])
+        response.close()
+        self.assertTrue(default_storage.is_cached(file_obj.file_name.name))
+
+    def test_abandoned_fill_leaves_no_partial_file(self):
+        """Test a client disconnecting mid-fill leaves nothing in the cache"""
+        file_obj = self.upload(self.padded(600 * 1024), 'big.docx')
+        name = file_obj.file_name.name
+        os.remove(default_storage.local_path(name))
+
+        blocks = default_storage.iter_fill(name)
+        next(blocks)
+        blocks.close()
+
+        self.assertEqual(os.listdir(os.path.dirname(default_storage.local_path(name))), [])
+
+    def test_eviction_runs_in_background(self):
+        """Test going past the size limit evicts on one background thread without holding the lock"""
+        old = self.upload(self.padded(600 * 1024), 'old.docx')
+        self.wait_for_eviction()
+        path = default_storage.local_path(old.file_name.name)
+        os.utime(path, (datetime.datetime(2020, 1, 1).timestamp(), os.stat(path).st_mtime))
+        checking, release = threading.Event(), threading.Event()
+        remote_size = default_storage.remote.size
+
+        def slow_size(name):
+            checking.set()
+            release.wait(5)
+            return remote_size(name)
+
+        with patch.object(default_storage.remote, 'size', slow_size):
+            recent = self.upload(self.padded(600 * 1024), 'recent.docx')
+            self.assertTrue(checking.wait(5))
+            evictor = default_storage.evictor
+            self.assertNotEqual(evictor.ident, threading.get_ident())
+            # Fills and uploads carry on while the shared store is asked.
+            self.assertTrue(default_storage.lock.acquire(timeout=1))
+            default_storage.lock.release()
+            default_storage.added(0)
+            self.assertIs(default_storage.evictor, evictor)
+            release.set()
+            self.wait_for_eviction()
+
+        self.assertFalse(default_storage.is_cached(old.file_name.name))
+        self.assertTrue(default_storage.is_cached(recent.file_name.name))
+        self.assertEqual(self.counters().get('ezshare_storage_cache_total|evict'), 1)
+
+    def test_eviction_keeps_unpublished_files(self):
+        """Test the least recently used published files are evicted and unpublished ones kept"""
+        old = self.upload(self.padded(400 * 1024), 'old.docx')
+        recent = self.upload(self.padded(400 * 1024), 'recent.docx')
+        unpublished = default_storage.save('in-progress.docx', ContentFile(os.urandom(300 * 1024)))
+        past = datetime.datetime(2020, 1, 1).timestamp()
+        for name in (old.file_name.name, unpublished):
+            path = default_storage.local_path(name)
+            os.utime(path, (past, os.stat(path).st_mtime))
+        self.wait_for_eviction()
+
+        out = io.StringIO()
+        call_command('evict_storage_cache', stdout=out)
+
+        self.assertIn('Evicted 1 file(s).', out.getvalue())
+
+        self.assertFalse(default_storage.is_cached(old.file_name.name))
+        self.assertTrue(default_storage.is_cached(recent.file_name.name))
+        self.assertTrue(default_storage.is_cached(unpublished))
+        self.assertEqual(self.counters().get('ezshare_storage_cache_total|evict'), 1)
+        # Evicted files still download, straight from the shared store.
+        response = self.client.get(self.link(old))
+        self.assertEqual(response.status_code, 200)
+        with default_storage.remote.open(old.file_name.name) as f:
+            self.assertEqual(b''.join(response.streaming_content), f.read())
+        response.close()
@@ -0,0 +1,78 @@
+import time
+import hmac
+import base64
+import hashlib
+import functools
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from django.conf import settings
+
+
+# 'fernet' mints MultiFernet tokens; 'hmac' mints compact HMAC-SHA256 tokens.
+# Both formats are always accepted, so switching formats does not break links.
+DOWNLOAD_TOKEN_FORMAT = getattr(settings, 'DOWNLOAD_TOKEN_FORMAT', 'fernet')
+DOWNLOAD_TOKEN_TTL = getattr(settings, 'DOWNLOAD_TOKEN_TTL', None)
+DOWNLOAD_TOKEN_CACHE_SIZE = getattr(settings, 'DOWNLOAD_TOKEN_CACHE_SIZE', 4096)
+HMAC_DIGEST_BYTES = 16
+
+
+def derive_key(label):
+    """Stable per-deployment key so every worker and node agrees without config."""
+    return hashlib.sha256(f'ezshare.{label}:{settings.SECRET_KEY}'.encode()).digest()
+
+
+def load_fernet():
+    keys = getattr(settings, 'FERNET_KEYS', None) or [base64.urlsafe_b64encode(derive_key('fernet'))]
+    return MultiFernet([Fernet(key) for key in keys])
+
+
+def load_signing_keys():
+    keys = getattr(settings, 'DOWNLOAD_SIGNING_KEYS', None)
+    return [key.encode() for key in keys] if keys else [derive_key('signing')]
+
+
+# The first key of each keyring signs; the rest only verify (rotation).
+fernet = load_fernet()
+signing_keys = load_signing_keys()
+
+
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def hmac_digest(key, body):
+    return hmac.new(key, body.encode(), hashlib.sha256).digest()[:HMAC_DIGEST_BYTES]
+
+
+def sign_token(payload):
+    if DOWNLOAD_TOKEN_FORMAT != 'hmac':
+        return fernet.encrypt(payload.encode()).decode()
+    expires = int(time.time() + DOWNLOAD_TOKEN_TTL) if DOWNLOAD_TOKEN_TTL else 0
+    body = b64encode(f'{payload}|{expires}'.encode())
+    return f'{body}.{b64encode(hmac_digest(signing_keys[0], body))}'
+
+
+@functools.lru_cache(maxsize=DOWNLOAD_TOKEN_CACHE_SIZE)
+def _unsign(token):
+    """Return ``(payload, expires_at)``; failures raise and are not cached."""
+    if '.' not in token:
+        payload = fernet.decrypt(token.encode()).decode()
+        expires = fernet.extract_timestamp(token.encode()) + DOWNLOAD_TOKEN_TTL if DOWNLOAD_TOKEN_TTL else 0
+        return payload, expires
+    body, signature = token.split('.', 1)
+    signature = b64decode(signature)
+    if not any(hmac.compare_digest(hmac_digest(key, body), signature) for key in signing_keys):
+        raise InvalidToken
+    payload, expires = b64decode(body).decode().rsplit('|', 1)
+    return payload, int(expires)
+
+
+def verify_token(token):
+    """Return the payload signed into ``token`` or raise ``InvalidToken``."""
+    payload, expires = _unsign(token)
+    if expires and expires < time.time():
+        raise InvalidToken
+    return payload
@@ -0,0 +1,76 @@
+import os
+import hashlib
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from .uploads import (
+    ALLOWED_EXTENSIONS, MAX_NAME_LENGTH, UPLOAD_MAX_FILE_SIZE, OOXMLSniffer, reserve_storage_name
+)
+
+
+class StoredUploadedFile(UploadedFile):
+    """An upload already written to ``storage_name`` in default storage."""
+
+    def __init__(self, name, storage_name, size, sha256, content_type=None):
+        super().__init__(None, name, content_type, size)
+        self.storage_name = storage_name
+        self.sha256 = sha256
+
+
+class OOXMLUploadHandler(FileUploadHandler):
+    """Stream an OOXML upload straight into storage in a single pass.
+
+    Each chunk is hashed and written to the file's final storage name as it
+    arrives. The zip signature is checked on the first bytes and the package
+    part names are matched on the fly, so a mismatching upload is aborted
+    without reading the rest of the body. The reason is left on
+    ``request.upload_rejection``.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.storage_name = None
+        self.ext = os.path.splitext(self.file_name or '')[1].lower()
+        if self.ext not in ALLOWED_EXTENSIONS:
+            self.reject('Invalid file type.')
+        if len(self.file_name) > MAX_NAME_LENGTH:
+            self.reject('File name too long.')
+        if self.content_length and self.content_length > UPLOAD_MAX_FILE_SIZE:
+            self.reject('File too large.')
+        self.storage_name = reserve_storage_name(self.file_name)
+        self.file = open(default_storage.path(self.storage_name), 'wb')
+        self.digest = hashlib.sha256()
+        self.sniffer = OOXMLSniffer(self.ext)
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > UPLOAD_MAX_FILE_SIZE:
+            self.reject('File too large.')
+        if not self.sniffer.feed(raw_data):
+            self.reject('File content does not match its type.')
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        self.file.close()
+        if not self.sniffer.matches():
+            self.reject('File content does not match its type.')
+        return StoredUploadedFile(
+            self.file_name, self.storage_name, file_size,
+            self.digest.hexdigest(), self.content_type
+        )
+
+    def upload_interrupted(self):
+        self.discard()
+
+    def discard(self):
+        if getattr(self, 'storage_name', None):
+            if not self.file.closed:
+                self.file.close()
+            default_storage.delete(self.storage_name)
+            self.storage_name = None
+
+    def reject(self, message):
+        self.discard()
+        self.request.upload_rejection = message
+        raise StopUpload(connection_reset=True)
@@ -0,0 +1,140 @@
+import os
+import hashlib
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from .models import UploadChunk, shard_name
+
+
+UPLOAD_MAX_CHUNK_SIZE = getattr(settings, 'UPLOAD_MAX_CHUNK_SIZE', 8 * 1024 * 1024)
+UPLOAD_MAX_FILE_SIZE = getattr(settings, 'UPLOAD_MAX_FILE_SIZE', 1024 * 1024 * 1024)
+ALLOWED_EXTENSIONS = ['.pptx', '.docx', '.xlsx']
+# File.original_name and UploadSession.original_name hold at most this many characters.
+MAX_NAME_LENGTH = 255
+WRITE_BLOCK_SIZE = 64 * 1024
+
+ZIP_SIGNATURE = b'PK\x03\x04'
+CONTENT_TYPES_PART = b'[Content_Types].xml'
+# Every OOXML package of a given type has parts under this folder.
+MAIN_PART_PREFIXES = {
+    '.docx': b'word/',
+    '.pptx': b'ppt/',
+    '.xlsx': b'xl/',
+}
+
+
+class ChunkError(Exception):
+    pass
+
+
+class UploadNotLocal(Exception):
+    """The session's file is being written on another app node."""
+
+
+class OOXMLSniffer:
+    """Check that bytes fed in order look like an OOXML package of type ``ext``.
+
+    The zip signature is checked on the first bytes and the package part
+    names are matched as they pass, so a mismatch shows up without reading
+    the rest of the content.
+    """
+
+    def __init__(self, ext):
+        self.head = b''
+        self.tail = b''
+        self.pending_markers = {CONTENT_TYPES_PART, MAIN_PART_PREFIXES[ext]}
+
+    def feed(self, data):
+        """Take the next bytes; False once the content cannot match."""
+        if len(self.head) < len(ZIP_SIGNATURE):
+            self.head += data[:len(ZIP_SIGNATURE) - len(self.head)]
+            if not ZIP_SIGNATURE.startswith(self.head):
+                return False
+        if self.pending_markers:
+            window = self.tail + data
+            self.pending_markers = {m for m in self.pending_markers if m not in window}
+            self.tail = window[-len(CONTENT_TYPES_PART):]
+        return True
+
+    def matches(self):
+        return self.head == ZIP_SIGNATURE and not self.pending_markers
+
+
+def is_ooxml(path, ext):
+    """True if the file at ``path`` looks like an OOXML package of type ``ext``."""
+    sniffer = OOXMLSniffer(ext)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(WRITE_BLOCK_SIZE), b''):
+            if not sniffer.feed(block):
+                return False
+            if sniffer.matches():
+                return True
+    return sniffer.matches()
+
+
+def reserve_storage_name(original_name):
+    """Create the empty final file, under a sharded name, so chunks can be written into place."""
+    return default_storage.save(shard_name(original_name), ContentFile(b''))
+
+
+def local_upload_path(session):
+    """Local path of the file the session's chunks are written into.
+
+    Chunks are written in place, so only the node that started the upload
+    has the file until it is finalized; anywhere else this raises
+    ``UploadNotLocal``.
+    """
+    storage = session.file_name.storage
+    # CachedStorage.path would look the name up in the shared store first.
+    path = getattr(storage, 'local_path', storage.path)(session.file_name.name)
+    if not os.path.exists(path):
+        raise UploadNotLocal('Upload is in progress on another server.')
+    return path
+
+
+def write_chunk(session, offset, stream, length, expected_sha256=None):
+    """Write ``length`` bytes from ``stream`` at ``offset`` of the session's file.
+
+    The body is hashed as it is written; a mismatch with ``expected_sha256``
+    raises ``ChunkError`` and the chunk is not recorded, so the client can
+    simply resend it.
+    """
+    if offset < 0 or length <= 0 or length > UPLOAD_MAX_CHUNK_SIZE:
+        raise ChunkError('Invalid chunk size.')
+    if offset + length > session.total_size:
+        raise ChunkError('Chunk exceeds declared file size.')
+
+    digest = hashlib.sha256()
+    written = 0
+    with open(local_upload_path(session), 'r+b') as out:
+        out.seek(offset)
+        while written < length:
+            block = stream.read(min(WRITE_BLOCK_SIZE, length - written))
+            if not block:
+                break
+            digest.update(block)
+            out.write(block)
+            written += len(block)
+    if written != length:
+        raise ChunkError('Incomplete chunk body.')
+
+    checksum = digest.hexdigest()
+    if expected_sha256 and expected_sha256.lower() != checksum:
+        raise ChunkError('Chunk checksum mismatch.')
+    return UploadChunk.objects.create(session=session, offset=offset, size=length, sha256=checksum)
+
+
+def received_ranges(session):
+    """Merged ``[start, end)`` byte ranges received so far."""
+    merged = []
+    for offset, size in session.chunks.order_by('offset').values_list('offset', 'size'):
+        end = offset + size
+        if merged and offset <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([offset, end])
+    return merged
+
+
+def is_complete(session):
+    return received_ranges(session) == [[0, session.total_size]]
@@ -1,9 +1,16 @@
 from django.urls import path
+from django.conf import settings
 from . import views
 
 urlpatterns = [
     path('upload/', views.upload_file, name='upload_file'),
-    path('list/', views.list_files, name='list_files'),
-    path('download-file/<int:file_id>/', views.download_file, name='download_file'),
-    path('secure-download/<str:token>/', views.secure_download, name='secure_download'),
+    path('uploads/', views.create_upload_session, name='create_upload_session'),
+    path('uploads/<uuid:upload_id>/', views.upload_chunk, name='upload_chunk'),
+    path('uploads/<uuid:upload_id>/finalize/', views.finalize_upload, name='finalize_upload'),
+    path('list/', views.alist_files if settings.ASYNC_VIEWS else views.list_files, name='list_files'),
+    path('download-file/<int:file_id>/', views.adownload_file if settings.ASYNC_VIEWS else views.download_file, name='download_file'),
+    path('download-links/', views.download_links, name='download_links'),
+    path('secure-download/<str:token>/', views.asecure_download if settings.ASYNC_VIEWS else views.secure_download, name='secure_download'),
+    path('bundle-link/', views.bundle_link, name='bundle_link'),
+    path('secure-bundle/<str:token>/', views.secure_bundle, name='secure_bundle'),
 ]
\ No newline at end of file
@@ -1,26 +1,238 @@
 import os
-from django.http import JsonResponse, FileResponse, HttpResponseForbidden, HttpResponse
+from django.http import JsonResponse, HttpResponseForbidden, HttpResponse, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.conf import settings
 from django.contrib.auth.models import User
-from user_auth.models import Role
-from .models import File
+from user_auth.roles import get_user_role, aget_user_role
+from .models import File, UploadSession
+from .uploads import (
+    ALLOWED_EXTENSIONS, MAX_NAME_LENGTH, UPLOAD_MAX_FILE_SIZE, ChunkError, UploadNotLocal,
+    reserve_storage_name, write_chunk, received_ranges, is_complete, local_upload_path, is_ooxml
+)
+from .delivery import file_download_response, afile_download_response
+from .access_log import record_access, arecord_access
+from .upload_handlers import OOXMLUploadHandler
+from .tokens import fernet, sign_token, verify_token
+from .bundles import BUNDLE_MAX_FILES, zip_bundle_response
+from .blobs import create_file_from_upload, create_file_from_storage
+from .processing import enqueue_processing
 from django.core.files.storage import default_storage
 from django.urls import reverse
-from cryptography.fernet import Fernet
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from ezshare.query_budget import query_budget
 import datetime
+import base64
+import json
 
 
-FERNET_KEY = os.environ.get('FERNET_KEY', Fernet.generate_key())
-fernet = Fernet(FERNET_KEY)
+LIST_PAGE_SIZE = getattr(settings, 'LIST_PAGE_SIZE', 100)
+LIST_MAX_PAGE_SIZE = getattr(settings, 'LIST_MAX_PAGE_SIZE', 1000)
+LIST_STREAM_CHUNK_SIZE = getattr(settings, 'LIST_STREAM_CHUNK_SIZE', 2000)
+BULK_LINK_MAX_FILES = getattr(settings, 'BULK_LINK_MAX_FILES', 500)
+LIST_FIELDS = (
+    'id', 'file_name', 'original_name', 'file_size_kb', 'last_opened', 'created_at', 'search_name',
+    'metadata__title', 'metadata__author', 'metadata__page_count', 'metadata__modified_at', 'metadata__snippet',
+)
+# ?sort= names (prefix with - for descending) and the indexed columns behind them.
+SORT_FIELDS = {
+    'created_at': 'created_at',
+    'name': 'search_name',
+    'size': 'file_size_kb',
+    'last_opened': 'last_opened',
+}
+DATETIME_SORT_FIELDS = ('created_at', 'last_opened')
 
-def get_user_role(user):
-    role_obj = Role.objects.filter(user=user).last()
-    return role_obj.role if role_obj else None
 
+def encode_cursor(value, file_id, field='created_at', descending=False):
+    """An opaque cursor after ``(value, file_id)``, tied to the sort it came from."""
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    sort = f'-{field}' if descending else field
+    return base64.urlsafe_b64encode(json.dumps([sort, value, file_id]).encode()).decode()
 
+
+def decode_cursor(cursor, field, descending):
+    """``(value, file_id)`` from a cursor of the same sort; ValueError otherwise."""
+    sort, value, file_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if sort != (f'-{field}' if descending else field):
+        raise ValueError('Cursor is for a different sort.')
+    if value is not None:
+        if field in DATETIME_SORT_FIELDS:
+            value = datetime.datetime.fromisoformat(value)
+        elif field == 'file_size_kb':
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise ValueError(value)
+        elif not isinstance(value, str):
+            raise ValueError(value)
+    return value, int(file_id)
+
+
+def parse_when(value):
+    """An ISO 8601 datetime or date; naive values are taken as UTC."""
+    when = parse_datetime(value)
+    if when is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        when = datetime.datetime.combine(day, datetime.time())
+    if settings.USE_TZ and timezone.is_naive(when):
+        when = timezone.make_aware(when, datetime.timezone.utc)
+    return when
+
+
+# ?param= -> (lookup, parser) for the list filters.
+LIST_FILTERS = {
+    'owner': ('owner_id', int),
+    'min_size_kb': ('file_size_kb__gte', int),
+    'max_size_kb': ('file_size_kb__lte', int),
+    'created_after': ('created_at__gte', parse_when),
+    'created_before': ('created_at__lt', parse_when),
+    'opened_after': ('last_opened__gte', parse_when),
+    'opened_before': ('last_opened__lt', parse_when),
+}
+
+
+def serialize_file(row):
+    return {
+        'id': row['id'],
+        'file_name': row['original_name'] or os.path.basename(row['file_name'] or ''),
+        'file_size_kb': row['file_size_kb'],
+        'last_opened': row['last_opened'],
+        'title': row['metadata__title'],
+        'author': row['metadata__author'],
+        'page_count': row['metadata__page_count'],
+        'modified_at': row['metadata__modified_at'],
+        'snippet': row['metadata__snippet'],
+    }
+
+
+def stream_file_list(files, field='created_at', descending=False):
+    """Stream every row of ``files`` as one JSON document.
+
+    Reads keyset pages of LIST_STREAM_CHUNK_SIZE rows rather than one big
+    query: mysqlclient buffers a whole result set client-side, even under
+    ``iterator()``.
+    """
+    encoder = DjangoJSONEncoder()
+    yield '{"files": ['
+    page = files
+    separator = ''
+    while True:
+        rows = list(page[:LIST_STREAM_CHUNK_SIZE])
+        for row in rows:
+            yield separator + encoder.encode(serialize_file(row))
+            separator = ', '
+        if len(rows) < LIST_STREAM_CHUNK_SIZE:
+            break
+        page = files.filter(after_cursor(field, descending, rows[-1][field], rows[-1]['id']))
+    yield ']}'
+
+
+def catalogue_files(request):
+    """Active files matching the list filters, in the requested order:
+    ``(files, sort_field, descending, error_response)``."""
+    files = File.objects.filter(status=True)
+    for param, (lookup, parse) in LIST_FILTERS.items():
+        value = request.GET.get(param)
+        if not value:
+            continue
+        try:
+            files = files.filter(**{lookup: parse(value)})
+        except ValueError:
+            return files, None, False, JsonResponse({'message': f'Invalid {param}.'}, status=400)
+
+    # search_name is already lower-case; the case-insensitive lookups compile to a
+    # plain LIKE on MySQL, which can use the index for a prefix.
+    prefix = request.GET.get('prefix')
+    if prefix:
+        files = files.filter(search_name__istartswith=prefix.lower())
+    search = request.GET.get('q')
+    if search:
+        files = files.filter(search_name__icontains=search.lower())
+
+    sort = request.GET.get('sort', 'created_at')
+    descending = sort.startswith('-')
+    field = SORT_FIELDS.get(sort.lstrip('-'))
+    if field is None:
+        return files, None, False, JsonResponse({'message': 'Invalid sort.'}, status=400)
+    if descending:
+        files = files.order_by(f'-{field}', '-id')
+    else:
+        files = files.order_by(field, 'id')
+    return files.values(*LIST_FIELDS), field, descending, None
+
+
+def after_cursor(field, descending, value, file_id):
+    """Rows after ``(value, file_id)`` in ``field`` order; NULL sorts lowest, as
+    it does on MySQL and SQLite."""
+    if value is None:
+        if descending:
+            return Q(**{f'{field}__isnull': True, 'id__lt': file_id})
+        return Q(**{f'{field}__isnull': True, 'id__gt': file_id}) | Q(**{f'{field}__isnull': False})
+    if descending:
+        return (
+            Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': file_id})
+            | Q(**{f'{field}__isnull': True})
+        )
+    return Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': file_id})
+
+
+def paginate_files(request, files, field='created_at', descending=False):
+    """Apply ``page_size``/``cursor`` to ``files``: ``(files, page_size, error_response)``."""
+    try:
+        page_size = int(request.GET.get('page_size', LIST_PAGE_SIZE))
+    except ValueError:
+        return files, 0, JsonResponse({'message': 'Invalid page size.'}, status=400)
+    page_size = max(1, min(page_size, LIST_MAX_PAGE_SIZE))
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            value, file_id = decode_cursor(cursor, field, descending)
+            files = files.filter(after_cursor(field, descending, value, file_id))
+        except (ValueError, TypeError, UnicodeDecodeError):
+            return files, page_size, JsonResponse({'message': 'Invalid cursor.'}, status=400)
+    return files, page_size, None
+
+
+def file_page_response(rows, page_size, field='created_at', descending=False):
+    """``rows`` holds up to ``page_size + 1`` rows; the extra one signals a next page."""
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1][field], rows[-1]['id'], field, descending)
+    return JsonResponse({'files': [serialize_file(row) for row in rows], 'next_cursor': next_cursor})
+
+
+async def astream_file_list(files, field='created_at', descending=False):
+    """Async ``stream_file_list``."""
+    encoder = DjangoJSONEncoder()
+    yield '{"files": ['
+    page = files
+    separator = ''
+    while True:
+        rows = [row async for row in page[:LIST_STREAM_CHUNK_SIZE]]
+        for row in rows:
+            yield separator + encoder.encode(serialize_file(row))
+            separator = ', '
+        if len(rows) < LIST_STREAM_CHUNK_SIZE:
+            break
+        page = files.filter(after_cursor(field, descending, rows[-1][field], rows[-1]['id']))
+    yield ']}'
+
+
+def build_download_link(request, file_id):
+    token = sign_token(f"{request.user.id}:{file_id}")
+    return request.build_absolute_uri(reverse('secure_download', args=[token]))
+
+
+@query_budget(12)
 @login_required
 def upload_file(request):
     if request.method == 'POST':
@@ -28,43 +240,143 @@ def upload_file(request):
         if get_user_role(user) != 'Ops':
             return HttpResponseForbidden("Only Ops users can upload files.")
 
+        request.upload_handlers = [OOXMLUploadHandler(request)]
         file = request.FILES.get('file')
+        rejection = getattr(request, 'upload_rejection', None)
+        if rejection:
+            return JsonResponse({'message': rejection}, status=400)
         if not file:
             return JsonResponse({'message': 'No file provided.'}, status=400)
 
-        ext = os.path.splitext(file.name)[1].lower()
-        if ext not in ['.pptx', '.docx', '.xlsx']:
-            return JsonResponse({'message': 'Invalid file type.'}, status=400)
-
-        saved_file = File.objects.create(
-            owner=user,
-            file_name=file,
-            file_size_kb=file.size // 1024
-        )
+        saved_file = create_file_from_upload(user, file)
+        enqueue_processing(saved_file.id)
         return JsonResponse({'message': 'File uploaded successfully.', 'file_id': saved_file.id})
 
     return JsonResponse({'message': 'Invalid request method.'}, status=405)
 
 
+def get_upload_session(request, upload_id, lock=False):
+    sessions = UploadSession.objects.select_for_update() if lock else UploadSession.objects
+    try:
+        return sessions.get(upload_id=upload_id, owner=request.user, file__isnull=True)
+    except UploadSession.DoesNotExist:
+        return None
+
+
+@query_budget(4)
+@login_required
+def create_upload_session(request):
+    if request.method != 'POST':
+        return JsonResponse({'message': 'Invalid request method.'}, status=405)
+    if get_user_role(request.user) != 'Ops':
+        return HttpResponseForbidden("Only Ops users can upload files.")
+
+    try:
+        data = json.loads(request.body)
+        filename = os.path.basename(data['filename'])
+        total_size = int(data['size'])
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'message': 'Invalid upload details.'}, status=400)
+    if os.path.splitext(filename)[1].lower() not in ALLOWED_EXTENSIONS:
+        return JsonResponse({'message': 'Invalid file type.'}, status=400)
+    if len(filename) > MAX_NAME_LENGTH:
+        return JsonResponse({'message': 'File name too long.'}, status=400)
+    if not 0 < total_size <= UPLOAD_MAX_FILE_SIZE:
+        return JsonResponse({'message': 'Invalid file size.'}, status=400)
+
+    session = UploadSession.objects.create(
+        owner=request.user,
+        original_name=filename,
+        file_name=reserve_storage_name(filename),
+        total_size=total_size
+    )
+    return JsonResponse({'message': 'Upload session created.', 'upload_id': str(session.upload_id)})
+
+
+@query_budget(6)
+@login_required
+def upload_chunk(request, upload_id):
+    if get_user_role(request.user) != 'Ops':
+        return HttpResponseForbidden("Only Ops users can upload files.")
+    session = get_upload_session(request, upload_id)
+    if session is None:
+        return JsonResponse({'message': 'Upload session not found.'}, status=404)
+
+    if request.method == 'GET':
+        return JsonResponse({'size': session.total_size, 'received': received_ranges(session)})
+    if request.method != 'PUT':
+        return JsonResponse({'message': 'Invalid request method.'}, status=405)
+
+    try:
+        offset = int(request.GET['offset'])
+        length = int(request.headers['Content-Length'])
+    except (KeyError, ValueError):
+        return JsonResponse({'message': 'Offset and Content-Length are required.'}, status=400)
+    try:
+        chunk = write_chunk(session, offset, request, length, request.headers.get('X-Chunk-SHA256'))
+    except ChunkError as e:
+        return JsonResponse({'message': str(e)}, status=400)
+    except UploadNotLocal as e:
+        return JsonResponse({'message': str(e)}, status=409)
+    return JsonResponse({'message': 'Chunk stored.', 'sha256': chunk.sha256, 'received': received_ranges(session)})
+
+
+@query_budget(13)
+@login_required
+def finalize_upload(request, upload_id):
+    if request.method != 'POST':
+        return JsonResponse({'message': 'Invalid request method.'}, status=405)
+    if get_user_role(request.user) != 'Ops':
+        return HttpResponseForbidden("Only Ops users can upload files.")
+    # The row lock makes a concurrent finalize of the same session wait, then find it done.
+    with transaction.atomic():
+        session = get_upload_session(request, upload_id, lock=True)
+        if session is None:
+            return JsonResponse({'message': 'Upload session not found.'}, status=404)
+        ext = os.path.splitext(session.original_name)[1].lower()
+        if ext not in ALLOWED_EXTENSIONS:
+            return JsonResponse({'message': 'Invalid file type.'}, status=400)
+        if not is_complete(session):
+            return JsonResponse({'message': 'Upload incomplete.', 'received': received_ranges(session)}, status=409)
+        try:
+            path = local_upload_path(session)
+        except UploadNotLocal as e:
+            return JsonResponse({'message': str(e)}, status=409)
+        # The same check OOXMLUploadHandler runs on direct uploads, on the assembled file.
+        if not is_ooxml(path, ext):
+            default_storage.delete(session.file_name.name)
+            session.delete()
+            return JsonResponse({'message': 'File content does not match its type.'}, status=400)
+
+        saved_file = create_file_from_storage(
+            request.user, session.file_name.name, session.original_name, session.total_size
+        )
+        session.file = saved_file
+        session.save()
+        enqueue_processing(saved_file.id)
+    return JsonResponse({'message': 'File uploaded successfully.', 'file_id': saved_file.id})
+
+
+@query_budget(4)
 @login_required
 def list_files(request):
     user = request.user
     if get_user_role(user) != 'Client':
         return HttpResponseForbidden("Only Client users can list files.")
 
-    files = File.objects.filter(status=True)
-    file_list = [
-        {
-            'id': f.id,
-            'file_name': os.path.basename(f.file_name.name),
-            'file_size_kb': f.file_size_kb,
-            'last_opened': f.last_opened
-        }
-        for f in files
-    ]
-    return JsonResponse({'files': file_list})
+    files, field, descending, error = catalogue_files(request)
+    if error:
+        return error
+    if request.GET.get('all') in ('1', 'true'):
+        return StreamingHttpResponse(stream_file_list(files, field, descending), content_type='application/json')
+
+    files, page_size, error = paginate_files(request, files, field, descending)
+    if error:
+        return error
+    return file_page_response(list(files[:page_size + 1]), page_size, field, descending)
 
 
+@query_budget(4)
 @login_required
 def download_file(request, file_id):
     user = request.user
@@ -76,17 +388,34 @@ def download_file(request, file_id):
     except File.DoesNotExist:
         return JsonResponse({'message': 'File not found.'}, status=404)
 
-    
-    token = fernet.encrypt(f"{user.id}:{file_obj.id}".encode()).decode()
-    download_link = request.build_absolute_uri(
-        reverse('secure_download', args=[token])
-    )
-    return JsonResponse({'download-link': download_link, 'message': 'success'})
+    return JsonResponse({'download-link': build_download_link(request, file_obj.id), 'message': 'success'})
+
 
+@query_budget(4)
+@login_required
+def download_links(request):
+    if request.method != 'POST':
+        return JsonResponse({'message': 'Invalid request method.'}, status=405)
+    if get_user_role(request.user) != 'Client':
+        return HttpResponseForbidden("Only Client users can download files.")
+
+    try:
+        file_ids = [int(file_id) for file_id in json.loads(request.body)['file_ids']]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'message': 'Invalid file ids.'}, status=400)
+    if len(file_ids) > BULK_LINK_MAX_FILES:
+        return JsonResponse({'message': f'At most {BULK_LINK_MAX_FILES} files per request.'}, status=400)
+
+    found = set(File.objects.filter(id__in=file_ids, status=True).values_list('id', flat=True))
+    links = {file_id: build_download_link(request, file_id) for file_id in file_ids if file_id in found}
+    missing = [file_id for file_id in dict.fromkeys(file_ids) if file_id not in found]
+    return JsonResponse({'download-links': links, 'missing': missing, 'message': 'success'})
+
+@query_budget(5)
 @login_required
 def secure_download(request, token):
     try:
-        decrypted = fernet.decrypt(token.encode()).decode()
+        decrypted = verify_token(token)
         user_id, file_id = decrypted.split(':')
         if int(user_id) != request.user.id:
             return HttpResponseForbidden("This link is not for you.")
@@ -94,8 +423,103 @@ def secure_download(request, token):
     except Exception:
         return JsonResponse({'message': 'Invalid or expired link.'}, status=400)
 
-    file_path = file_obj.file_name.path
-    file_obj.last_opened = datetime.datetime.now()
-    file_obj.save()
-    response = FileResponse(open(file_path, 'rb'), as_attachment=True, filename=os.path.basename(file_path))
-    return response
\ No newline at end of file
+    record_access(file_obj.id)
+    return file_download_response(request, file_obj.file_name, file_obj.display_name())
+
+
+@query_budget(4)
+@login_required
+def bundle_link(request):
+    if request.method != 'POST':
+        return JsonResponse({'message': 'Invalid request method.'}, status=405)
+    if get_user_role(request.user) != 'Client':
+        return HttpResponseForbidden("Only Client users can download files.")
+
+    try:
+        file_ids = list(dict.fromkeys(int(file_id) for file_id in json.loads(request.body)['file_ids']))
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'message': 'Invalid file ids.'}, status=400)
+    if not 0 < len(file_ids) <= BUNDLE_MAX_FILES:
+        return JsonResponse({'message': f'A bundle holds 1 to {BUNDLE_MAX_FILES} files.'}, status=400)
+    found = set(File.objects.filter(id__in=file_ids, status=True).values_list('id', flat=True))
+    missing = [file_id for file_id in file_ids if file_id not in found]
+    if missing:
+        return JsonResponse({'message': 'File not found.', 'missing': missing}, status=404)
+
+    ids = ','.join(str(file_id) for file_id in file_ids)
+    token = sign_token(f"{request.user.id}:bundle:{ids}")
+    download_link = request.build_absolute_uri(reverse('secure_bundle', args=[token]))
+    return JsonResponse({'download-link': download_link, 'message': 'success'})
+
+
+@query_budget(5)
+@login_required
+def secure_bundle(request, token):
+    try:
+        decrypted = verify_token(token)
+        user_id, kind, ids = decrypted.split(':')
+        if kind != 'bundle':
+            raise ValueError(kind)
+        if int(user_id) != request.user.id:
+            return HttpResponseForbidden("This link is not for you.")
+        file_ids = [int(file_id) for file_id in ids.split(',')]
+        files = File.objects.in_bulk(file_ids)
+        if len(files) != len(file_ids):
+            raise File.DoesNotExist
+    except Exception:
+        return JsonResponse({'message': 'Invalid or expired link.'}, status=400)
+
+    record_access(*file_ids)
+    return zip_bundle_response([files[file_id] for file_id in file_ids])
+
+
+# Native async variants, routed instead of the sync views when ASYNC_VIEWS is set.
+
+@query_budget(4)
+@login_required
+async def alist_files(request):
+    user = await request.auser()
+    if await aget_user_role(user) != 'Client':
+        return HttpResponseForbidden("Only Client users can list files.")
+
+    files, field, descending, error = catalogue_files(request)
+    if error:
+        return error
+    if request.GET.get('all') in ('1', 'true'):
+        return StreamingHttpResponse(astream_file_list(files, field, descending), content_type='application/json')
+
+    files, page_size, error = paginate_files(request, files, field, descending)
+    if error:
+        return error
+    return file_page_response([row async for row in files[:page_size + 1]], page_size, field, descending)
+
+
+@query_budget(4)
+@login_required
+async def adownload_file(request, file_id):
+    user = await request.auser()
+    if await aget_user_role(user) != 'Client':
+        return HttpResponseForbidden("Only Client users can download files.")
+
+    if not await File.objects.filter(id=file_id, status=True).aexists():
+        return JsonResponse({'message': 'File not found.'}, status=404)
+
+    request.user = user
+    return JsonResponse({'download-link': build_download_link(request, file_id), 'message': 'success'})
+
+
+@query_budget(5)
+@login_required
+async def asecure_download(request, token):
+    user = await request.auser()
+    try:
+        decrypted = verify_token(token)
+        user_id, file_id = decrypted.split(':')
+        if int(user_id) != user.id:
+            return HttpResponseForbidden("This link is not for you.")
+        file_obj = await File.objects.aget(id=file_id, status=True)
+    except Exception:
+        return JsonResponse({'message': 'Invalid or expired link.'}, status=400)
+
+    await arecord_access(file_obj.id)
+    return await afile_download_response(request, file_obj.file_name, file_obj.display_name())
@@ -0,0 +1,28 @@
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from .roles import get_cached_user, aget_cached_user
+
+
+class EmailBackend(ModelBackend):
+    """Authenticate by email with exactly one password hash per attempt."""
+
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if email is None or password is None:
+            return None
+        user = User.objects.filter(email=email).first()
+        if user is None:
+            # Hash anyway so a missing account takes as long as a wrong password.
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        # Runs on every authenticated request; served from the user cache.
+        user = get_cached_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        user = await aget_cached_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
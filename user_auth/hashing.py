@@ -0,0 +1,23 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+# hashlib releases the GIL while hashing, so threads give real parallelism.
+PASSWORD_HASH_WORKERS = getattr(settings, 'PASSWORD_HASH_WORKERS', None) or os.cpu_count()
+hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+
+
+async def acheck_password(password, encoded):
+    """Verify ``password`` against ``encoded`` off the event loop.
+
+    Pure CPU work only: unlike ``User.check_password`` it never saves an
+    upgraded hash, so the pool threads never touch the database.
+    """
+    loop = asyncio.get_running_loop()
+    if encoded is None:
+        await loop.run_in_executor(hash_executor, hashers.make_password, password)
+        return False
+    return await loop.run_in_executor(hash_executor, hashers.check_password, password, encoded)
@@ -0,0 +1,92 @@
+import datetime
+import smtplib
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from .models import OutgoingEmail
+
+
+EMAIL_QUEUE_BATCH_SIZE = getattr(settings, 'EMAIL_QUEUE_BATCH_SIZE', 50)
+EMAIL_QUEUE_MAX_ATTEMPTS = getattr(settings, 'EMAIL_QUEUE_MAX_ATTEMPTS', 5)
+EMAIL_QUEUE_RETRY_BASE = getattr(settings, 'EMAIL_QUEUE_RETRY_BASE', 30)
+
+
+def queue_email(subject, body, to_email, from_email=None):
+    return OutgoingEmail.objects.create(
+        subject=subject,
+        body=body,
+        to_email=to_email,
+        from_email=from_email or settings.EMAIL_HOST_USER
+    )
+
+
+def claim_batch(batch_size):
+    """Lock up to ``batch_size`` due messages; concurrent workers skip locked rows."""
+    return list(
+        OutgoingEmail.objects.select_for_update(skip_locked=True)
+        .filter(sent_at__isnull=True, next_attempt_at__lte=timezone.now())
+        .order_by('next_attempt_at', 'id')[:batch_size]
+    )
+
+
+def deliver(connection, message):
+    """Send ``message``, reconnecting once if the server dropped the connection."""
+    try:
+        connection.send_messages([message])
+    except smtplib.SMTPServerDisconnected:
+        connection.close()
+        connection.open()
+        connection.send_messages([message])
+
+
+def send_batch(connection, batch_size=EMAIL_QUEUE_BATCH_SIZE):
+    """Send one batch over ``connection``, opening it only if anything is due.
+
+    Failed messages are retried with exponential backoff and given up
+    (soft-deleted) after EMAIL_QUEUE_MAX_ATTEMPTS. Returns ``(sent, failed)``.
+    """
+    sent = failed = 0
+    with transaction.atomic():
+        batch = claim_batch(batch_size)
+        if batch:
+            # A no-op when already open; if the relay is down the batch stays queued untouched.
+            connection.open()
+        for outgoing in batch:
+            message = EmailMessage(
+                outgoing.subject, outgoing.body, outgoing.from_email,
+                [outgoing.to_email], connection=connection
+            )
+            outgoing.attempts += 1
+            try:
+                deliver(connection, message)
+            except Exception as e:
+                failed += 1
+                outgoing.last_error = str(e)
+                outgoing.next_attempt_at = timezone.now() + datetime.timedelta(
+                    seconds=EMAIL_QUEUE_RETRY_BASE * 2 ** (outgoing.attempts - 1)
+                )
+                outgoing.status = outgoing.attempts < EMAIL_QUEUE_MAX_ATTEMPTS
+            else:
+                sent += 1
+                outgoing.sent_at = timezone.now()
+            outgoing.save()
+    return sent, failed
+
+
+def drain_queue(batch_size=EMAIL_QUEUE_BATCH_SIZE, connection=None):
+    """Send every due message, reusing one connection across batches.
+
+    The connection is only opened once there is something to send.
+    """
+    connection = connection or get_connection()
+    total_sent = total_failed = 0
+    try:
+        while True:
+            sent, failed = send_batch(connection, batch_size)
+            total_sent += sent
+            total_failed += failed
+            if sent + failed < batch_size:
+                return total_sent, total_failed
+    finally:
+        connection.close()
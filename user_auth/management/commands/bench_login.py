@@ -0,0 +1,45 @@
+import time
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare single-core login throughput of the old double-hash path and the email backend."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def double_hash_login(self, email, password):
+        user = User.objects.filter(email=email).first()
+        if user is not None and user.check_password(password):
+            return authenticate(username=user.username, password=password)
+
+    def single_hash_login(self, email, password):
+        return authenticate(email=email, password=password)
+
+    def measure(self, login, iterations, email, password):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            assert login(email, password) is not None
+        return iterations / (time.perf_counter() - start)
+
+    def handle(self, *args, **options):
+        email, password = 'bench-login@example.invalid', 'Bench@1234'
+        iterations = options['iterations']
+        try:
+            with transaction.atomic():
+                User.objects.create_user(username=email, email=email, password=password)
+                before = self.measure(self.double_hash_login, iterations, email, password)
+                after = self.measure(self.single_hash_login, iterations, email, password)
+                raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write(f"double hash (check_password + authenticate): {before:.1f} logins/s/core")
+        self.stdout.write(f"single hash (EmailBackend):                  {after:.1f} logins/s/core")
+        self.stdout.write(f"speedup: {after / before:.2f}x")
@@ -0,0 +1,30 @@
+import time
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from user_auth.mail import EMAIL_QUEUE_BATCH_SIZE, drain_queue
+
+
+class Command(BaseCommand):
+    help = "Send queued emails in batches over one reused mail connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit.")
+        parser.add_argument('--batch-size', type=int, default=EMAIL_QUEUE_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=5, help="Seconds between polls.")
+
+    def handle(self, *args, **options):
+        connection = get_connection()
+        while True:
+            close_old_connections()
+            try:
+                sent, failed = drain_queue(options['batch_size'], connection)
+            except Exception as e:
+                # Mail server unreachable; the messages stay queued for the next poll.
+                self.stderr.write(f"Mail connection failed: {e}")
+                sent = failed = 0
+            if sent or failed or options['once']:
+                self.stdout.write(f"Sent {sent} email(s), {failed} failed.")
+            if options['once']:
+                return
+            time.sleep(options['interval'])
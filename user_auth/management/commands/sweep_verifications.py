@@ -0,0 +1,45 @@
+import json
+import time
+import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from user_auth.models import Verification
+
+
+class Command(BaseCommand):
+    help = "Delete (optionally archiving first) verification codes older than the retention age, in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'VERIFICATION_SWEEP_BATCH_SIZE', 1000))
+        parser.add_argument('--retention-hours', type=float, default=getattr(settings, 'VERIFICATION_RETENTION_HOURS', 24 * 7))
+        parser.add_argument('--sleep', type=float, default=0, help="Seconds to pause between batches.")
+        parser.add_argument('--archive', help="Append swept rows as JSON lines to this file before deleting.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(hours=options['retention_hours'])
+        # Codes only live 120 seconds, so anything past retention is either spent
+        # or was verified long enough ago that registration has had its chance.
+        stale = Verification._base_manager.filter(created_at__lt=cutoff).order_by('created_at', 'id')
+        archive = open(options['archive'], 'a') if options['archive'] else None
+        swept = 0
+        try:
+            while True:
+                if archive:
+                    rows = list(stale.values()[:options['batch_size']])
+                    ids = [row['id'] for row in rows]
+                    for row in rows:
+                        archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+                    archive.flush()
+                else:
+                    ids = list(stale.values_list('id', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                swept += Verification._base_manager.filter(id__in=ids).delete()[0]
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+        finally:
+            if archive:
+                archive.close()
+        self.stdout.write(f"Swept {swept} verification row(s) older than {cutoff.isoformat()}.")
@@ -0,0 +1,40 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.functional import SimpleLazyObject
+from .roles import get_user_role
+
+
+def _user_with_role(user):
+    if user.is_authenticated:
+        get_user_role(user)
+    return user
+
+
+class RoleMiddleware:
+    """Attach the cached role to ``request.user`` as ``request.user.role``.
+
+    Must come after ``AuthenticationMiddleware``. The user stays lazy, so
+    endpoints that never touch ``request.user`` pay nothing.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.attach_role(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # Async views resolve the role themselves via aget_user_role().
+        self.attach_role(request)
+        return await self.get_response(request)
+
+    def attach_role(self, request):
+        user = request.user
+        request.user = SimpleLazyObject(lambda: _user_with_role(user))
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_auth', '0004_outgoing_email'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='verification',
+            index=models.Index(fields=['email', 'is_expired', 'id'], name='verification_email_expired_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='verification',
+            index=models.Index(fields=['email', 'is_verified', 'is_expired', 'id'], name='verification_email_verif_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='verification',
+            index=models.Index(fields=['created_at', 'id'], name='verification_created_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class DeletedManager(models.Manager):
     def get_queryset(self):
@@ -30,4 +31,29 @@ class Verification(BaseModel):
     code = models.IntegerField(null=True)
     is_verified = models.BooleanField(default=False)
     is_expired = models.BooleanField(default=False)
-    email = models.CharField(max_length=100)
\ No newline at end of file
+    email = models.CharField(max_length=100)
+
+    class Meta:
+        indexes = [
+            # verify(): filter(email=..., is_expired=False).last()
+            models.Index(fields=['email', 'is_expired', 'id'], name='verification_email_expired_idx'),
+            # user_registration(): filter(email=..., is_verified=True, is_expired=True).last()
+            models.Index(fields=['email', 'is_verified', 'is_expired', 'id'], name='verification_email_verif_idx'),
+            # sweep_verifications: oldest rows first
+            models.Index(fields=['created_at', 'id'], name='verification_created_idx'),
+        ]
+
+class OutgoingEmail(BaseModel):
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, null=True, blank=True)
+    to_email = models.CharField(max_length=254)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sent_at', 'next_attempt_at'], name='user_auth_email_pending_idx'),
+        ]
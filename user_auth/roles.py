@@ -0,0 +1,93 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from .models import Role
+
+
+ROLE_CACHE_TIMEOUT = getattr(settings, 'ROLE_CACHE_TIMEOUT', 300)
+USER_CACHE_TIMEOUT = getattr(settings, 'USER_CACHE_TIMEOUT', 300)
+_MISSING = object()
+
+
+def role_cache_key(user_id):
+    return f'user_auth:role:{user_id}'
+
+
+def user_cache_key(user_id):
+    return f'user_auth:user:{user_id}'
+
+
+def get_user_role(user):
+    """Return the role name for ``user``, or None if it has no active role.
+
+    Looks at the value attached to ``request.user`` by ``RoleMiddleware``
+    first, then the Django cache, and only queries ``Role`` on a miss.
+    """
+    if user is None or not user.is_authenticated:
+        return None
+    role = getattr(user, 'role', _MISSING)
+    if role is not _MISSING:
+        return role
+    key = role_cache_key(user.id)
+    role = cache.get(key, _MISSING)
+    if role is _MISSING:
+        role_obj = Role.objects.filter(user=user).last()
+        role = role_obj.role if role_obj else None
+        cache.set(key, role, ROLE_CACHE_TIMEOUT)
+    user.role = role
+    return role
+
+
+async def aget_user_role(user):
+    """Async ``get_user_role`` for native async views."""
+    if user is None or not user.is_authenticated:
+        return None
+    role = getattr(user, 'role', _MISSING)
+    if role is not _MISSING:
+        return role
+    key = role_cache_key(user.id)
+    role = await cache.aget(key, _MISSING)
+    if role is _MISSING:
+        role_obj = await Role.objects.filter(user=user).alast()
+        role = role_obj.role if role_obj else None
+        await cache.aset(key, role, ROLE_CACHE_TIMEOUT)
+    user.role = role
+    return role
+
+
+def get_cached_user(user_id):
+    """Return the User with ``user_id`` and its role attached as ``user.role``.
+
+    Both come from one cache entry, so an authenticated request with a warm
+    cache runs no ``auth_user`` or ``Role`` query. Returns None if the user
+    does not exist.
+    """
+    key = user_cache_key(user_id)
+    cached = cache.get(key)
+    if cached is not None:
+        user, user.role = cached
+        return user
+    user = User.objects.filter(pk=user_id).first()
+    if user is None:
+        return None
+    cache.set(key, (user, get_user_role(user)), USER_CACHE_TIMEOUT)
+    return user
+
+
+async def aget_cached_user(user_id):
+    """Async ``get_cached_user`` for native async views."""
+    key = user_cache_key(user_id)
+    cached = await cache.aget(key)
+    if cached is not None:
+        user, user.role = cached
+        return user
+    user = await User.objects.filter(pk=user_id).afirst()
+    if user is None:
+        return None
+    await cache.aset(key, (user, await aget_user_role(user)), USER_CACHE_TIMEOUT)
+    return user
+
+
+def invalidate_user_role(user_id):
+    if user_id is not None:
+        cache.delete_many([role_cache_key(user_id), user_cache_key(user_id)])
@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Role
+from .roles import invalidate_user_role
+
+
+# Soft deletes go through save() with status=False, so post_save covers them.
+# QuerySet.update() bypasses signals; call invalidate_user_role() yourself there.
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def role_changed(sender, instance, **kwargs):
+    invalidate_user_role(instance.user_id)
+
+
+# Password changes, deactivation and last_login updates all save the User.
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    invalidate_user_role(instance.pk)
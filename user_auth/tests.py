@@ -1,9 +1,29 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, AsyncClient, AsyncRequestFactory, override_settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
 from django.contrib.auth.models import User
-from django.urls import reverse
-import json
-from .models import Verification, Role
+from django.contrib.sessions.backends.db import SessionStore
+from django.core import mail
+from django.core.management import call_command
+from django.urls import reverse, path
+from django.utils import timezone
 from unittest.mock import patch
+import datetime
+import io
+import json
+import os
+import smtplib
+import tempfile
+from ezshare.query_budget import QueryBudgetTestMixin, budget_for
+from user_auth import urls
+from . import views
+from .mail import queue_email, drain_queue
+from .models import Verification, Role, OutgoingEmail
+from .views import alogin_view
+
+
+urlpatterns = [
+    path('api/login_view/', views.alogin_view, name='login_view'),
+]
 
 
 class UserAuthTestCase(TestCase):
@@ -31,11 +51,8 @@ class UserAuthTestCase(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn('First verify your email', response.json()['message'])
 
-    @patch('user_auth.views.get_connection')
-    def test_email_verification_flow(self, mock_connection):
+    def test_email_verification_flow(self):
         """Test complete email verification process"""
-        mock_connection.return_value = None
-        
         data = {'email': 'test@example.com'}
         response = self.client.post(
             self.verify_url,
@@ -43,6 +60,7 @@ class UserAuthTestCase(TestCase):
             content_type='application/json'
         )
         self.assertEqual(response.status_code, 200)
+        self.assertTrue(OutgoingEmail.objects.filter(to_email='test@example.com').exists())
         
         verification = Verification.objects.filter(email='test@example.com').first()
         data = {'email': 'test@example.com', 'code': verification.code}
@@ -132,3 +150,173 @@ class UserAuthTestCase(TestCase):
         
         self.assertEqual(response.status_code, 200)
         self.assertIn('Logout successful', response.json()['message'])
+
+    def test_verify_queues_email_without_sending(self):
+        """Test that verify only queues the email and the worker delivers it"""
+        response = self.client.post(
+            self.verify_url,
+            data=json.dumps({'email': 'test@example.com'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command('send_queued_email', '--once', stdout=io.StringIO())
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['test@example.com'])
+        code = Verification.objects.get(email='test@example.com').code
+        self.assertIn(str(code), mail.outbox[0].body)
+        self.assertIsNotNone(OutgoingEmail.objects.get().sent_at)
+
+    def test_send_queued_email_retries_with_backoff(self):
+        """Test that a failed send is rescheduled and given up after max attempts"""
+        outgoing = queue_email('Subject', 'Body', 'test@example.com')
+
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('relay down')):
+            self.assertEqual(drain_queue(), (0, 1))
+        outgoing.refresh_from_db()
+        self.assertEqual(outgoing.attempts, 1)
+        self.assertIn('relay down', outgoing.last_error)
+        self.assertGreater(outgoing.next_attempt_at, outgoing.created_at)
+        self.assertEqual(drain_queue(), (0, 0))
+
+        with patch('user_auth.mail.EMAIL_QUEUE_MAX_ATTEMPTS', 2), \
+                patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('relay down')):
+            OutgoingEmail.objects.update(next_attempt_at=outgoing.created_at)
+            drain_queue()
+        self.assertFalse(OutgoingEmail.objects.exists())
+
+    def test_send_queued_email_connects_only_when_due(self):
+        """Test an empty queue never opens a mail connection"""
+        with patch('django.core.mail.backends.locmem.EmailBackend.open') as open_connection:
+            self.assertEqual(drain_queue(), (0, 0))
+            open_connection.assert_not_called()
+
+            queue_email('Subject', 'Body', 'test@example.com')
+            self.assertEqual(drain_queue(), (1, 0))
+            open_connection.assert_called_once()
+
+    def test_send_queued_email_reconnects_after_disconnect(self):
+        """Test a dropped connection is reopened instead of failing the rest of the batch"""
+        for i in range(3):
+            queue_email('Subject', 'Body', f'user{i}@example.com')
+
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                   side_effect=[smtplib.SMTPServerDisconnected('gone'), 1, 1, 1]), \
+                patch('django.core.mail.backends.locmem.EmailBackend.close') as close:
+            self.assertEqual(drain_queue(), (3, 0))
+
+        self.assertEqual(close.call_count, 2)
+        self.assertEqual(OutgoingEmail.objects.filter(attempts=1, sent_at__isnull=False).count(), 3)
+
+    def test_login_hashes_password_once(self):
+        """Test that a successful login runs the password hasher exactly once"""
+        User.objects.create_user(username='test@example.com', email='test@example.com', password='Test@1234')
+
+        with patch.object(PBKDF2PasswordHasher, 'verify', autospec=True, side_effect=PBKDF2PasswordHasher.verify) as verify:
+            response = self.client.post(
+                self.login_url,
+                data=json.dumps({'email': 'test@example.com', 'password': 'Test@1234'}),
+                content_type='application/json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(verify.call_count, 1)
+
+    def test_sweep_verifications_in_batches(self):
+        """Test that old verification rows are archived and deleted in batches"""
+        old = timezone.now() - datetime.timedelta(days=30)
+        for i in range(5):
+            Verification.objects.create(email=f'old{i}@example.com', code=1234, is_expired=True)
+        Verification.objects.update(created_at=old)
+        fresh = Verification.objects.create(email='new@example.com', code=1234)
+        archive = os.path.join(tempfile.mkdtemp(), 'verifications.jsonl')
+
+        out = io.StringIO()
+        call_command('sweep_verifications', '--batch-size', '2', '--archive', archive, stdout=out)
+
+        self.assertEqual(list(Verification.objects.values_list('id', flat=True)), [fresh.id])
+        self.assertIn('Swept 5', out.getvalue())
+        with open(archive) as f:
+            self.assertEqual(len(f.readlines()), 5)
+
+
+class AsyncLoginTestCase(TransactionTestCase):
+    async def _login(self, password):
+        request = AsyncRequestFactory().post(
+            '/api/login_view/',
+            data=json.dumps({'email': 'test@example.com', 'password': password}),
+            content_type='application/json'
+        )
+        request.session = SessionStore()
+        return await alogin_view(request), request
+
+    async def test_async_login(self):
+        """Test the async login view hashes in the pool and logs the user in"""
+        user = await User.objects.acreate(username='test@example.com', email='test@example.com')
+        user.set_password('Test@1234')
+        await user.asave()
+
+        response, request = await self._login('Test@1234')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(request.session['_auth_user_id'], str(user.pk))
+
+        response, _ = await self._login('WrongPassword')
+        self.assertEqual(response.status_code, 403)
+
+
+class QueryBudgetTestCase(QueryBudgetTestMixin, TestCase):
+    """Every user_auth view stays within its declared query budget."""
+
+    def setUp(self):
+        self.client = Client()
+        # A realistic backlog of codes for other addresses.
+        Verification.objects.bulk_create([
+            Verification(email=f'user{i}@example.com', code='1234', is_expired=i % 2 == 0, is_verified=i % 4 == 0)
+            for i in range(500)
+        ])
+        User.objects.bulk_create([
+            User(username=f'user{i}@example.com', email=f'user{i}@example.com') for i in range(200)
+        ])
+        self.user = User.objects.create_user(username='test@example.com', email='test@example.com', password='Test@1234')
+        Role.objects.create(user=self.user, role='Client')
+
+    def post_json(self, path, data):
+        return self.client.post(path, json.dumps(data), content_type='application/json')
+
+    def test_every_view_declares_a_budget(self):
+        """Test every routed user_auth view declares a query budget"""
+        for pattern in urls.urlpatterns + urlpatterns:
+            self.assertIsNotNone(budget_for(pattern.callback), pattern.name)
+
+    def test_registration_views_within_budget(self):
+        """Test sending a code, verifying it and registering stay within budget"""
+        self.assertWithinQueryBudget(self.post_json, '/api/verify/', {'email': 'new@example.com'})
+        code = Verification.objects.filter(email='new@example.com').last().code
+        response = self.assertWithinQueryBudget(self.post_json, '/api/verify/', {'email': 'new@example.com', 'code': code})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.assertWithinQueryBudget(self.post_json, '/api/user_registration/', {
+            'email': 'new@example.com', 'password': 'Test@1234', 'role': 'Ops', 'name': 'New User'
+        })
+        self.assertEqual(response.status_code, 200)
+
+    def test_login_views_within_budget(self):
+        """Test login and logout stay within budget"""
+        response = self.assertWithinQueryBudget(
+            self.post_json, '/api/login_view/', {'email': 'test@example.com', 'password': 'Test@1234'}
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.assertWithinQueryBudget(self.client.get, '/api/logout_view/')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(ROOT_URLCONF='user_auth.tests')
+    async def test_async_login_within_budget(self):
+        """Test the async login view stays within budget"""
+        client = AsyncClient()
+        response = await self.aassertWithinQueryBudget(
+            client.post, '/api/login_view/',
+            json.dumps({'email': 'test@example.com', 'password': 'Test@1234'}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
@@ -5,7 +5,7 @@ from django.conf import settings
 
 urlpatterns = [
     path('user_registration/', views.user_registration, name='user_registration'),
-    path('login_view/', views.login_view, name='login_view'),
+    path('login_view/', views.alogin_view if settings.ASYNC_VIEWS else views.login_view, name='login_view'),
     path('logout_view/', views.logout_view, name='logout_view'),
     path('verify/', views.verify, name='verify'),
     
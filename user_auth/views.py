@@ -1,4 +1,4 @@
-from django.contrib.auth import login, authenticate, logout
+from django.contrib.auth import login, authenticate, logout, alogin
 from django.http import JsonResponse, HttpResponse
 import json
 from django.contrib.auth.models import User
@@ -8,9 +8,11 @@ import re
 from django.core.mail import send_mail
 import random
 import datetime
-from django.conf import settings
-from django.core.mail import EmailMessage, get_connection
+from .mail import queue_email
+from .hashing import acheck_password
+from ezshare.query_budget import query_budget
 
+@query_budget(4)
 def user_registration(request):
     if request.method == 'POST':
         data = json.loads(request.body)
@@ -44,24 +46,39 @@ def user_registration(request):
         return JsonResponse({'message': 'Registration successful!'}, status=200)
     return JsonResponse({"message": "Invalid request method."}, status=405)
 
+@query_budget(9)
 def login_view(request):
     if request.method == 'POST':
         data = json.loads(request.body)
         email = data.get('email')
         password = data.get('password')
-        user = User.objects.filter(email=email).first()
-        if user is not None and user.check_password(password):
-            auth_user = authenticate(request, username=user.username, password=password)
-            if auth_user is not None:
-                login(request, auth_user)
-                return JsonResponse({'message': 'Login successful'})
-            else:
-                return JsonResponse({'message': 'No user exists.'}, status=403)
+        user = authenticate(request, email=email, password=password)
+        if user is not None:
+            login(request, user)
+            return JsonResponse({'message': 'Login successful'})
+        else:
+            return JsonResponse({'message': 'Incorrect credentials'}, status=403)
+    else:
+        return JsonResponse({'message': 'Invalid method'}, status=405)
+
+@query_budget(9)
+async def alogin_view(request):
+    if request.method == 'POST':
+        data = json.loads(request.body)
+        email = data.get('email')
+        password = data.get('password')
+        user = await User.objects.filter(email=email).afirst() if email else None
+        valid = await acheck_password(password or '', user.password if user else None)
+        if valid and user.is_active:
+            user.backend = 'user_auth.backends.EmailBackend'
+            await alogin(request, user)
+            return JsonResponse({'message': 'Login successful'})
         else:
             return JsonResponse({'message': 'Incorrect credentials'}, status=403)
     else:
         return JsonResponse({'message': 'Invalid method'}, status=405)
 
+@query_budget(5)
 def logout_view(request):
     if request.method == 'GET':
         if request.user.is_authenticated:
@@ -74,6 +91,7 @@ def logout_view(request):
     else:
         return JsonResponse({'message': 'Request not valid'}, status=405)
 
+@query_budget(2)
 def verify(request):
     if request.method == 'POST':
         data = json.loads(request.body)
@@ -85,27 +103,8 @@ def verify(request):
                 code=randomcode,
                 email=email
             )
-            try:
-                connection = get_connection(
-                    host=settings.EMAIL_HOST,
-                    port=settings.EMAIL_PORT,
-                    username=settings.EMAIL_HOST_USER,
-                    password=settings.EMAIL_HOST_PASSWORD,
-                    use_tls=settings.EMAIL_USE_TLS
-                )
-                subject = 'Verification Code'
-                message = f'Your verification code is: {randomcode}'
-                email_msg = EmailMessage(
-                    subject,
-                    message,
-                    settings.EMAIL_HOST_USER,
-                    [email],
-                    connection=connection
-                )
-                email_msg.send()
-                return JsonResponse({"message": "Sent verification code to email."}, status=200)
-            except Exception as e:
-                return JsonResponse({"error": f"Failed to send email: {str(e)}"}, status=500)
+            queue_email('Verification Code', f'Your verification code is: {randomcode}', email)
+            return JsonResponse({"message": "Sent verification code to email."}, status=200)
         elif code and email:
             check = Verification.objects.filter(email=email, is_expired=False).last()
             if check: